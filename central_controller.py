@@ -1,145 +1,357 @@
 import sys
+import time
 import signal
+import argparse
+from concurrent.futures import wait
 
 from services.service_manager import ServiceManager
 from command_processor import CommandProcessor, CommandProcessingError
+from command_pipeline import CommandPipeline
 from services.message_service import MessageService
-from interface import InterfaceManager
+from metrics import MetricsServer, registry as metrics_registry
 
 # This file is the central controller for the project, this should run the entire program
 
-# Load core objects
-service_manager = ServiceManager()
+# How many commands can be in each stage of the command pipeline at once, unless configured: many
+#   HomeAssistant requests since they mostly wait. The SLM stage's default is the SLM's
+#   batch_capacity, concurrent SLM commands are decoded together in one batched generate call per
+#   SLM process, so that's how many can decode at once without competing for the CPU
+DEFAULT_STAGE_LIMITS = {"ha": 16}
 
-# Load services
-service_manager.load_config()
-service_manager.load_services()
+# Seconds each message spends in each stage: queue_wait, parse, slm_generate, ha_request and
+#   reply_send, by message service and processed_type
+stage_seconds = metrics_registry.histogram("hah_stage_seconds", "Seconds a message spent in each stage of handling it.")
+messages_total = metrics_registry.counter("hah_messages_total", "Messages handled, by message service and processed_type.")
 
-ha_controller = None
-if('home_assistant' in service_manager.services.keys()):
-    ha_controller = service_manager.services["home_assistant"]
+class PrintRedirector:
+    def __init__(self, orig_out, interface):
+        self.orig_out = orig_out
+        self.interface = interface
 
-if(ha_controller is None):
-    print("WARNING: HomeAssistant hasn't loaded, no requests will be made.")
+    def write(self, message):
+        self.interface.console_buffer.write(message)
+        self.orig_out.write(message)
 
-if('telegram' in service_manager.services.keys()):
-    print("WARNING: Telegram isn't supported, expect broken behavior.")
+    def flush(self):
+        pass
 
-if(len(service_manager.get_message_services()) == 0):
-    service_manager.load_service("command_line")
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description="HomeAssistantHub, control HomeAssistant through message services.")
+    parser.add_argument("--headless", action="store_true", help="Run without the interface window, e.g. on a host without a display.")
+    return parser.parse_args(args)
 
-cmd_processor = CommandProcessor(ha_controller)
+def main():
+    args = parse_args()
 
-# Create and load custom commands
-def stop_running():
-    global running
-    running = False
+    # Load core objects
+    service_manager = ServiceManager()
 
-    return {"msg": "Exiting HomeAssistantHub."}
+    # Load services
+    service_manager.load_config()
+    service_manager.load_services()
 
-def get_entity_list():
-    json = ha_controller.get_all_entities()
-    entity_ids = [item["entity_id"] for item in json]
+    ha_controller = None
+    if('home_assistant' in service_manager.services.keys()):
+        ha_controller = service_manager.services["home_assistant"]
 
-    return {"msg": entity_ids}
+    if(ha_controller is None):
+        print("WARNING: HomeAssistant hasn't loaded, no requests will be made.")
 
-cmd_processor.add_custom_command("exit", stop_running)
-cmd_processor.add_custom_command("listdevices", get_entity_list)
+    if('telegram' in service_manager.services.keys()):
+        print("WARNING: Telegram isn't supported, expect broken behavior.")
 
-# Start
-# Load interface
-interface = InterfaceManager(service_manager, cmd_processor)
+    if(len(service_manager.get_message_services()) == 0):
+        service_manager.load_service("command_line")
 
-class PrintRedirector:
-    def __init__(self, orig_out, interface):
-        self.orig_out = orig_out
-        self.interface = interface
+    # Optional command processor settings, e.g. {"slm_workers": 1, "slm_options": {"profile": "fast"}}
+    cmd_processor = CommandProcessor(ha_controller, **service_manager.config.get("command_processor", {}))
 
-    def write(self, message):
-        self.interface.console_queue.append(message)
-        self.orig_out.write(message)
+    running = True
 
-    def flush(self):
-        pass
+    # Create and load custom commands
+    def stop_running():
+        nonlocal running
+        running = False
+        # The main loop sleeps until there's a message, wake it to notice
+        service_manager.dispatcher.wake()
 
-sys.stdout = PrintRedirector(sys.stdout, interface)
+        return {"msg": "Exiting HomeAssistantHub."}
 
-# Start program
-print("Starting...")
+    def get_entity_list():
+        json = ha_controller.get_all_entities()
+        entity_ids = [item["entity_id"] for item in json]
 
-service_manager.start_services()
+        return {"msg": entity_ids}
 
-running = True
+    cmd_processor.add_custom_command("exit", stop_running)
+    cmd_processor.add_custom_command("listdevices", get_entity_list)
 
-# Establish signal handler for Ctrl+C support
-def signal_handler(sig, frame):
-    stop_running()
+    # Start
+    # Load interface, it runs on its own thread. Headless, tkinter is never imported and
+    #   output only goes to the terminal
+    interface = None
+    if(not args.headless):
+        from interface import InterfaceManager
 
-signal.signal(signal.SIGINT, signal_handler)
+        interface = InterfaceManager(service_manager, cmd_processor)
+        try:
+            interface.start()
+        except Exception as e:
+            print(f"ERROR: Failed to start the interface, run with --headless on hosts without a display: {e}")
+            cmd_processor.stop()
+            return
 
-try:
-    print("Running...")
-    while running:
-        interface.update()
+        sys.stdout = PrintRedirector(sys.stdout, interface)
 
-        # Loop through each message service and check if its queue has pending messages for us to
-        #   handle.
-        for message_service in service_manager.get_message_services():
-            queue = message_service.message_queue
+    # Start program
+    print("Starting...")
 
-            # If there are no messages in queue, continue
-            if(len(queue) == 0):
-                continue
+    service_manager.start_services()
 
-            # Get the first available message
-            message_in = queue.pop(0).lower()
+    # Establish signal handler for Ctrl+C support
+    def signal_handler(sig, frame):
+        stop_running()
 
-            # Try to process command, if we can't handle the error that it throws.
-            process_result = None
-            try:
-                process_result = cmd_processor.process_command(message_in)
-            except CommandProcessingError as e:
-                message_service.send_message(f"Failed to process command \"{message_in}\": {e.message}", message_in)
-                print(e)
-                continue
+    signal.signal(signal.SIGINT, signal_handler)
+
+    def handle_process_result(message_service, message_in, process_result, envelope):
+        if(process_result["processed_type"] == "multi_cmd"):
+            handle_multi_result(message_service, message_in, process_result, envelope)
 
-            if(process_result["processed_type"] == "ha_cmd"):
+        elif(process_result["processed_type"] == "ha_cmd"):
 
-                action_label = process_result["action_label"]
-                entity_id = process_result["entity_id"]
+            action_label = process_result["action_label"]
+            entity_id = process_result["entity_id"]
+            # Group commands target a list of entities, made with a single request per domain
+            entity_label = entity_id if isinstance(entity_id, str) else ", ".join(entity_id)
 
-                # Debug log message
-                print(f"Processed HomeAssistant command {'with SLM' if process_result['used_slm'] else 'manually'} as action label {action_label} and entity id {entity_id}")
+            # Debug log message
+            print(f"Processed HomeAssistant command {'with SLM' if process_result['used_slm'] else 'manually'} as action label {action_label} and entity id {entity_label}")
 
-                # Make the request for HomeAssistant
-                request_status, request_response_text = True, None
-                if(ha_controller is not None):
-                    try:
+            # Make the request for HomeAssistant
+            request_status, request_response_text = True, None
+            if(ha_controller is not None):
+                try:
+                    with pipeline.stage("ha"), stage_timer("ha_request", message_service, "ha_cmd"):
                         request_status, request_response_text = ha_controller.make_request(action_label, entity_id)
-                    except Exception as e:
-                        request_status = False
-                
-                print(f"{'Successfully made' if request_status else 'Failed to make'} request to HomeAssistant. Response: {request_response_text}")
+                except Exception as e:
+                    request_status = False
+
+            print(f"{'Successfully made' if request_status else 'Failed to make'} request to HomeAssistant. Response: {request_response_text}")
 
-                # Output message to user via message_service
-                return_message = None
-                if(request_status):
-                    return_message = f"Recieved \"{message_in}\" and {'the slm' if process_result['used_slm'] else 'manually'} performed {action_label} on {entity_id}"
-                else:
-                    return_message = f"HomeAssistant failed to perform the request: {'No response.' if request_response_text is None else request_response_text}"
+            # Output message to user via message_service
+            return_message = None
+            if(request_status):
+                return_message = f"Recieved \"{message_in}\" and {'the slm' if process_result['used_slm'] else 'manually'} performed {action_label} on {entity_label}"
+            else:
+                return_message = f"HomeAssistant failed to perform the request: {'No response.' if request_response_text is None else request_response_text}"
 
-                message_service.send_message(return_message, message_in)
+            reply(message_service, return_message, envelope, process_result["processed_type"])
 
-            elif(process_result["processed_type"] == "custom_cmd"):
-                
-                message_service.send_message(f"Recieved command \"{process_result['custom_cmd_label']}\"", message_in)
-                cmd_exec = process_result["custom_cmd"]()
-                if("msg" in cmd_exec):
-                    message_service.send_message(cmd_exec["msg"], message_in)
+        elif(process_result["processed_type"] == "ha_query"):
 
-                print(f"Concluded request for custom command \"{process_result['custom_cmd_label']}\"")
+            entity_id = process_result["entity_id"]
 
+            print(f"Processed HomeAssistant query {'with SLM' if process_result['used_slm'] else 'manually'} for entity id {entity_id}")
 
-finally:
-    print("Shutting down...")
-    service_manager.stop_services()
\ No newline at end of file
+            if(ha_controller is None):
+                reply(message_service, f"Can't check {entity_id}, HomeAssistant isn't loaded.", envelope, process_result["processed_type"])
+                return
+
+            # Answered from the state mirror/cache when it's fresh, otherwise fetched from HomeAssistant
+            try:
+                with pipeline.stage("ha"), stage_timer("ha_request", message_service, "ha_query"):
+                    state = ha_controller.get_entity_state(entity_id)
+            except Exception as e:
+                print(f"Failed to get the state of {entity_id} from HomeAssistant: {e}")
+                reply(message_service, f"HomeAssistant failed to get the state of {entity_id}.", envelope, process_result["processed_type"])
+                return
+
+            if(state is None):
+                reply(message_service, f"HomeAssistant doesn't have an entity {entity_id}.", envelope, process_result["processed_type"])
+                return
+
+            name = state.get("attributes", {}).get("friendly_name", entity_id)
+            reply(message_service, f"{name} is {state['state']}", envelope, process_result["processed_type"])
+
+        elif(process_result["processed_type"] == "custom_cmd"):
+
+            reply(message_service, f"Recieved command \"{process_result['custom_cmd_label']}\"", envelope, process_result["processed_type"])
+            cmd_exec = process_result["custom_cmd"]()
+            if("msg" in cmd_exec):
+                reply(message_service, cmd_exec["msg"], envelope, process_result["processed_type"])
+
+            print(f"Concluded request for custom command \"{process_result['custom_cmd_label']}\"")
+
+    def handle_multi_result(message_service, message_in, process_result, envelope):
+        # The HomeAssistant requests of every subcommand are made concurrently, then the user gets
+        #   one reply with each subcommand's outcome
+        commands = process_result["commands"]
+        requests = [None] * len(commands)
+        with pipeline.stage("ha"), stage_timer("ha_request", message_service, "multi_cmd"):
+            for index, command in enumerate(commands):
+                result = command["result"]
+                if(result is None or ha_controller is None):
+                    continue
+                if(result["processed_type"] == "ha_cmd"):
+                    requests[index] = ha_controller.submit(ha_controller.async_make_request(result["action_label"], result["entity_id"]))
+                elif(result["processed_type"] == "ha_query"):
+                    requests[index] = ha_controller.submit(ha_controller.async_get_entity_state(result["entity_id"]))
+            wait([request for request in requests if request is not None])
+
+        lines = []
+        for index, command in enumerate(commands):
+            result, request = command["result"], requests[index]
+            if(result is None):
+                status = f"couldn't process: {command['error']}"
+            elif(result["processed_type"] == "custom_cmd"):
+                cmd_exec = result["custom_cmd"]()
+                status = f"ran {result['custom_cmd_label']}" + (f": {cmd_exec['msg']}" if "msg" in cmd_exec else "")
+            elif(request is None):
+                status = "skipped, HomeAssistant isn't loaded"
+            elif(request.exception() is not None):
+                status = f"failed: {request.exception()}"
+            elif(result["processed_type"] == "ha_query"):
+                state = request.result()
+                status = f"{result['entity_id']} not found" if state is None else f"{state.get('attributes', {}).get('friendly_name', result['entity_id'])} is {state['state']}"
+            else:
+                request_status, request_response_text = request.result()
+                entity_id = result["entity_id"]
+                entity_label = entity_id if isinstance(entity_id, str) else ", ".join(entity_id)
+                status = f"performed {result['action_label']} on {entity_label}" if request_status else f"failed: {request_response_text}"
+            lines.append(f"{index + 1}. \"{command['command']}\" {status}")
+
+        latency = time.perf_counter() - envelope.received_at
+        print(f"Concluded {len(commands)} subcommands of \"{message_in}\" in {latency:.3f}s")
+        reply(message_service, f"Recieved \"{message_in}\" as {len(commands)} commands, done in {latency:.2f}s:\n" + "\n".join(lines), envelope, process_result["processed_type"])
+
+    def stage_timer(stage, message_service, processed_type):
+        return stage_seconds.time(stage=stage, service=service_names.get(message_service, "unknown"), processed_type=processed_type)
+
+    def reply(message_service, message, envelope, processed_type):
+        with stage_timer("reply_send", message_service, processed_type):
+            message_service.send_message(message, envelope)
+
+    def run_command(envelope):
+        # Runs on a command pipeline worker: parse, make the HomeAssistant request(s) and reply
+        message_service = envelope.service
+        message_in = envelope.text.lower()
+        timings = {"queue_wait": time.perf_counter() - envelope.received_at}
+        processed_type = "error"
+
+        # Try to process command, if we can't handle the error that it throws.
+        try:
+            process_result = cmd_processor.process_command_async(message_in).result()
+            processed_type = process_result["processed_type"]
+            timings.update(process_result.get("timings", {}))
+        except CommandProcessingError as e:
+            reply(message_service, f"Failed to process command \"{message_in}\": {e.message}", envelope, "error")
+            print(e)
+            return
+        except Exception as e:
+            reply(message_service, f"Failed to process command \"{message_in}\": {e}", envelope, "error")
+            print(f"ERROR: Unexpected error processing \"{message_in}\": {e}")
+            return
+        finally:
+            service_name = service_names.get(message_service, "unknown")
+            messages_total.inc(service=service_name, processed_type=processed_type)
+            for stage, seconds in timings.items():
+                stage_seconds.observe(seconds, stage=stage, service=service_name, processed_type=processed_type)
+
+        handle_process_result(message_service, message_in, process_result, envelope)
+
+    # Messages are handled concurrently, but each conversation's in order. Cheap commands are
+    #   scheduled ahead of SLM-bound ones. Optionally configured with e.g. {"max_workers": 16,
+    #   "stage_limits": {"slm": 8, "ha": 16}, "class_weights": {"custom": 8, "exact": 4, "slm": 1},
+    #   "service_weights": {"discord": 2}}
+    pipeline_config = service_manager.config.get("command_pipeline", {})
+    slm_batch_capacity = cmd_processor.slm_processor.batch_capacity
+    stage_limits = pipeline_config.get("stage_limits", {**DEFAULT_STAGE_LIMITS, "slm": slm_batch_capacity})
+    if(stage_limits.get("slm", slm_batch_capacity) < slm_batch_capacity):
+        print(f"WARNING: The slm stage limit {stage_limits['slm']} is below the SLM's batch capacity {slm_batch_capacity}, SLM batches can't fill.")
+    pipeline = CommandPipeline(
+        run_command,
+        max_workers=pipeline_config.get("max_workers", 16),
+        stage_limits=stage_limits,
+        class_weights=pipeline_config.get("class_weights"),
+        # SLM-bound jobs past the SLM's limit would only block workers cheap commands could use
+        class_limits={"slm": stage_limits["slm"]} if "slm" in stage_limits else None,
+        source_weights=pipeline_config.get("service_weights")
+    )
+    cmd_processor.slm_stage = pipeline.stage("slm")
+    service_names = {service: name for name, service in service_manager.services.items()}
+
+    def get_latency_report():
+        stats = pipeline.latency_stats()
+        if(len(stats) == 0):
+            return {"msg": "No commands have been handled yet."}
+
+        lines = [
+            f"{priority_class}: {class_stats['count']} commands, mean {class_stats['mean'] * 1000:.0f}ms, p50 {class_stats['p50'] * 1000:.0f}ms, p95 {class_stats['p95'] * 1000:.0f}ms, max {class_stats['max'] * 1000:.0f}ms"
+            for priority_class, class_stats in sorted(stats.items())
+        ]
+        return {"msg": "\n".join(lines)}
+
+    cmd_processor.add_custom_command("latency", get_latency_report)
+
+    def collect_queue_stats(stat):
+        return [
+            ({"service": service_names.get(message_service, "unknown")}, message_service.message_queue.stats()[stat])
+            for message_service in service_manager.get_message_services()
+        ]
+
+    metrics_registry.gauge("hah_message_queue_depth", "Messages waiting in each message service's queue.", lambda: collect_queue_stats("depth"))
+    metrics_registry.gauge("hah_message_queue_high_water", "The most messages that have waited in each message service's queue.", lambda: collect_queue_stats("high_water"))
+    metrics_registry.gauge("hah_message_queue_dropped", "Messages dropped by each full message service queue.", lambda: collect_queue_stats("dropped"))
+    metrics_registry.gauge("hah_message_queue_rejected", "Messages rejected by each full message service queue.", lambda: collect_queue_stats("rejected"))
+
+    # Prometheus metrics endpoint, optionally configured with e.g. {"enabled": true, "host":
+    #   "127.0.0.1", "port": 9464}
+    metrics_config = service_manager.config.get("metrics", {})
+    metrics_server = None
+    if(metrics_config.get("enabled", True)):
+        metrics_server = MetricsServer(metrics_registry, metrics_config.get("host", "127.0.0.1"), metrics_config.get("port", 9464))
+        if(not metrics_server.start()):
+            metrics_server = None
+
+    def dispatch_message(message_service):
+        # Get the first available message, it may have been taken by an earlier notification or
+        #   dropped for a newer one
+        envelope = message_service.message_queue.get()
+        if(envelope is None):
+            return
+
+        # Classified with the cheap parse tiers so deterministic commands don't wait behind SLM ones
+        pipeline.submit(
+            (message_service, envelope.conversation_id), envelope,
+            priority_class=cmd_processor.classify_command(envelope.text),
+            source=service_names.get(message_service)
+        )
+
+    # The main loop sleeps until a message service receives a message or stop_running wakes it
+    dispatcher = service_manager.dispatcher
+
+    try:
+        print("Running...")
+        while running:
+            for kind, payload in dispatcher.wait():
+                if(kind == "message"):
+                    dispatch_message(payload)
+
+                if(not running):
+                    break
+
+    finally:
+        print("Shutting down...")
+        print(get_latency_report()["msg"])
+        pipeline.stop()
+        if(metrics_server is not None):
+            metrics_server.stop()
+        service_manager.stop_services()
+        cmd_processor.stop()
+        if(interface is not None):
+            sys.stdout = sys.stdout.orig_out
+            interface.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+from collections import deque
+
+class _MatcherNode:
+    __slots__ = ("children", "fail", "output", "keyword")
+
+    def __init__(self):
+        self.children = {}
+        self.fail = None
+        # The keyword ending at this node, if any
+        self.keyword = None
+        # The keyword reachable through the failure chain that ends here, used to report overlapping
+        #   matches without walking the whole failure chain on every character
+        self.output = None
+
+class CommandMatcher:
+    """
+    The CommandMatcher is an Aho-Corasick automaton over a set of keywords (action names or entity
+      names). It is built once and updated as keywords are added or removed, then finds every
+      keyword in a command with a single pass over the command text.
+    Keywords only match whole words, "front door lock" isn't found in "front door locked" and "on"
+      isn't found in "front".
+    Keywords are inserted into the trie incrementally, the failure links are only recomputed the
+      next time the matcher is used after a change.
+    """
+
+    def __init__(self, keywords=()):
+        self.root = _MatcherNode()
+        # Keyword -> insertion order, used to break ties between keywords of equal length the same
+        #   way iterating the mapping dictionaries would
+        self.keywords = {}
+        self._order = 0
+        self._dirty = False
+
+        for keyword in keywords:
+            self.add(keyword)
+
+    def __len__(self):
+        return len(self.keywords)
+
+    def __contains__(self, keyword):
+        return keyword in self.keywords
+
+    def add(self, keyword):
+        """
+        Add a keyword to the matcher.
+
+        Parameters:
+        keyword (string): The keyword to be matched
+
+        Returns:
+        void
+        """
+        if(len(keyword) == 0 or keyword in self.keywords):
+            return
+
+        node = self.root
+        for char in keyword:
+            child = node.children.get(char)
+            if(child is None):
+                child = _MatcherNode()
+                node.children[char] = child
+            node = child
+
+        node.keyword = keyword
+        self.keywords[keyword] = self._order
+        self._order += 1
+        self._dirty = True
+
+    def remove(self, keyword):
+        """
+        Remove a keyword from the matcher, pruning trie nodes that are no longer used.
+
+        Parameters:
+        keyword (string): The keyword to be removed
+
+        Returns:
+        bool: True if the keyword was in the matcher
+        """
+        if(keyword not in self.keywords):
+            return False
+
+        # Walk down to the keyword's node, remembering the path so unused nodes can be pruned
+        path = [self.root]
+        for char in keyword:
+            path.append(path[-1].children[char])
+
+        path[-1].keyword = None
+        for depth in range(len(keyword), 0, -1):
+            node = path[depth]
+            if(node.keyword is not None or len(node.children) > 0):
+                break
+            del path[depth - 1].children[keyword[depth - 1]]
+
+        del self.keywords[keyword]
+        self._dirty = True
+        return True
+
+    def clear(self):
+        """
+        Remove every keyword from the matcher.
+        """
+        self.root = _MatcherNode()
+        self.keywords = {}
+        self._dirty = False
+
+    def find_all(self, text):
+        """
+        Find every keyword occurring in the text as whole words, including overlapping ones.
+
+        Parameters:
+        text (string): The text to be scanned
+
+        Returns:
+        list<(int, string)>: (start index, keyword) pairs in the order they end in the text
+        """
+        if(self._dirty):
+            self._build_failure_links()
+
+        matches = []
+        node = self.root
+        for index, char in enumerate(text):
+            while node is not self.root and char not in node.children:
+                node = node.fail
+            node = node.children.get(char, self.root)
+
+            # A match must end before a non-word character
+            if(index + 1 < len(text) and _is_word_char(text[index + 1])):
+                continue
+
+            match_node = node if node.keyword is not None else node.output
+            while match_node is not None:
+                start = index - len(match_node.keyword) + 1
+                # ...and start after one
+                if(start == 0 or not _is_word_char(text[start - 1])):
+                    matches.append((start, match_node.keyword))
+                match_node = match_node.output
+
+        return matches
+
+    def longest_match(self, text, accept=None):
+        """
+        Find the longest keyword in the text. Keywords of the same length are ranked by the order
+          they were added to the matcher.
+
+        Parameters:
+        text (string): The text to be scanned
+        accept (function): Called with each keyword found, only keywords it returns True for can be
+          the longest match. None accepts every keyword
+
+        Returns:
+        string: The longest keyword found, None if no keyword is in the text
+        """
+        best = None
+        for _, keyword in self.find_all(text):
+            if(accept is not None and not accept(keyword)):
+                continue
+            if(best is None or len(keyword) > len(best)
+                or (len(keyword) == len(best) and self.keywords[keyword] < self.keywords[best])):
+                best = keyword
+        return best
+
+    def _build_failure_links(self):
+        """
+        Recompute the failure and output links with a breadth first walk of the trie.
+        """
+        self.root.fail = self.root
+        self.root.output = None
+
+        pending = deque()
+        for child in self.root.children.values():
+            child.fail = self.root
+            child.output = None
+            pending.append(child)
+
+        while len(pending) > 0:
+            node = pending.popleft()
+            for char, child in node.children.items():
+                fail = node.fail
+                while fail is not self.root and char not in fail.children:
+                    fail = fail.fail
+                child.fail = fail.children.get(char, self.root)
+                child.output = child.fail if child.fail.keyword is not None else child.fail.output
+                pending.append(child)
+
+        self._dirty = False
+
+def _is_word_char(char):
+    return char.isalnum() or char == "_"
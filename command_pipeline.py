@@ -0,0 +1,216 @@
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+
+# How often each priority class is picked relative to the others when they all have jobs waiting,
+#   unless configured. Cheap commands go first, SLM-bound ones still make progress
+DEFAULT_CLASS_WEIGHTS = {"custom": 8, "exact": 4, "slm": 1}
+
+# How many latencies per priority class are kept for the latency stats
+LATENCY_WINDOW = 1000
+
+class CommandPipeline:
+    """
+    The CommandPipeline runs the parse -> HomeAssistant request -> reply pipeline of each message
+      on a bounded pool of worker threads, so a slow SLM decode or HomeAssistant timeout only holds
+      up the conversation it belongs to.
+    Jobs of the same conversation (a user/channel) run one at a time in the order they were
+      submitted, jobs of different conversations run concurrently.
+    Each job has a priority class (e.g. "custom", "exact" or "slm"). When workers free up, the
+      classes with jobs waiting are picked by weighted round robin, then within the class each
+      source (message service) is picked by weighted round robin, so one busy service can't starve
+      the others. A class can be limited to a number of running jobs so it can't tie up every worker.
+    Each stage of the pipeline can have its own concurrency limit, see stage.
+    """
+
+    def __init__(self, handler, max_workers=16, stage_limits=None, class_weights=None, class_limits=None, source_weights=None):
+        """
+        Parameters:
+        handler (function): Called as handler(*args) on a worker for each submitted job
+        max_workers (int): The number of worker threads, i.e. the most jobs running at once
+        stage_limits (dict): Stage name -> the most jobs that can be in that stage at once, e.g.
+          {"slm": 2, "ha": 16}. Stages without a limit are only limited by max_workers
+        class_weights (dict): Priority class -> weight, see DEFAULT_CLASS_WEIGHTS. Unknown classes weigh 1
+        class_limits (dict): Priority class -> the most jobs of that class running at once
+        source_weights (dict): Source -> weight within each class. Unknown sources weigh 1
+        """
+        self.handler = handler
+        self.class_weights = DEFAULT_CLASS_WEIGHTS if class_weights is None else class_weights
+        self.class_limits = {} if class_limits is None else class_limits
+        self.source_weights = {} if source_weights is None else source_weights
+
+        stage_limits = {} if stage_limits is None else stage_limits
+        self._stages = {name: threading.BoundedSemaphore(limit) for name, limit in stage_limits.items()}
+
+        # conversation -> jobs waiting behind the one queued or running, a conversation is only
+        #   present while one of its jobs is queued or running
+        self._conversations = {}
+        # priority class -> source -> jobs ready to run, a job is (conversation, priority_class,
+        #   source, args, submitted_at)
+        self._ready = {}
+        self._running = {}
+        # Smooth weighted round robin state, see _pick_weighted
+        self._class_credit = {}
+        self._source_credit = {}
+        self._latencies = {}
+
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._workers = []
+        for index in range(max_workers):
+            worker = threading.Thread(target=self._work, name=f"command-pipeline-{index}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, conversation, *args, priority_class="exact", source=None):
+        """
+        Queue a job, it runs once every earlier job of its conversation has finished.
+
+        Parameters:
+        conversation (hashable): Identifies the user/channel the job belongs to
+        args (list): The handler's arguments
+        priority_class (string): The job's priority class, see class_weights
+        source (hashable): Where the job came from, e.g. the message service's name
+
+        Returns:
+        void
+        """
+        job = (conversation, priority_class, source, args, time.perf_counter())
+        with self._condition:
+            if(self._stopped):
+                return
+            if(conversation in self._conversations):
+                self._conversations[conversation].append(job)
+                return
+            self._conversations[conversation] = deque()
+            self._make_ready(job)
+
+    def stage(self, name):
+        """
+        Get the context manager a job enters for a stage of the pipeline, it blocks while the
+          stage is at its limit.
+
+        Parameters:
+        name (string): The stage name, e.g. "slm" or "ha"
+
+        Returns:
+        context manager: The stage's semaphore, or a no-op if the stage isn't limited
+        """
+        return self._stages.get(name, nullcontext())
+
+    def latency_stats(self):
+        """
+        Get the latency from submit to finish of the recent jobs of each priority class.
+
+        Returns:
+        dict: Priority class -> {"count", "mean", "p50", "p95", "max"} in seconds, count is the
+          number of jobs the stats are over
+        """
+        with self._condition:
+            latencies = {priority_class: sorted(window) for priority_class, window in self._latencies.items()}
+
+        stats = {}
+        for priority_class, window in latencies.items():
+            stats[priority_class] = {
+                "count": len(window),
+                "mean": sum(window) / len(window),
+                "p50": window[len(window) // 2],
+                "p95": window[min(len(window) - 1, int(len(window) * 0.95))],
+                "max": window[-1]
+            }
+        return stats
+
+    def stop(self):
+        """
+        Stop the workers, jobs that haven't started are dropped.
+        """
+        with self._condition:
+            self._stopped = True
+            self._conversations.clear()
+            self._ready.clear()
+            self._condition.notify_all()
+
+    def _make_ready(self, job):
+        # Must be called holding _condition
+        _, priority_class, source, _, _ = job
+        self._ready.setdefault(priority_class, {}).setdefault(source, deque()).append(job)
+        self._condition.notify()
+
+    def _next_job(self):
+        # Must be called holding _condition. Takes the next job to run, None if none can run
+        classes = [
+            priority_class for priority_class, sources in self._ready.items()
+            if(len(sources) > 0 and self._running.get(priority_class, 0) < self.class_limits.get(priority_class, float("inf")))
+        ]
+        if(len(classes) == 0):
+            return None
+        priority_class = _pick_weighted(classes, self.class_weights, self._class_credit)
+
+        sources = self._ready[priority_class]
+        source_credit = self._source_credit.setdefault(priority_class, {})
+        source = _pick_weighted(list(sources.keys()), self.source_weights, source_credit)
+
+        job = sources[source].popleft()
+        if(len(sources[source]) == 0):
+            del sources[source]
+            source_credit.pop(source, None)
+        if(len(sources) == 0):
+            self._class_credit.pop(priority_class, None)
+        return job
+
+    def _work(self):
+        while True:
+            with self._condition:
+                job = self._next_job()
+                while job is None:
+                    if(self._stopped):
+                        return
+                    self._condition.wait()
+                    job = self._next_job()
+                conversation, priority_class, source, args, submitted_at = job
+                self._running[priority_class] = self._running.get(priority_class, 0) + 1
+
+            try:
+                self.handler(*args)
+            except Exception as e:
+                print(f"ERROR: Command pipeline job failed: {e}")
+
+            with self._condition:
+                self._running[priority_class] -= 1
+                self._latencies.setdefault(priority_class, deque(maxlen=LATENCY_WINDOW)).append(time.perf_counter() - submitted_at)
+
+                # Queue the conversation's next job behind the other conversations' jobs, a busy
+                #   conversation doesn't keep a worker to itself
+                waiting = self._conversations.get(conversation)
+                if(waiting is None or len(waiting) == 0):
+                    self._conversations.pop(conversation, None)
+                else:
+                    self._make_ready(waiting.popleft())
+
+                # A job of this class may have been held back by its class limit
+                self._condition.notify()
+
+def _pick_weighted(candidates, weights, credit):
+    """
+    Smooth weighted round robin: every candidate earns its weight in credit, the one with the most
+      credit is picked and pays back the total. Over time each candidate is picked in proportion to
+      its weight, without bursts of the same one.
+
+    Parameters:
+    candidates (list): The candidates that can be picked
+    weights (dict): Candidate -> weight, unknown candidates weigh 1
+    credit (dict): Candidate -> credit, updated in place
+
+    Returns:
+    object: The picked candidate
+    """
+    total = 0
+    for candidate in candidates:
+        weight = weights.get(candidate, 1)
+        credit[candidate] = credit.get(candidate, 0) + weight
+        total += weight
+
+    picked = max(candidates, key=lambda candidate: credit[candidate])
+    credit[picked] -= total
+    return picked
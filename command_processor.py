@@ -1,5 +1,13 @@
+import re
+import time
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import nullcontext
+
 from slm_command_processor import SLMCommandProcessor
-from services.service_manager import ServiceManager
+from slm_worker_pool import SLMWorkerPool
+from command_matcher import CommandMatcher
+from fuzzy_matcher import FuzzyEntityMatcher
 
 class CommandProcessor:
     """
@@ -9,15 +17,40 @@ class CommandProcessor:
     Use parse_command to convert command strings.
     """
 
-    def __init__(self, ha_controller):
-        self.slm_processor = SLMCommandProcessor()
+    def __init__(self, ha_controller, slm_wait_timeout=0.0, fuzzy_threshold=0.8, use_embedding_index=False,
+                 embedding_threshold=0.8, embedding_top_k=5, slm_workers=0, slm_options=None):
+        # The SLM loads in the background, commands that need it before it's ready wait up to
+        #   slm_wait_timeout seconds and are otherwise told the model is warming up.
+        # With slm_workers > 0 it runs in that many worker processes instead of this one, so decoding
+        #   doesn't hold this process's GIL. slm_options are passed to each SLMCommandProcessor
+        slm_options = {} if slm_options is None else slm_options
+        if(slm_workers > 0):
+            self.slm_processor = SLMWorkerPool(slm_workers, **slm_options)
+        else:
+            self.slm_processor = SLMCommandProcessor(load_async=True, **slm_options)
+        # Runs the SLM step of process_command_async, one thread per command that can share a batched
+        #   generate call, so batches can fill. See CommandPipeline#stage for the "slm" stage limit
+        self.slm_executor = ThreadPoolExecutor(max_workers=self.slm_processor.batch_capacity, thread_name_prefix="slm-request")
+        self.slm_wait_timeout = slm_wait_timeout
+        # Entered around each SLM step, can be replaced with a semaphore to limit how many commands
+        #   use the SLM at once, see CommandPipeline#stage
+        self.slm_stage = nullcontext()
+        # Near-miss entity names scoring above fuzzy_threshold are resolved without the SLM. At 0.8 a
+        #   single word of up to 5 letters with a typo can't pass on its own ("clock" for "lock")
+        self.fuzzy_threshold = fuzzy_threshold
+        # With use_embedding_index the SLM tier scores the command against an embedding of every
+        #   entity name in the action's domain, accepting the best if it scores at least
+        #   embedding_threshold and generating an entity id otherwise
+        self.use_embedding_index = use_embedding_index
+        self.embedding_threshold = embedding_threshold
+        self.embedding_top_k = embedding_top_k
         self.ha_controller = ha_controller
         if(ha_controller is None):
             print("WARNING: HomeAssistant hasn't loaded, the command processor won't be able to use it.")
 
         # Dictionary to map target entities to Home Assistant entity IDs
+        # Commands with "all" target every matching entity instead, see _match_group
         self.entity_mapping = {
-            # "all": "all",
             # # Lock Dictionary
             # "front door": "lock.front_door",
             # "garage door": "lock.garage_door",
@@ -37,57 +70,158 @@ class CommandProcessor:
         }
 
         self.custom_commands = {}
+
+        # First words that make a command a question about an entity's state
+        self.query_words = {"is", "are", "was", "what", "what's", "whats", "status", "state", "check", "how"}
+
+        # Words ignored when matching a group command's filter, e.g. "turn on all of the lights please",
+        #   and when fuzzy matching a target. A part of a compound command made only of these
+        #   ("..., please", "... and thanks") isn't a command of its own, see split_command
+        self.filler_words = {"the", "my", "of", "in", "on", "please", "now", "devices", "entities",
+                             "thanks", "thank", "you", "pls", "plz", "cheers"}
+
+        # Precompiled matchers over the mapping keys, kept in sync by the add/remove methods so
+        #   process_command can find actions and entities in a single pass over the command.
+        # The mappings can change from HomeAssistant's thread while commands are parsed, the
+        #   mapping_lock guards them and their matchers
+        self.mapping_lock = threading.RLock()
+        self.action_matcher = CommandMatcher(self.action_mapping.keys())
+        self.entity_matcher = CommandMatcher(self.entity_mapping.keys())
+        self.fuzzy_matcher = FuzzyEntityMatcher(self.entity_mapping.keys())
+        self.embedding_index = None
+        if(use_embedding_index):
+            # Imported here so numpy is only loaded when the index is used
+            from entity_embedding_index import EntityEmbeddingIndex
+            self.embedding_index = EntityEmbeddingIndex(self.slm_processor.encode, self.entity_mapping.keys())
         
         #Dynamically Add entities to Dictionary
         self.update_entity_mapping()
 
+        if(self.embedding_index is not None):
+            # Encode the entity names once the SLM has loaded, instead of on the first query
+            threading.Thread(target=self._warm_embedding_index, name="embedding-warmup", daemon=True).start()
+
+        # Keep the mapping up to date as HomeAssistant entities appear and disappear
+        if(ha_controller is not None):
+            ha_controller.add_entity_listener(self.on_entities_changed)
+
     def update_entity_mapping(self):
         # Make sure Home Assistant is loaded
         if(self.ha_controller is None):
             print("WARNING: HomeAssistant hasn't loaded, no requests will be made.")
         
+        previous_entities = set(self.entity_mapping.items())
         try:
             json = self.ha_controller.get_all_entities()
 
-            for item in json:
-                entity_id = item["entity_id"]
-                friendly_name = entity_id.split(".")[1]
-                friendly_name = friendly_name.replace("_", " ").lower()
-                self.entity_mapping[friendly_name] = entity_id
+            with self.mapping_lock:
+                for item in json:
+                    entity_id = item["entity_id"]
+                    self._add_entity(friendly_entity_name(entity_id), entity_id)
                 
         except Exception as e:
             print(f"Error: {e}")
-            
-        
+
+        # Constrain the SLM to the current entities, this also drops cached results that may point
+        #   at entities that changed
+        if(set(self.entity_mapping.items()) != previous_entities):
+            self.slm_processor.set_entity_constraints(self.entity_mapping.values())
+            self._encode_new_entities()
+
+    def on_entities_changed(self, added_entity_ids, removed_entity_ids):
+        """
+        Entity listener for HomeAssistantController#add_entity_listener, updates the entity mapping
+          incrementally as entities appear in or disappear from HomeAssistant.
+
+        Parameters:
+        added_entity_ids (list<string>): Entity ids that appeared
+        removed_entity_ids (list<string>): Entity ids that disappeared
+
+        Returns:
+        void
+        """
+        with self.mapping_lock:
+            changed = False
+            for entity_id in added_entity_ids:
+                name = friendly_entity_name(entity_id)
+                if(self.entity_mapping.get(name) != entity_id):
+                    self._add_entity(name, entity_id)
+                    changed = True
+
+            removed = set(removed_entity_ids)
+            for name in [name for name, entity_id in self.entity_mapping.items() if entity_id in removed]:
+                self._remove_entity(name)
+                changed = True
+
+            if(changed):
+                self.slm_processor.set_entity_constraints(self.entity_mapping.values())
+        if(changed):
+            self._encode_new_entities()
+
+    def _warm_embedding_index(self):
+        if(self.slm_processor.wait_until_ready()):
+            self.embedding_index.encode_in_background()
+
+    def _encode_new_entities(self):
+        # Before the SLM has loaded, _warm_embedding_index encodes them once it has
+        if(self.embedding_index is not None and self.slm_processor.is_ready):
+            self.embedding_index.encode_in_background()
+
+    def _add_entity(self, entity_name, entity_id):
+        # Must be called holding mapping_lock, doesn't update the SLM's constraints
+        self.entity_mapping[entity_name] = entity_id
+        self.entity_matcher.add(entity_name)
+        self.fuzzy_matcher.add(entity_name)
+        if(self.embedding_index is not None):
+            self.embedding_index.add(entity_name)
+
+    def _remove_entity(self, entity_name):
+        # Must be called holding mapping_lock, doesn't update the SLM's constraints
+        del self.entity_mapping[entity_name]
+        self.entity_matcher.remove(entity_name)
+        self.fuzzy_matcher.remove(entity_name)
+        if(self.embedding_index is not None):
+            self.embedding_index.remove(entity_name)
     
     def add_to_enity_mapping(self, entity_name, entity_id):
         #Validate the entity_id is valid with HomeAssistant
-        self.entity_mapping[entity_name] = entity_id
+        with self.mapping_lock:
+            self._add_entity(entity_name, entity_id)
+            self.slm_processor.set_entity_constraints(self.entity_mapping.values())
     
     def add_to_action_mapping(self, action_name, action_id):
         #Validate the action_id is valid with HomeAssistant
-        self.action_mapping[action_name] = action_id
+        with self.mapping_lock:
+            self.action_mapping[action_name] = action_id
+            self.action_matcher.add(action_name)
 
     def add_custom_command(self, command_name, command):
         self.custom_commands[command_name] = command
 
     def remove_from_entity_mapping(self, entity_name):
-        if entity_name in self.entity_mapping:
-            del self.entity_mapping[entity_name]
-            return True
-        else:
-            return False
+        with self.mapping_lock:
+            if entity_name in self.entity_mapping:
+                self._remove_entity(entity_name)
+                self.slm_processor.set_entity_constraints(self.entity_mapping.values())
+                return True
+            else:
+                return False
         
     def remove_from_action_mapping(self, action_name):
-        if action_name in self.action_mapping:
-            del self.action_mapping[action_name]
-            return True
-        else:
-            return False
+        with self.mapping_lock:
+            if action_name in self.action_mapping:
+                del self.action_mapping[action_name]
+                self.action_matcher.remove(action_name)
+                return True
+            else:
+                return False
     
     def process_command(self, command):
         """
         Process a string command and convert it to a action_url and entity_id tuple.
+        Compound commands ("lock the front door and turn on the porch light") are split into
+          subcommands, see split_command, and resolve to a "multi_cmd" result.
+        Each result has timings, the seconds spent in the "parse" and "slm_generate" stages.
         Parameters:
         command (string): The entire string command from the messaging services.
 
@@ -95,61 +229,416 @@ class CommandProcessor:
         (string, string): The action_url and entity_id tuple
         """
         command = command.lower()
+        subcommands = self.split_command(command)
+        if(len(subcommands) == 1):
+            return self._process_single(subcommands[0])
+
+        outcomes = []
+        for subcommand in subcommands:
+            try:
+                outcomes.append(self._process_single(subcommand))
+            except CommandProcessingError as e:
+                outcomes.append(e)
+        return self._make_multi_result(subcommands, outcomes)
+
+    def process_command_async(self, command):
+        """
+        Process a string command like process_command, without blocking on the SLM. The cheap steps
+          run on the calling thread, a command that needs the SLM is finished on slm_executor.
+        The subcommands of a compound command are resolved concurrently.
+
+        Parameters:
+        command (string): The entire string command from the messaging services.
+
+        Returns:
+        Future: Resolves to the process_command result, or raises its CommandProcessingError
+        """
+        command = command.lower()
+        subcommands = self.split_command(command)
+        if(len(subcommands) == 1):
+            return self._process_single_async(subcommands[0])
+
+        future = Future()
+        sub_futures = [self._process_single_async(subcommand) for subcommand in subcommands]
+        remaining = [len(sub_futures)]
+        remaining_lock = threading.Lock()
+
+        def on_done(_):
+            with remaining_lock:
+                remaining[0] -= 1
+                if(remaining[0] > 0):
+                    return
+            outcomes = [sub_future.exception() or sub_future.result() for sub_future in sub_futures]
+            future.set_result(self._make_multi_result(subcommands, outcomes))
+
+        for sub_future in sub_futures:
+            sub_future.add_done_callback(on_done)
+        return future
+
+    def classify_command(self, command):
+        """
+        Classify a command by the cheapest tier that can resolve it, without using the SLM, so
+          cheap commands can be scheduled ahead of expensive ones.
+
+        Parameters:
+        command (string): The entire string command from the messaging services.
+
+        Returns:
+        string: "custom" for custom commands, "slm" if any part of it needs the SLM, otherwise
+          "exact" (including commands that will fail to process, they're answered right away)
+        """
+        command = command.lower()
+        priority_class = "exact"
+        for subcommand in self.split_command(command):
+            try:
+                result, _ = self._parse_command(subcommand)
+            except CommandProcessingError:
+                continue
+            if(result is None):
+                return "slm"
+            if(result["processed_type"] == "custom_cmd"):
+                priority_class = "custom"
+        return priority_class
+
+    def split_command(self, command):
+        """
+        Split a compound command into its subcommands, in order, on "and", "then", commas and
+          semicolons. A subcommand without an action reuses the previous one's, so "turn on the
+          porch light and the garage light" turns on both. Custom commands are never split.
+        Parts made only of filler words ("..., please") are merged into the part before them. The
+          command is only split if every other part has its own target, an entity or "all", so a
+          part can never be sent on to the SLM to guess a target it doesn't name.
+
+        Parameters:
+        command (string): The lowercase command
+
+        Returns:
+        list<string>: The subcommands, just the command itself if it isn't compound
+        """
+        if(command.split(" ")[0] in self.custom_commands):
+            return [command]
+
+        parts = []
+        for part in re.split(r"\s*(?:[,;]|\band then\b|\bthen\b|\band\b)\s*", command):
+            part = part.strip()
+            if(len(part) == 0):
+                continue
+            if(len(parts) > 0 and self._is_filler(part)):
+                parts[-1] = f"{parts[-1]} {part}"
+            else:
+                parts.append(part)
+        if(len(parts) <= 1):
+            return [command]
+
+        subcommands = []
+        lead = None
+        with self.mapping_lock:
+            if(not all(self._has_target(part) for part in parts)):
+                return [command]
+
+            for part in parts:
+                first_word = part.split(" ")[0]
+                if(first_word in self.custom_commands):
+                    lead = None
+                elif(first_word in self.query_words):
+                    lead = "is"
+                else:
+                    action = self.action_matcher.longest_match(part)
+                    if(action is not None):
+                        lead = action
+                    elif(lead is not None):
+                        part = f"{lead} {part}"
+                subcommands.append(part)
+        return subcommands
+
+    def _is_filler(self, part):
+        return all(word.strip("?!.,") in self.filler_words for word in part.split(" "))
+
+    def _has_target(self, part):
+        """
+        Whether a part of a compound command names its own target: a custom command, "all", an
+          entity name, or a near-miss of one the fuzzy tier would resolve.
+        Must be called holding mapping_lock.
+        """
+        command_split = part.split(" ")
+        if(command_split[0] in self.custom_commands or "all" in command_split):
+            return True
+        if(self.entity_matcher.longest_match(part) is not None):
+            return True
+
+        is_query = command_split[0] in self.query_words
+        action = None if is_query else self.action_matcher.longest_match(part)
+        fuzzy_target, fuzzy_score = self.fuzzy_matcher.best_match(self._target_words(part, action, is_query))
+        return fuzzy_target is not None and fuzzy_score > self.fuzzy_threshold
+
+    def _process_single(self, command):
+        started = time.perf_counter()
+        result, action = self._parse_command(command)
+        parse_time = time.perf_counter() - started
+        if(result is None):
+            result = self._parse_with_slm(command, action)
+        result.setdefault("timings", {})["parse"] = parse_time
+        return result
+
+    def _process_single_async(self, command):
+        started = time.perf_counter()
+        try:
+            result, action = self._parse_command(command)
+        except CommandProcessingError as e:
+            future = Future()
+            future.set_exception(e)
+            return future
+        parse_time = time.perf_counter() - started
+
+        if(result is None):
+            def parse_with_slm():
+                result = self._parse_with_slm(command, action)
+                result["timings"]["parse"] = parse_time
+                return result
+            return self.slm_executor.submit(parse_with_slm)
+
+        result["timings"] = {"parse": parse_time}
+        future = Future()
+        future.set_result(result)
+        return future
+
+    def _make_multi_result(self, subcommands, outcomes):
+        """
+        Build the process result of a compound command.
+
+        Parameters:
+        subcommands (list<string>): The subcommands, see split_command
+        outcomes (list): Each subcommand's process result, or the exception it raised
+
+        Returns:
+        dict: A "multi_cmd" result with a {"command", "result", "error"} dictionary per subcommand,
+          where error is set instead of result if the subcommand couldn't be processed, and the
+          seconds spent in each parse stage as timings
+        """
+        commands = []
+        for subcommand, outcome in zip(subcommands, outcomes):
+            if(isinstance(outcome, CommandProcessingError)):
+                commands.append({"command": subcommand, "result": None, "error": outcome.message})
+            elif(isinstance(outcome, BaseException)):
+                commands.append({"command": subcommand, "result": None, "error": str(outcome)})
+            else:
+                commands.append({"command": subcommand, "result": outcome, "error": None})
+
+        # The subcommands are parsed one after another, but their SLM steps run concurrently
+        sub_timings = [command["result"].get("timings", {}) for command in commands if command["result"] is not None]
+        timings = {"parse": sum(sub_timing.get("parse", 0) for sub_timing in sub_timings)}
+        slm_timings = [sub_timing["slm_generate"] for sub_timing in sub_timings if "slm_generate" in sub_timing]
+        if(len(slm_timings) > 0):
+            timings["slm_generate"] = max(slm_timings)
+
+        return {
+            "processed_type": "multi_cmd",
+            "used_slm": any(command["result"] is not None and command["result"].get("used_slm", False) for command in commands),
+            "commands": commands,
+            "timings": timings
+        }
+
+    def stop(self):
+        """
+        Stop the SLM's background threads and worker processes.
+        """
+        self.slm_executor.shutdown(wait=False, cancel_futures=True)
+        self.slm_processor.stop()
+
+    def _parse_command(self, command):
+        """
+        The steps of process_command that don't need the SLM.
+
+        Returns:
+        (dict, string): The process result and None if the command was resolved, otherwise None and
+          the matched action for _parse_with_slm (None for a state query)
+        """
         command_split = command.split(" ")
 
-        # Theres 3 major steps: Parse as custom command, parse as home assistant command, parse with slm
+        # Theres 4 major steps: Parse as custom command, parse as home assistant command, resolve
+        #   a near-miss target, parse with slm
         # 1. Try to parse as custom command first
         if(command_split[0] in self.custom_commands):
             return {
                 "processed_type": "custom_cmd",
                 "custom_cmd": self.custom_commands[command_split[0]],
                 "custom_cmd_label": command_split[0]
-            }
+            }, None
 
-        # 2. Try to parse as HomeAssistant command
-        # Sort actions by length to prevent partial matches (e.g. "lock" being matched before "unlock")
-        sorted_actions = sorted(self.action_mapping.keys(), key=len, reverse=True)
+        # Questions about an entity ("is the front door locked?") are answered from its state rather
+        #   than performing an action, even though "locked" contains the "lock" action
+        is_query = command_split[0] in self.query_words
 
-        action = None
-        for word in sorted_actions:
-            if word in command:
-                action = word
-                break
-                
-        target = None
-        for entity in self.entity_mapping:
-            if entity in command:
-                target = entity
-                break
-
-        # Successfully processed the command without SLM, return the parse result
-        # We want this to happen before the SLM because it is 100% what the user intends to do.
-        # That way, if the user's SLM inputs aren't what they want, they can use the consistent commands
-        if(action and target):
-            return {
-                "processed_type": "ha_cmd",
-                "used_slm": False,
-                "action_label": self.action_mapping[action],
-                "entity_id": self.entity_mapping[target]
-            }
+        with self.mapping_lock:
+            # 2. Try to parse as HomeAssistant command
+            # The longest match wins to prevent partial matches (e.g. "lock" being matched before
+            #   "unlock", or "front door" before "front door lock")
+            action = None if is_query else self.action_matcher.longest_match(command)
+            # Group commands ("turn on all living room lights") target every entity they match
+            if(action and "all" in command_split):
+                return self._match_group(action, command_split), None
+
+            # An action only matches entities of its domain, its service can't be called on others
+            accept = None
+            if(action):
+                domain = self.action_mapping[action].split("/")[0]
+                accept = lambda name: self.entity_mapping[name].split(".")[0] == domain
+
+            target = self.entity_matcher.longest_match(command, accept)
+
+            # Successfully processed the command without SLM, return the parse result
+            # We want this to happen before the SLM because it is 100% what the user intends to do.
+            # That way, if the user's SLM inputs aren't what they want, they can use the consistent commands
+            if((action or is_query) and target):
+                return self._make_result(action, self.entity_mapping[target], False), None
+
+            # The later steps only resolve the target, without an action there's nothing for them to do
+            if not (action or is_query):
+                raise CommandProcessingError("Unrecognized action.")
+
+            # 3. Try to resolve a near-miss target (typos, missing spaces) without the SLM. Only the
+            #   words that could name the target are matched
+            fuzzy_target, fuzzy_score = self.fuzzy_matcher.best_match(self._target_words(command, action, is_query), accept)
+            if(fuzzy_target is not None and fuzzy_score > self.fuzzy_threshold):
+                return self._make_result(action, self.entity_mapping[fuzzy_target], False, fuzzy_score=fuzzy_score), None
+
+            return None, action
+
+    def _target_words(self, command, action, is_query):
+        """
+        The part of a command that could name its target: without the matched action, the query
+          word or filler words, so they can't match an entity name on their own (e.g. "open"
+          matching "oven").
+
+        Returns:
+        string: The remaining words
+        """
+        command_split = command.split(" ")
+        if(is_query):
+            command_split = command_split[1:]
+        if(action):
+            command_split = re.sub(rf"\b{re.escape(action)}\b", " ", " ".join(command_split), count=1).split(" ")
+        return " ".join(word for word in command_split if word.strip("?!.,") not in self.filler_words)
+
+    def _parse_with_slm(self, command, action):
+        """
+        The last step of process_command, resolves the target with the SLM.
+
+        Returns:
+        dict: The process result
+        """
+        # 4. Parse with SLM
+        with self.slm_stage:
+            started = time.perf_counter()
+            result = self._resolve_with_slm(command, action)
+            result["timings"] = {"slm_generate": time.perf_counter() - started}
+            return result
+
+    def _resolve_with_slm(self, command, action):
+        if(not self.slm_processor.wait_until_ready(self.slm_wait_timeout)):
+            if(self.slm_processor.load_error is not None):
+                raise CommandProcessingError("Unrecognized target, and the language model failed to load.")
+            raise CommandProcessingError("Unrecognized target. The language model is still warming up, try again in a moment.")
+
+        if(self.embedding_index is not None):
+            with self.mapping_lock:
+                # Like the fuzzy tier, only entities in the action's domain are candidates
+                if(action):
+                    domain = self.action_mapping[action].split("/")[0]
+                    names = {name for name, entity_id in self.entity_mapping.items() if(entity_id.split(".")[0] == domain)}
+                else:
+                    names = set(self.entity_mapping.keys())
+            candidates = self.embedding_index.query(command, self.embedding_top_k, names.__contains__)
+            with self.mapping_lock:
+                # Entities may have been removed since the index was queried
+                candidates = [(self.entity_mapping[name], score) for name, score in candidates if name in self.entity_mapping]
+            if(len(candidates) > 0 and candidates[0][1] >= self.embedding_threshold):
+                return self._make_result(action, candidates[0][0], True, candidates=candidates)
+            # No entity is close enough, generation may still find it
 
-        # 3. Parse with SLM
         # TODO: Needs to return entity_id and action_label. If it's easier for the SLM, we could make it output a key from the action_mapping dictionary (like "lock" "unlock")
         entity_id = self.slm_processor.generate_api_command(command)
-        if(action and entity_id):
+        if(entity_id):
             print(f"SLM entity id {entity_id} and got action {action}")
+            return self._make_result(action, entity_id, True)
+
+        raise CommandProcessingError("Unrecognized target.")
+
+    def _match_group(self, action, command_split):
+        """
+        Resolve a group command to every entity in the action's domain whose name has each word
+          after "all", e.g. "turn on all living room lights" to every light with "living room" in
+          its name. The domain's own name is ignored, "lights" is only there for the user.
+        Must be called holding mapping_lock.
+
+        Parameters:
+        action (string): The matched action_mapping key
+        command_split (list<string>): The command's words
+
+        Returns:
+        dict: An "ha_cmd" result whose entity_id is a list of entity ids
+        """
+        domain = self.action_mapping[action].split("/")[0]
+        action_words = set(action.split(" "))
+
+        filter_words = []
+        for word in command_split[command_split.index("all") + 1:]:
+            word = word.strip("?!.,")
+            if(len(word) == 0 or word in self.filler_words or word in action_words):
+                continue
+            if(word == domain or word == domain + "s"):
+                continue
+            filter_words.append(word)
+
+        def matches(name):
+            name_words = set(name.split(" "))
+            # Plurals match the singular, "doors" matches "front door"
+            return all(word in name_words or (word.endswith("s") and word[:-1] in name_words) for word in filter_words)
+
+        entity_ids = sorted({
+            entity_id for name, entity_id in self.entity_mapping.items()
+            if(entity_id.split(".")[0] == domain and matches(name))
+        })
+        if(len(entity_ids) == 0):
+            raise CommandProcessingError(f"No {domain} entities match \"{' '.join(filter_words) or 'all'}\".")
+
+        return self._make_result(action, entity_ids, False, group=True)
+
+    def _make_result(self, action, entity_id, used_slm, **details):
+        """
+        Build a process result for a resolved target.
+
+        Parameters:
+        action (string): The matched action_mapping key, None for a state query
+        entity_id (string): The resolved entity id, or a list of them for a group command
+        used_slm (bool): Whether the SLM resolved the target
+        details (dict): Extra keys for the result, e.g. fuzzy_score
+
+        Returns:
+        dict: An "ha_cmd" result, or an "ha_query" result if there's no action
+        """
+        if(action is None):
             return {
-                "processed_type": "ha_cmd",
-                "used_slm": True,
-                "action_label": self.action_mapping[action],
-                "entity_id": entity_id
+                "processed_type": "ha_query",
+                "used_slm": used_slm,
+                "entity_id": entity_id,
+                **details
             }
-        
-        if not action:
-            raise CommandProcessingError("Unrecognized action.")
-        if not target:
-            raise CommandProcessingError("Unrecognized target.")
+
+        return {
+            "processed_type": "ha_cmd",
+            "used_slm": used_slm,
+            "action_label": self.action_mapping[action],
+            "entity_id": entity_id,
+            **details
+        }
             
+def friendly_entity_name(entity_id):
+    """
+    The name users refer to an entity by, e.g. "front door" for lock.front_door.
+    """
+    return entity_id.split(".")[1].replace("_", " ").lower()
+
 class CommandProcessingError(Exception):
     def __init__(self, message):
         super().__init__(message)
@@ -0,0 +1,65 @@
+import threading
+from collections import deque
+
+# Console levels from least to most severe, a line's level is read from its prefix
+LEVELS = ("info", "warning", "error")
+
+def line_level(line):
+    """
+    Get the level of a console line from the prefixes the program prints with, e.g. "WARNING: ..."
+      or "Error: ...".
+
+    Returns:
+    string: "error", "warning" or "info"
+    """
+    prefix = line.lstrip()[:7].upper()
+    if(prefix.startswith("ERROR")):
+        return "error"
+    if(prefix.startswith("WARNING")):
+        return "warning"
+    return "info"
+
+class ConsoleBuffer:
+    """
+    A bounded, thread-safe ring buffer of console output. Any thread can write print fragments to
+      it, they're joined into lines, and the interface drains the complete lines once per update.
+    When the interface falls behind, the oldest lines are dropped so memory stays constant.
+    """
+
+    def __init__(self, max_lines=10000):
+        self.max_lines = max_lines
+        self.dropped = 0
+
+        # (level, line) pairs, oldest first
+        self._lines = deque()
+        # The fragment of the line that's still being written
+        self._partial = ""
+        self._lock = threading.Lock()
+
+    def write(self, text):
+        """
+        Add text to the buffer, lines are complete once their newline is written.
+
+        Returns:
+        void
+        """
+        with self._lock:
+            lines = (self._partial + text).split("\n")
+            self._partial = lines.pop()
+            for line in lines:
+                if(len(self._lines) >= self.max_lines):
+                    self._lines.popleft()
+                    self.dropped += 1
+                self._lines.append((line_level(line), line))
+
+    def drain(self):
+        """
+        Take every complete line written since the last drain.
+
+        Returns:
+        list<(string, string)>: (level, line) pairs in the order they were written
+        """
+        with self._lock:
+            lines = list(self._lines)
+            self._lines.clear()
+            return lines
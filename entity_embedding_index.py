@@ -0,0 +1,174 @@
+import threading
+
+import numpy as np
+
+class EntityEmbeddingIndex:
+    """
+    The EntityEmbeddingIndex holds one embedding per entity name in a NumPy matrix, so a command can
+      be scored against every entity with a single matrix-vector product instead of running
+      autoregressive generation.
+    Added names are kept pending and encoded in one batch, by encode_pending or on a background
+      thread with encode_in_background, so queries don't wait for them. A query encodes any that
+      are left first.
+    """
+
+    def __init__(self, encode, names=()):
+        """
+        Parameters:
+        encode (callable): Called with a list of strings, returns a float32 array with one
+          L2-normalized row per string, see SLMCommandProcessor#encode
+        names (iterable<string>): Entity names to index
+        """
+        self.encode = encode
+
+        # The first count rows of matrix are in use, row i holds the embedding of names[i]. The
+        #   matrix grows by doubling so adding entities one at a time stays cheap
+        self.names = []
+        self.matrix = None
+        self.count = 0
+        self._rows = {}
+        self._pending = set()
+        self._lock = threading.Lock()
+        # Held while encoding so each pending name is encoded once, without blocking queries
+        self._encode_lock = threading.Lock()
+        self._encoder = None
+
+        for name in names:
+            self.add(name)
+
+    def __len__(self):
+        return self.count + len(self._pending)
+
+    def add(self, name):
+        """
+        Add an entity name to the index, it's encoded by the next encode_pending or query.
+        """
+        with self._lock:
+            if(name not in self._rows):
+                self._pending.add(name)
+
+    def remove(self, name):
+        """
+        Remove an entity name from the index by moving the last row into its place.
+
+        Returns:
+        bool: True if the name was in the index
+        """
+        with self._lock:
+            if(name in self._pending):
+                self._pending.discard(name)
+                return True
+
+            row = self._rows.pop(name, None)
+            if(row is None):
+                return False
+
+            last = self.count - 1
+            if(row != last):
+                moved_name = self.names[last]
+                self.matrix[row] = self.matrix[last]
+                self.names[row] = moved_name
+                self._rows[moved_name] = row
+            self.names.pop()
+            self.count -= 1
+            return True
+
+    def query(self, text, k=5, accept=None):
+        """
+        Find the entity names most similar to the text.
+
+        Parameters:
+        text (string): The command to be matched
+        k (int): The most candidates returned
+        accept (callable): Called with an entity name, only names it returns True for are candidates
+
+        Returns:
+        list<(string, float)>: Up to k (entity name, cosine similarity) pairs, best first
+        """
+        vector = self.encode([text])[0]
+        self.encode_pending()
+
+        with self._lock:
+            if(self.count == 0):
+                return []
+
+            scores = self.matrix[:self.count] @ vector
+            if(accept is not None):
+                accepted = np.fromiter((accept(name) for name in self.names), dtype=bool, count=self.count)
+                scores = np.where(accepted, scores, -np.inf)
+                k = min(k, int(accepted.sum()))
+            k = min(k, self.count)
+            if(k == 0):
+                return []
+            # Only the top k need sorting
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(self.names[row], float(scores[row])) for row in top]
+
+    def encode_pending(self):
+        """
+        Encode every pending name and add it to the matrix. The encoder runs without holding the
+          index lock, so queries and updates aren't blocked by it.
+
+        Returns:
+        void
+        """
+        with self._encode_lock:
+            with self._lock:
+                names = list(self._pending)
+            if(len(names) == 0):
+                return
+            embeddings = self.encode(names)
+
+            with self._lock:
+                # Names removed while they were being encoded are dropped
+                kept = [row for row, name in enumerate(names) if(name in self._pending)]
+                self._pending.difference_update(names)
+                self._append([names[row] for row in kept], embeddings[kept])
+
+    def encode_in_background(self):
+        """
+        Encode the pending names on a background thread, e.g. as entities are added once the encoder
+          is ready. Does nothing if the thread is already running.
+
+        Returns:
+        void
+        """
+        with self._lock:
+            if(self._encoder is not None or len(self._pending) == 0):
+                return
+            self._encoder = threading.Thread(target=self._encode_in_background, name="embedding-encoder", daemon=True)
+            self._encoder.start()
+
+    def _encode_in_background(self):
+        while True:
+            with self._lock:
+                if(len(self._pending) == 0):
+                    self._encoder = None
+                    return
+            try:
+                self.encode_pending()
+            except Exception as e:
+                print(f"WARNING: Couldn't encode entity names: {e}")
+                with self._lock:
+                    self._encoder = None
+                return
+
+    def _append(self, names, embeddings):
+        # Must be called holding _lock
+        if(len(names) == 0):
+            return
+
+        if(self.matrix is None):
+            self.matrix = np.zeros((max(16, len(names)), embeddings.shape[1]), dtype=np.float32)
+        elif(self.count + len(names) > self.matrix.shape[0]):
+            capacity = max(self.matrix.shape[0] * 2, self.count + len(names))
+            matrix = np.zeros((capacity, self.matrix.shape[1]), dtype=np.float32)
+            matrix[:self.count] = self.matrix[:self.count]
+            self.matrix = matrix
+
+        self.matrix[self.count:self.count + len(names)] = embeddings
+        for name in names:
+            self._rows[name] = self.count
+            self.names.append(name)
+            self.count += 1
@@ -0,0 +1,208 @@
+import re
+from itertools import combinations
+
+def bounded_edit_distance(a, b, max_distance):
+    """
+    Edit distance between two strings, counting insertions, deletions, substitutions and swaps of
+      adjacent characters (optimal string alignment). Gives up once the distance is known to
+      exceed max_distance.
+
+    Parameters:
+    a (string): The first string
+    b (string): The second string
+    max_distance (int): The largest distance of interest
+
+    Returns:
+    int: The edit distance, or max_distance + 1 if it's larger than max_distance
+    """
+    if(abs(len(a) - len(b)) > max_distance):
+        return max_distance + 1
+    if(len(a) < len(b)):
+        a, b = b, a
+
+    before_previous = None
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            cost = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != char_b)
+            )
+            if(i > 1 and j > 1 and char_a == b[j - 2] and a[i - 2] == char_b):
+                cost = min(cost, before_previous[j - 2] + 1)
+            current.append(cost)
+
+        # Every path through the last two rows already costs too much
+        if(min(current) > max_distance and min(previous) > max_distance):
+            return max_distance + 1
+        before_previous, previous = previous, current
+
+    return previous[-1] if previous[-1] <= max_distance else max_distance + 1
+
+def _deletes(word, distance):
+    """
+    Every string made by deleting up to distance characters from word, including word itself.
+    """
+    variants = {word}
+    for count in range(1, min(distance, len(word)) + 1):
+        for positions in combinations(range(len(word)), count):
+            variants.add("".join(char for index, char in enumerate(word) if index not in positions))
+    return variants
+
+def _allowed_distance(word, max_distance):
+    # Short words only match exactly, otherwise "on" would match "tv" and the like
+    if(len(word) <= 2):
+        return 0
+    if(len(word) <= 5):
+        return min(1, max_distance)
+    return max_distance
+
+def tokenize(text):
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+class FuzzyEntityMatcher:
+    """
+    The FuzzyEntityMatcher resolves near-miss entity names ("frnt door", "livingroom lamp") in a
+      command without the SLM.
+    Every word of every entity name, and every pair of adjacent words joined together, is a key in
+      an inverted index. Keys are also indexed by their deletion variants (symmetric delete
+      spelling correction) so the keys within a bounded edit distance of a command word are found
+      with a few dictionary lookups rather than a scan over every entity.
+    An entity's score is the average similarity of its best matching command word per name word.
+    """
+
+    def __init__(self, names=(), max_distance=1):
+        self.max_distance = max_distance
+        # name -> list of its words
+        self.names = {}
+        # key -> set of (name, first word index, word count) the key covers
+        self._key_index = {}
+        # deletion variant -> set of keys it was made from
+        self._delete_index = {}
+
+        for name in names:
+            self.add(name)
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, name):
+        """
+        Add an entity name to the matcher.
+        """
+        if(name in self.names):
+            return
+
+        words = tokenize(name)
+        if(len(words) == 0):
+            return
+        self.names[name] = words
+
+        for key, start, span in self._keys(words):
+            postings = self._key_index.get(key)
+            if(postings is None):
+                postings = set()
+                self._key_index[key] = postings
+                for variant in _deletes(key, _allowed_distance(key, self.max_distance)):
+                    self._delete_index.setdefault(variant, set()).add(key)
+            postings.add((name, start, span))
+
+    def remove(self, name):
+        """
+        Remove an entity name from the matcher.
+
+        Returns:
+        bool: True if the name was in the matcher
+        """
+        words = self.names.pop(name, None)
+        if(words is None):
+            return False
+
+        for key, start, span in self._keys(words):
+            postings = self._key_index[key]
+            postings.discard((name, start, span))
+            if(len(postings) > 0):
+                continue
+
+            # No other name uses this key, drop it and its deletion variants
+            del self._key_index[key]
+            for variant in _deletes(key, _allowed_distance(key, self.max_distance)):
+                keys = self._delete_index[variant]
+                keys.discard(key)
+                if(len(keys) == 0):
+                    del self._delete_index[variant]
+        return True
+
+    def best_match(self, command, accept=None):
+        """
+        Find the entity name that best matches the command.
+
+        Parameters:
+        command (string): The command to be matched
+        accept (function): Called with each matching name, only names it returns True for can be
+          the best match, e.g. to only match entities of a domain. None accepts every name
+
+        Returns:
+        (string, float): The best matching entity name and its score between 0 and 1, (None, 0.0)
+          if nothing matched. Equal scores prefer the longer name.
+        """
+        words = tokenize(command)
+        queries = set(words)
+        # Adjacent command words joined together, catches names typed with a stray space
+        queries.update(words[i] + words[i + 1] for i in range(len(words) - 1))
+
+        # name -> best similarity for each of its words
+        coverage = {}
+        for query in queries:
+            for key, similarity in self._lookup(query):
+                for name, start, span in self._key_index[key]:
+                    scores = coverage.get(name)
+                    if(scores is None):
+                        scores = [0.0] * len(self.names[name])
+                        coverage[name] = scores
+                    for index in range(start, start + span):
+                        scores[index] = max(scores[index], similarity)
+
+        best_name, best_score = None, 0.0
+        for name, scores in coverage.items():
+            if(accept is not None and not accept(name)):
+                continue
+            score = sum(scores) / len(scores)
+            if(score > best_score or (score == best_score and best_name is not None and len(name) > len(best_name))):
+                best_name, best_score = name, score
+
+        return best_name, best_score
+
+    def _lookup(self, query):
+        """
+        Find the index keys within their allowed edit distance of the query.
+
+        Returns:
+        list<(string, float)>: Matching keys and their similarity to the query
+        """
+        # The query is expanded as far as any key could be, each candidate is then held to its own
+        #   allowed distance
+        candidates = set()
+        for variant in _deletes(query, 0 if len(query) <= 2 else self.max_distance):
+            candidates.update(self._delete_index.get(variant, ()))
+
+        matches = []
+        for key in candidates:
+            allowed = _allowed_distance(key, self.max_distance)
+            distance = bounded_edit_distance(query, key, allowed)
+            if(distance <= allowed):
+                matches.append((key, 1.0 - distance / max(len(query), len(key))))
+        return matches
+
+    def _keys(self, words):
+        """
+        The index keys for a name's words: each word, and each pair of adjacent words joined.
+
+        Returns:
+        list<(string, int, int)>: (key, first word index, word count) tuples
+        """
+        keys = [(word, index, 1) for index, word in enumerate(words)]
+        keys.extend((words[index] + words[index + 1], index, 2) for index in range(len(words) - 1))
+        return keys
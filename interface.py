@@ -1,40 +1,193 @@
 import sys
+import time
+import queue
 import threading
+from collections import deque
 import tkinter as tk
 from tkinter import ttk
 
 from services.message_service import MessageService
+from metrics import Counter, Gauge, Histogram, registry as metrics_registry
+from console_buffer import ConsoleBuffer, LEVELS
+
+# Milliseconds between updates of the interface on its thread
+UI_UPDATE_INTERVAL_MS = 50
+
+# Seconds between refreshes of the metrics tab
+METRICS_REFRESH_INTERVAL = 1.0
+
+# Console settings unless configured in the "interface" config section
+DEFAULT_CONSOLE_MAX_LINES = 5000
+DEFAULT_CONSOLE_BUFFER_LINES = 10000
+
+# Colors of the console levels
+LEVEL_COLORS = {"warning": "darkorange3", "error": "red3"}
 
 class InterfaceManager:
+    """
+    The InterfaceManager runs the Tk interface on its own thread, so redrawing it never holds up
+      command processing. Other threads only talk to it through thread-safe queues: console output
+      goes through the console_buffer and anything else that has to touch Tk is passed to call.
+    """
+
     def __init__(self, service_manager, command_processor):
         self.service_manager = service_manager
         self.command_processor = command_processor
-        # A list of strings to be added to console
-        self.console_queue = []
 
-        self._init_tk()
+        # Console output waiting to be shown, written from any thread and drained once per update.
+        #   The console widget keeps up to console_max_lines lines of console_level or above
+        interface_config = service_manager.config.get("interface", {})
+        self.console_buffer = ConsoleBuffer(interface_config.get("console_buffer_lines", DEFAULT_CONSOLE_BUFFER_LINES))
+        self.console_max_lines = interface_config.get("console_max_lines", DEFAULT_CONSOLE_MAX_LINES)
+        self.console_level = interface_config.get("console_level", "info")
+        if(self.console_level not in LEVELS):
+            print(f"WARNING: Invalid console_level \"{self.console_level}\", expected one of {', '.join(LEVELS)}. Showing every line.")
+            self.console_level = "info"
+        # The lines the console widget could show, so it can be redrawn when the level changes
+        self.console_history = deque(maxlen=self.console_max_lines)
+
+        # Functions to run on the interface's thread, see call
+        self._calls = queue.Queue()
+        self.thread = None
+        self.running = False
+        self._started = threading.Event()
+        self._start_error = None
 
         # Set up pseudo message service
         self.interface_ms = InterfaceMessageService(self)
         service_manager.register_service("interface_ms", self.interface_ms)
 
-        # Register an exit call for when the user clicks close window on the standalone window
-        self.root.protocol("WM_DELETE_WINDOW", lambda: self.interface_ms.recieve_message("exit"))
-        
+    def start(self):
+        """
+        Start the interface on its own thread, returning once its window has been created.
+
+        Raises:
+        tk.TclError: If the window can't be created, e.g. there's no display
+        """
+        self.thread = threading.Thread(target=self._run, name="interface", daemon=True)
+        self.thread.start()
+        self._started.wait()
+        if(self._start_error is not None):
+            raise self._start_error
+
+    def stop(self, timeout=2.0):
+        """
+        Close the interface's window and wait up to timeout seconds for its thread to finish.
+        """
+        if(self.thread is None or not self.thread.is_alive()):
+            return
+        self.call(self.root.destroy)
+        self.thread.join(timeout)
+
+    def call(self, callback, *args):
+        """
+        Run callback(*args) on the interface's thread, from any thread.
+
+        Returns:
+        void
+        """
+        self._calls.put((callback, args))
+
     def update(self):
         """
-        Update call to update interface and synchronize console queue with what's shown on screen.
+        Update call on the interface's thread to run queued calls and synchronize the console
+          buffer with what's shown on screen, rescheduled every UI_UPDATE_INTERVAL_MS.
         """
-        self.root.update()
+        while True:
+            try:
+                callback, args = self._calls.get_nowait()
+            except queue.Empty:
+                break
+            callback(*args)
+            # The window may have been destroyed by the call
+            if(not self.running):
+                return
+
+        if(time.monotonic() - self.metrics_refreshed_at >= METRICS_REFRESH_INTERVAL):
+            self.refresh_metrics()
+
+        lines = self.console_buffer.drain()
+        if(len(lines) > 0):
+            self.console_history.extend(lines)
+            self._show_console_lines(lines)
+
+        self.root.after(UI_UPDATE_INTERVAL_MS, self.update)
+
+    def _run(self):
+        # Tk has to be created and used on the one thread
+        try:
+            self._init_tk()
+        except tk.TclError as e:
+            self._start_error = e
+            self._started.set()
+            return
 
-        while len(self.console_queue) > 0:
-            message = self.console_queue.pop()
-            self.add_console_text(message)
+        # Register an exit call for when the user clicks close window on the standalone window
+        self.root.protocol("WM_DELETE_WINDOW", lambda: self.interface_ms.recieve_message("exit"))
+        self.root.bind("<Destroy>", self._on_destroy)
+        self.running = True
+        self._started.set()
+
+        self.update()
+        self.root.mainloop()
+        self.running = False
+
+    def _on_destroy(self, event):
+        if(event.widget is self.root):
+            self.running = False
 
     def add_console_text(self, message):
-        self.output_text.insert(tk.END, message)
+        """
+        Show a line in the console, from any thread.
+        """
+        self.console_buffer.write(f"{message}\n")
+
+    def set_console_level(self, level):
+        """
+        Only show console lines of level or above, redrawing the console.
+
+        Parameters:
+        level (string): "info", "warning" or "error"
+        """
+        self.console_level = level
+        self.output_text.delete("1.0", tk.END)
+        self._show_console_lines(self.console_history)
+
+    def _show_console_lines(self, lines):
+        # One batched insert of every line at or above the console level, then trim the widget
+        #   back to console_max_lines
+        minimum = LEVELS.index(self.console_level)
+        chunks = []
+        for level, line in lines:
+            if(LEVELS.index(level) >= minimum):
+                chunks.extend((line + "\n", level))
+        if(len(chunks) == 0):
+            return
+
+        self.output_text.insert(tk.END, *chunks)
+        line_count = int(self.output_text.index("end-1c").split(".")[0]) - 1
+        if(line_count > self.console_max_lines):
+            self.output_text.delete("1.0", f"{line_count - self.console_max_lines + 1}.0")
         self.output_text.see(tk.END)
 
+    def refresh_metrics(self):
+        """
+        Show the current metrics in the metrics tab, histograms as their p50/p95/p99 in milliseconds.
+        """
+        self.metrics_refreshed_at = time.monotonic()
+        self.metrics_tree.delete(*self.metrics_tree.get_children())
+
+        for metric in metrics_registry.metrics():
+            if(isinstance(metric, Histogram)):
+                for key, values in sorted(metric.percentiles().items()):
+                    self.metrics_tree.insert("", tk.END, values=(
+                        metric.name, _format_label_key(key), values["count"],
+                        f"{values[0.5] * 1000:.1f}", f"{values[0.95] * 1000:.1f}", f"{values[0.99] * 1000:.1f}"
+                    ))
+            elif(isinstance(metric, (Counter, Gauge))):
+                for key, value in sorted(metric.samples()):
+                    self.metrics_tree.insert("", tk.END, values=(metric.name, _format_label_key(key), value, "", "", ""))
+
     def _init_tk(self):
         self.root = tk.Tk()
         self.root.title("Home Assistant Interface")
@@ -58,6 +211,11 @@ class InterfaceManager:
             service_tab = self._create_service_tab(tab_control, service_name)
             tab_control.add(service_tab, text=service_name.capitalize())
 
+        # Metrics tab
+        metrics_tab = ttk.Frame(tab_control)
+        tab_control.add(metrics_tab, text="Metrics")
+        self._setup_metrics_tab(metrics_tab)
+
         tab_control.pack(expand=1, fill="both")
 
         # Console output
@@ -66,6 +224,17 @@ class InterfaceManager:
 
         self.output_text = tk.Text(output_frame, state="normal", wrap="word")
         self.output_text.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        for level, color in LEVEL_COLORS.items():
+            self.output_text.tag_configure(level, foreground=color)
+
+        # Console level filter
+        level_frame = tk.Frame(console_tab)
+        level_frame.pack(side=tk.BOTTOM, fill=tk.X)
+        ttk.Label(level_frame, text="Show:").pack(side=tk.LEFT, padx=10)
+        level_select = ttk.Combobox(level_frame, values=LEVELS, state="readonly", width=10)
+        level_select.set(self.console_level)
+        level_select.bind("<<ComboboxSelected>>", lambda event: self.set_console_level(level_select.get()))
+        level_select.pack(side=tk.LEFT)
 
         # Console input
         input_frame = tk.Frame(console_tab)
@@ -77,6 +246,22 @@ class InterfaceManager:
         send_button = tk.Button(input_frame, text="Send", command=self.send_command)
         send_button.pack(side=tk.RIGHT, padx=10, pady=10)
 
+    def _setup_metrics_tab(self, frame):
+        columns = ("metric", "labels", "count", "p50", "p95", "p99")
+        headings = ("Metric", "Labels", "Count/Value", "p50 (ms)", "p95 (ms)", "p99 (ms)")
+        widths = (160, 300, 80, 70, 70, 70)
+
+        self.metrics_tree = ttk.Treeview(frame, columns=columns, show="headings")
+        for column, heading, width in zip(columns, headings, widths):
+            self.metrics_tree.heading(column, text=heading)
+            self.metrics_tree.column(column, width=width, anchor=tk.W)
+
+        scrollbar = ttk.Scrollbar(frame, orient=tk.VERTICAL, command=self.metrics_tree.yview)
+        self.metrics_tree.configure(yscrollcommand=scrollbar.set)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.metrics_tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        self.metrics_refreshed_at = 0
+
     def _create_service_tab(self, parent, service_name):
         frame = ttk.Frame(parent)
         ttk.Label(frame, text=f"{service_name.capitalize()} Configuration", font=("Calibri", 15)).pack(pady=8)
@@ -104,11 +289,11 @@ class InterfaceManager:
                 api_key = api_key_entry.get()
                 url = url_entry.get()
                 if api_key.strip() and url.strip():
-                    # Save API key and URL
-                    self.service_manager.config["services"][service_name] = {
+                    # Save API key and URL, keeping the rest of the section's settings
+                    self.service_manager.config["services"].setdefault(service_name, {}).update({
                         "api_key": api_key,
                         "url": url,
-                    }
+                    })
                     self.service_manager.save_config()
                     self.add_console_text(f"{service_name.capitalize()} configuration saved!")
                 else:
@@ -159,8 +344,8 @@ class InterfaceManager:
         #     print("Error: Command cannot be empty.")
         self.user_input.delete(0, tk.END)
 
-    def start(self):
-        threading.Thread(target=self.root.mainloop, daemon=True).start()
+def _format_label_key(key):
+    return ", ".join(f"{name}={value}" for name, value in key)
 
 class InterfaceMessageService(MessageService):
     def __init__(self, interface):
@@ -197,3 +382,4 @@ if __name__ == "__main__":
     # Create and start the interface
     interface = InterfaceManager(service_manager, command_processor)
     interface.start()
+    interface.thread.join()
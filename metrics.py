@@ -0,0 +1,259 @@
+import bisect
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Histogram bucket upper bounds in seconds, from sub-millisecond rule parses to slow SLM decodes
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# How many recent observations per label set are kept to compute percentiles
+PERCENTILE_WINDOW = 1024
+
+class Counter:
+    """
+    A monotonically increasing count per label set, e.g. messages handled per message service.
+    """
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        """
+        Returns:
+        list<(tuple, float)>: (label key, value) for each label set
+        """
+        with self._lock:
+            return list(self._values.items())
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        for key, value in self.samples():
+            lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+class Gauge:
+    """
+    A value per label set that's read when the metrics are collected, from a callback returning
+      a list of (label dict, value) pairs, e.g. message queue depths.
+    """
+
+    def __init__(self, name, description, collect):
+        self.name = name
+        self.description = description
+        self.collect = collect
+
+    def samples(self):
+        try:
+            return [(_label_key(labels), value) for labels, value in self.collect()]
+        except Exception as e:
+            print(f"WARNING: Failed to collect gauge {self.name}: {e}")
+            return []
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} gauge"]
+        for key, value in self.samples():
+            lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+class Histogram:
+    """
+    Bucketed durations per label set, in the Prometheus histogram format. The most recent
+      observations are also kept to compute exact percentiles for the interface.
+    """
+
+    def __init__(self, name, description, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(buckets))
+        # label key -> [bucket counts, sum, count, recent observations]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if(series is None):
+                series = [[0] * len(self.buckets), 0.0, 0, deque(maxlen=PERCENTILE_WINDOW)]
+                self._series[key] = series
+
+            index = bisect.bisect_left(self.buckets, value)
+            if(index < len(self.buckets)):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+            series[3].append(value)
+
+    def time(self, **labels):
+        """
+        Time a block of code, e.g. with histogram.time(stage="ha_request"): ...
+        """
+        return _Timer(self, labels)
+
+    def percentiles(self, quantiles=(0.5, 0.95, 0.99)):
+        """
+        Get percentiles over the recent observations of each label set.
+
+        Returns:
+        dict: Label key -> {"count": total observations, quantile: seconds, ...}
+        """
+        with self._lock:
+            windows = {key: (series[2], sorted(series[3])) for key, series in self._series.items()}
+
+        result = {}
+        for key, (count, window) in windows.items():
+            values = {"count": count}
+            for quantile in quantiles:
+                values[quantile] = window[min(len(window) - 1, int(len(window) * quantile))]
+            result[key] = values
+        return result
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series_list = [(key, list(series[0]), series[1], series[2]) for key, series in self._series.items()]
+
+        for key, bucket_counts, total, count in series_list:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', repr(bound)),))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+class MetricsRegistry:
+    """
+    The MetricsRegistry holds every metric of the program so they can be rendered together for
+      the metrics endpoint and the interface. Metrics are created on first use by name.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, description=""):
+        return self._get_or_create(name, lambda: Counter(name, description))
+
+    def histogram(self, name, description="", buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(name, lambda: Histogram(name, description, buckets))
+
+    def gauge(self, name, description, collect):
+        return self._get_or_create(name, lambda: Gauge(name, description, collect))
+
+    def metrics(self):
+        with self._lock:
+            return list(self._metrics.values())
+
+    def render(self):
+        """
+        Render every metric in the Prometheus text exposition format.
+
+        Returns:
+        string: The metrics text
+        """
+        lines = []
+        for metric in self.metrics():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def _get_or_create(self, name, create):
+        with self._lock:
+            if(name not in self._metrics):
+                self._metrics[name] = create()
+            return self._metrics[name]
+
+class MetricsServer:
+    """
+    Serves a MetricsRegistry over HTTP at /metrics in the Prometheus text format, on its own thread.
+    """
+
+    def __init__(self, registry, host="127.0.0.1", port=9464):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        """
+        Start serving. The metrics are optional, so if the address can't be bound (e.g. the port is
+          taken by another instance) it's only a warning and the program runs without them.
+
+        Returns:
+        bool: Whether the server started
+        """
+        registry = self.registry
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if(self.path.split("?")[0] != "/metrics"):
+                    self.send_error(404)
+                    return
+
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Scrapes would flood the console
+                pass
+
+        try:
+            self._server = ThreadingHTTPServer((self.host, self.port), MetricsHandler)
+        except OSError as e:
+            print(f"WARNING: Failed to start the metrics endpoint on {self.host}:{self.port}: {e}")
+            return False
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="metrics-server", daemon=True)
+        self._thread.start()
+        print(f"Serving metrics at http://{self.host}:{self.port}/metrics")
+        return True
+
+    def stop(self):
+        if(self._server is not None):
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+def _format_labels(key):
+    if(len(key) == 0):
+        return ""
+    pairs = []
+    for name, value in key:
+        value = value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+# The program's metrics, shared so any module can record to it
+registry = MetricsRegistry()
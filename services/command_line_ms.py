@@ -1,9 +1,20 @@
+import os
+import sys
+import select
+from collections import deque
+
 from services.message_service import MessageService
 
+# Seconds between checks that the command line should still be waiting for input
+INPUT_POLL_INTERVAL = 0.25
+
 class CommandLine(MessageService):
 	def __init__(self):
 		super().__init__()
 		self.is_ready = True
+		# Lines read from stdin that haven't been received yet, and the start of the next line
+		self._pending_lines = deque()
+		self._partial_line = b""
 
 	def load_config(self, config):
 		return True, ""
@@ -11,18 +22,53 @@ class CommandLine(MessageService):
 	def run_service(self):
 		self.await_commands = True
 		while self.await_commands:
-			self.recieve_message(self.await_message())
+			message = self.await_message()
+			if(message is not None):
+				self.recieve_message(message)
 
 	def stop_service(self):
-		print("WARNING: Stopping command line, right now it's waiting for user input, input anything to console and press enter to continue.")
 		self.await_commands = False
 
 	def await_message(self):
-		# Right now, theres a problem with threading where, when the input is expecting a string but
-		#   thread gets killed it will throw an error. From what I can tell there's no good way to fix
-		#   this.
-		return input(f"Enter a message/command: ")
+		# input can't be interrupted, so where stdin can be polled it's read as it becomes available
+		#   and the command line notices it's being stopped. Otherwise the thread stays blocked in
+		#   input and is abandoned when the ServiceManager's stop deadline is up
+		if(not _stdin_pollable()):
+			try:
+				return input(f"Enter a message/command: ")
+			except EOFError:
+				self.await_commands = False
+				return None
+
+		if(len(self._pending_lines) == 0):
+			print("Enter a message/command: ", end="")
+		while len(self._pending_lines) == 0:
+			if(not self.await_commands):
+				return None
+			if(not select.select([sys.stdin], [], [], INPUT_POLL_INTERVAL)[0]):
+				continue
+
+			data = os.read(sys.stdin.fileno(), 4096)
+			if(len(data) == 0):
+				# stdin was closed, there won't be any more commands
+				self.await_commands = False
+				return None
+			lines = (self._partial_line + data).split(b"\n")
+			self._partial_line = lines.pop()
+			self._pending_lines.extend(line.decode(errors="replace").rstrip("\r") for line in lines)
+
+		return self._pending_lines.popleft()
 	
 	def send_message(self, message, in_response_to):
 		print(message)        
-		return
\ No newline at end of file
+		return
+
+def _stdin_pollable():
+	# select only works on sockets on Windows
+	if(os.name == "nt"):
+		return False
+	try:
+		sys.stdin.fileno()
+		return True
+	except (AttributeError, OSError, ValueError):
+		return False
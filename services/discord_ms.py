@@ -23,10 +23,6 @@ class DiscordBot(MessageService):
 
 	def __init__(self):
 		super().__init__()
-		# A dictionary of string messages and the userMessage object associated with it, we can use
-		#   this in send_message along with the "in_response_to" variable to access the incoming
-		#   userMessage object
-		self.message_metadata = {}
 		self.authorized_users = {}
 
 	def load_config(self, config):
@@ -95,10 +91,6 @@ class DiscordBot(MessageService):
 		msg_content = user_msg.content
 		msg_author = user_msg.author
 
-		# Store message metadata for when the program is ready to respond
-		self.message_metadata[msg_content] = user_msg
-		self.last_message = user_msg
-
 		# print message; not necessary, just used to illustrate
 		print(f"Received discord message from {msg_author}: {msg_content}")
 
@@ -106,25 +98,25 @@ class DiscordBot(MessageService):
 		# only authorized users should be able to modify the state of a device
 		if msg_author.name not in self.authorized_users:
 			# notify user that they are not authorized. do not process the command further.
-			self.send_message(f"Sorry <@{msg_author.id}>, you are not authorized to do that.", msg_content)
+			await user_msg.channel.send(f"Sorry <@{msg_author.id}>, you are not authorized to do that.")
 			return
 
-		# Recieve the message as a message service
-		self.recieve_message(msg_content)
+		# Recieve the message as a message service, each channel's messages are handled in order
+		#   and replies go to the message's channel
+		self.recieve_message(msg_content, user_msg.channel.id, user_msg)
 
 	### Abstract Class Functions
 	# Not implementing await message since discord.py has the on_message event callback
 	def await_message(self):
 		return
 
-	# Send a message back to the discord chat
+	# Send a message back to the discord chat, in the channel of the userMessage kept as the
+	#   envelope's reply handle
 	def send_message(self, message, in_response_to):
-		userMessage = self.last_message
-		if(in_response_to in self.message_metadata):
-			userMessage = self.message_metadata[in_response_to]
+		userMessage = in_response_to.reply_handle
 
 		if(userMessage is None):
-			print(f"ERROR: Failed to respond to message \"{in_response_to}\"")
+			print(f"ERROR: Failed to respond to message \"{in_response_to.text}\", it's no longer known")
 			return
 
 		asyncio.run_coroutine_threadsafe(userMessage.channel.send(message), self.bot.loop)
\ No newline at end of file
@@ -1,7 +1,13 @@
 import os
-import requests
+import json
+import time
+import asyncio
+import threading
+
+import aiohttp
 
 from services.service import Service
+from ttl_cache import TTLCache
 
 def load_home_assistant():
 	# TODO: Load homeassistant instance from configuration file/via message service
@@ -26,9 +32,36 @@ class HomeAssistantController(Service):
 	"""
 	This class will be the way our program controls HomeAssistant, we should provide functionality here
 	  for the rest of the program to access HomeAssistant.
+	Requests are made with aiohttp on an event loop running in its own thread, sharing one pooled
+	  keep-alive session. The async_ methods can be awaited on that loop (see submit) so many
+	  service calls can be in flight at once, the plain methods are blocking wrappers around them.
+	With use_websocket, the controller subscribes to HomeAssistant's state_changed events and keeps
+	  a local mirror of every entity's state, so entity listings are memory reads instead of REST
+	  calls. Entity listeners are told when entities appear or disappear, on their own thread and
+	  batched over entity_debounce seconds so a burst of changes is one call.
 	"""
 	def __init__(self):
 		super().__init__(False)
+		self.loop = None
+		self.session = None
+		self._loop_thread = None
+		self._loop_lock = threading.Lock()
+		self._semaphore = None
+
+		# entity_id -> state dictionary, kept up to date by the websocket while mirror_live is set
+		self.states = {}
+		self.mirror_live = threading.Event()
+		self._states_lock = threading.Lock()
+		self._entity_listeners = []
+		self._websocket_task = None
+		# Entity changes not yet given to the listeners, see _deliver_entity_changes
+		self._pending_added = set()
+		self._pending_removed = set()
+		self._pending_changed = threading.Condition()
+		self._listener_thread = None
+
+		# entity_id -> state dictionary from the REST API, for state queries while the mirror isn't live
+		self.state_cache = None
 
 	def load_config(self, config):
 		if(not "url" in config.keys()):
@@ -49,49 +82,463 @@ class HomeAssistantController(Service):
 			"Authorization": f"Bearer {self.long_term_key}",
 			"Content-Type": "application/json"
 		}
+
+		# Connection settings, all optional
+		try:
+			self.pool_size = int(config.get("pool_size", 10))
+			self.connect_timeout = float(config.get("connect_timeout", 3.05))
+			self.read_timeout = float(config.get("read_timeout", 10))
+			self.max_retries = int(config.get("max_retries", 3))
+			self.retry_backoff = float(config.get("retry_backoff", 0.5))
+			self.max_concurrency = int(config.get("max_concurrency", 8))
+			self.use_websocket = bool(config.get("use_websocket", False))
+			self.state_ttl = float(config.get("state_ttl", 10))
+			self.state_cache_size = int(config.get("state_cache_size", 1024))
+			self.entity_debounce = float(config.get("entity_debounce", 0.5))
+		except (TypeError, ValueError) as e:
+			return False, f"Invalid connection setting: {e}"
+
+		self.state_cache = TTLCache(self.state_cache_size, self.state_ttl)
+
 		return True, ""
 
-	def run_service(self): # HA controller doesn't use these methods
-		return
+	def run_service(self):
+		if(self.use_websocket):
+			self._websocket_task = self.submit(self._run_websocket())
 	
-	def stop_service(self): # HA controller doesn't use these methods
-		return
+	def stop_service(self):
+		if(self._websocket_task is not None):
+			self._websocket_task.cancel()
+			self._websocket_task = None
+		self.mirror_live.clear()
 
-	def make_request(self, action_url, entity_id):
+		with self._pending_changed:
+			listener_thread = self._listener_thread
+			self._listener_thread = None
+			self._pending_changed.notify()
+		if(listener_thread is not None):
+			listener_thread.join(timeout=5)
+
+		with self._loop_lock:
+			if(self.loop is None):
+				return
+
+			if(self.session is not None):
+				asyncio.run_coroutine_threadsafe(self.session.close(), self.loop).result(timeout=5)
+				self.session = None
+			self.loop.call_soon_threadsafe(self.loop.stop)
+			self._loop_thread.join(timeout=5)
+			self.loop = None
+
+#region Event loop
+	def submit(self, coroutine):
 		"""
-		Make a request to the HomeAssistant instance.
+		Run a coroutine on the controller's event loop, starting the loop if it isn't running yet.
+
 		Parameters:
-		action_label (string): the end of the service_call_url, labeling the action to be performed.
-		i.e. ha_url/api/services/<action_label>
-		entity_label (string): the HomeAssistant entity id
-		i.e. lock.front_door
+		coroutine (coroutine): e.g. self.async_make_request(action_url, entity_id)
 
 		Returns:
-		bool: Request success status
+		concurrent.futures.Future: Resolves to the coroutine's result
+		"""
+		with self._loop_lock:
+			if(self.loop is None):
+				self.loop = asyncio.new_event_loop()
+				self._loop_thread = threading.Thread(target=self.loop.run_forever, name="home-assistant-loop", daemon=True)
+				self._loop_thread.start()
+			loop = self.loop
+
+		return asyncio.run_coroutine_threadsafe(coroutine, loop)
+
+	def _run(self, coroutine):
+		# Blocking on the loop from the loop's own thread would deadlock
+		if(threading.current_thread() is self._loop_thread):
+			coroutine.close()
+			raise RuntimeError("Use the async_ methods from the HomeAssistant event loop.")
+		return self.submit(coroutine).result()
+
+	def _get_session(self):
+		# Must be called on the event loop, the session and semaphore are bound to it
+		if(self.session is None):
+			self.session = aiohttp.ClientSession(
+				headers=self.headers,
+				connector=aiohttp.TCPConnector(limit=self.pool_size),
+				timeout=aiohttp.ClientTimeout(total=None, sock_connect=self.connect_timeout, sock_read=self.read_timeout)
+			)
+			self._semaphore = asyncio.Semaphore(self.max_concurrency)
+		return self.session
+
+	async def _request(self, method, url, data=None):
+		"""
+		Make an HTTP request to HomeAssistant, limited to max_concurrency requests at once.
+		Failed connections are retried with exponential backoff, but a request that reached
+		  HomeAssistant is only retried if it's idempotent (GET), so service calls never run twice.
+
+		Returns:
+		(int, string): The response status and text
+		"""
+		session = self._get_session()
+		idempotent = method == "GET"
+
+		attempt = 0
+		while True:
+			try:
+				async with self._semaphore:
+					async with session.request(method, url, json=data) as response:
+						text = await response.text()
+				if(not idempotent or response.status not in (502, 503, 504) or attempt >= self.max_retries):
+					return response.status, text
+			except aiohttp.ClientConnectorError:
+				# The request never reached HomeAssistant
+				if(attempt >= self.max_retries):
+					raise
+			except (aiohttp.ClientError, asyncio.TimeoutError):
+				if(not idempotent or attempt >= self.max_retries):
+					raise
+
+			await asyncio.sleep(self.retry_backoff * (2 ** attempt))
+			attempt += 1
+#endregion
+
+#region State mirror
+	def add_entity_listener(self, listener):
+		"""
+		Register a callback for when entities appear in or disappear from the state mirror. It's
+		  called on the controller's listener thread as listener(added_entity_ids, removed_entity_ids),
+		  with every change from the last entity_debounce seconds.
+		"""
+		self._entity_listeners.append(listener)
+
+	def _notify_entity_listeners(self, added, removed):
+		# Listeners can be slow (the command processor rebuilds its matchers), so they're queued for
+		#   the listener thread instead of holding up the event loop
+		if(len(added) == 0 and len(removed) == 0):
+			return
+		with self._pending_changed:
+			# An entity that appears and disappears within one batch cancels out
+			for entity_id in added:
+				if(entity_id in self._pending_removed):
+					self._pending_removed.discard(entity_id)
+				else:
+					self._pending_added.add(entity_id)
+			for entity_id in removed:
+				if(entity_id in self._pending_added):
+					self._pending_added.discard(entity_id)
+				else:
+					self._pending_removed.add(entity_id)
+
+			if(self._listener_thread is None):
+				self._listener_thread = threading.Thread(target=self._deliver_entity_changes, name="home-assistant-listeners", daemon=True)
+				self._listener_thread.start()
+			self._pending_changed.notify()
+
+	def _deliver_entity_changes(self):
+		"""
+		Listener thread, waits for entity changes and gives them to the listeners once entity_debounce
+		  seconds have passed without another change. Exits when stop_service clears _listener_thread.
+		"""
+		current_thread = threading.current_thread()
+		while True:
+			with self._pending_changed:
+				while(len(self._pending_added) == 0 and len(self._pending_removed) == 0):
+					if(self._listener_thread is not current_thread):
+						return
+					self._pending_changed.wait()
+				# Wait out the burst, every notify restarts the window, but a burst that doesn't end
+				#   is still delivered every 10 windows
+				deadline = time.monotonic() + self.entity_debounce * 10
+				while(self._listener_thread is current_thread and time.monotonic() < deadline):
+					if(not self._pending_changed.wait(self.entity_debounce)):
+						break
+				if(self._listener_thread is not current_thread):
+					return
+
+				added = list(self._pending_added)
+				removed = list(self._pending_removed)
+				self._pending_added.clear()
+				self._pending_removed.clear()
+
+			for listener in self._entity_listeners:
+				try:
+					listener(added, removed)
+				except Exception as e:
+					print(f"Error: Entity listener failed: {e}")
+
+	def _mirrored_entities(self):
+		# The mirrored states as a get_all_entities result, None if the mirror isn't live
+		if(not self.mirror_live.is_set()):
+			return None
+		with self._states_lock:
+			return list(self.states.values())
+
+	def _websocket_url(self):
+		url = self.ha_url.rstrip("/")
+		if(url.startswith("https://")):
+			url = "wss://" + url[len("https://"):]
+		elif(url.startswith("http://")):
+			url = "ws://" + url[len("http://"):]
+		return f"{url}/api/websocket"
+
+	async def _run_websocket(self):
+		"""
+		Keep a websocket connection to HomeAssistant open, reconnecting with backoff when it drops.
+		While disconnected the mirror isn't live and reads fall back to the REST API.
+		"""
+		backoff = 1
+		while True:
+			try:
+				await self._mirror_states()
+			except asyncio.CancelledError:
+				raise
+			except PermissionError as e:
+				print(f"Error: HomeAssistant websocket authentication failed: {e}")
+				return
+			except Exception as e:
+				print(f"WARNING: HomeAssistant websocket disconnected: {e}")
+
+			# Only a connection that got the mirror live resets the backoff, one that keeps failing
+			#   before then (e.g. on the state snapshot) isn't retried every second
+			if(self.mirror_live.is_set()):
+				backoff = 1
+			self.mirror_live.clear()
+			await asyncio.sleep(backoff)
+			backoff = min(backoff * 2, 30)
+
+	async def _mirror_states(self):
+		session = self._get_session()
+		# The get_states snapshot of a few thousand entities is larger than aiohttp's default 4MB
+		#   message limit, so messages aren't limited
+		async with session.ws_connect(self._websocket_url(), heartbeat=30, max_msg_size=0) as websocket:
+			# Authenticate, HomeAssistant sends auth_required first
+			await websocket.receive_json()
+			await websocket.send_json({"type": "auth", "access_token": self.long_term_key})
+			auth_result = await websocket.receive_json()
+			if(auth_result.get("type") != "auth_ok"):
+				raise PermissionError(auth_result.get("message", auth_result.get("type")))
+
+			# Subscribe before taking the snapshot so no change falls between the two
+			await websocket.send_json({"id": 1, "type": "subscribe_events", "event_type": "state_changed"})
+			await websocket.send_json({"id": 2, "type": "get_states"})
+
+			async for message in websocket:
+				if(message.type == aiohttp.WSMsgType.ERROR):
+					raise ConnectionError(f"Websocket error: {websocket.exception()}")
+				if(message.type != aiohttp.WSMsgType.TEXT):
+					break
+
+				data = json.loads(message.data)
+				if(data.get("type") == "result" and data.get("id") == 2):
+					self._replace_states(data["result"])
+					self.mirror_live.set()
+				elif(data.get("type") == "event" and data.get("id") == 1):
+					event_data = data["event"]["data"]
+					self._apply_state_change(event_data["entity_id"], event_data.get("new_state"))
+
+			raise ConnectionError(f"HomeAssistant closed the websocket (code {websocket.close_code})")
+
+	def _replace_states(self, states):
+		with self._states_lock:
+			previous = set(self.states.keys())
+			self.states = {state["entity_id"]: state for state in states}
+			current = set(self.states.keys())
+
+		self._notify_entity_listeners(list(current - previous), list(previous - current))
+
+	def _apply_state_change(self, entity_id, new_state):
+		with self._states_lock:
+			existed = entity_id in self.states
+			if(new_state is None):
+				self.states.pop(entity_id, None)
+			else:
+				self.states[entity_id] = new_state
+
+		if(new_state is None and existed):
+			self._notify_entity_listeners([], [entity_id])
+		elif(new_state is not None and not existed):
+			self._notify_entity_listeners([entity_id], [])
+#endregion
+
+#region State cache
+	def _local_state(self, entity_id):
+		# An entity's state without a request, None if it isn't mirrored or cached
+		if(self.mirror_live.is_set()):
+			with self._states_lock:
+				state = self.states.get(entity_id)
+			if(state is not None):
+				return state
+		if(self.state_cache is None):
+			return None
+		return self.state_cache.get(entity_id)
+
+	def _cache_states(self, states):
+		if(self.state_cache is None):
+			return
+		for state in states:
+			self.state_cache.put(state["entity_id"], state)
+#endregion
+
+	async def async_make_request(self, action_url, entity_id):
+		"""
+		Make a request to the HomeAssistant instance, see make_request.
 		"""
+		if(isinstance(entity_id, str)):
+			return await self._call_service(action_url, entity_id)
+
+		# One service call per domain, each with every entity id of that domain
+		service = action_url.split("/")[-1]
+		groups = {}
+		for group_entity_id in entity_id:
+			groups.setdefault(group_entity_id.split(".")[0], []).append(group_entity_id)
+
+		results = await asyncio.gather(
+			*(self._call_service(f"{domain}/{service}", entity_ids) for domain, entity_ids in groups.items()),
+			return_exceptions=True
+		)
+
+		success = True
+		texts = []
+		for result in results:
+			if(isinstance(result, Exception)):
+				success, text = False, repr(result)
+			else:
+				status, text = result
+				success = success and status
+			texts.append(text)
+		return (success, "\n".join(texts))
 
+	async def _call_service(self, action_url, entity_id):
 		service_call_url = f"{self.ha_url}/api/services/{action_url}"
 		data = {
 			"entity_id": entity_id
 		}
 
 		# Sending the POST request to the service call endpoint
-		response = requests.post(service_call_url, headers=self.headers, json=data)
+		status, text = await self._request("POST", service_call_url, data)
+
+		# HomeAssistant responds with the states the call changed, keep them for state queries
+		if(status == 200):
+			try:
+				self._cache_states(json.loads(text))
+			except (ValueError, TypeError, KeyError):
+				pass
+
+		return (status == 200, text)
+
+	async def async_make_requests(self, requests):
+		"""
+		Make several requests to the HomeAssistant instance concurrently, see make_requests.
+		"""
+		return await asyncio.gather(
+			*(self.async_make_request(action_url, entity_id) for action_url, entity_id in requests),
+			return_exceptions=True
+		)
+
+	async def async_get_all_entities(self):
+		"""
+		Retrieves all entities from the Home Assistant instance, see get_all_entities.
+		"""
+		mirrored = self._mirrored_entities()
+		if(mirrored is not None):
+			return mirrored
+
+		url = f"{self.ha_url}/api/states"
+		status, text = await self._request("GET", url)
+		if(status >= 400):
+			raise HomeAssistantError(status, text)
+		states = json.loads(text)
+		self._cache_states(states)
+		return states
+
+	async def async_get_entity_state(self, entity_id):
+		"""
+		Retrieves one entity's state, see get_entity_state.
+		"""
+		state = self._local_state(entity_id)
+		if(state is not None):
+			return state
 
-		return (response.status_code == 200, response.text)
+		url = f"{self.ha_url}/api/states/{entity_id}"
+		status, text = await self._request("GET", url)
+		if(status == 404):
+			return None
+		if(status >= 400):
+			raise HomeAssistantError(status, text)
+		state = json.loads(text)
+		self._cache_states([state])
+		return state
+
+	def make_request(self, action_url, entity_id):
+		"""
+		Make a request to the HomeAssistant instance.
+		Parameters:
+		action_label (string): the end of the service_call_url, labeling the action to be performed.
+		i.e. ha_url/api/services/<action_label>
+		entity_label (string or list<string>): the HomeAssistant entity id, or a list of them
+		i.e. lock.front_door
+		A list is grouped by domain and sent as a single service call per domain, calling the
+		  action's service in each entity's domain (e.g. light/turn_on and switch/turn_on).
+
+		Returns:
+		bool, string: Request success status (whether every call succeeded), the response text(s)
+		"""
+		return self._run(self.async_make_request(action_url, entity_id))
+
+	def make_requests(self, requests):
+		"""
+		Make several requests to the HomeAssistant instance concurrently.
+
+		Parameters:
+		requests (list<(string, string)>): (action_url, entity_id) pairs, see make_request
+
+		Returns:
+		list: A (success status, response text) tuple per request, or the exception it raised
+		"""
+		return self._run(self.async_make_requests(requests))
 
 	def get_all_entities(self):
 		"""
-		Retrieves all entities from the Home Assistant instance.
+		Retrieves all entities from the Home Assistant instance, from the state mirror when it's live.
 
 		Returns:
 		list: A list of dictionaries containing information about each entity.
 		
 		Raises:
-		requests.exceptions.RequestException: If there is an issue with the HTTP request.
+		aiohttp.ClientError: If there is an issue with the HTTP request, HomeAssistantError if
+		  HomeAssistant responds with an error status.
 		"""
+		mirrored = self._mirrored_entities()
+		if(mirrored is not None):
+			return mirrored
+		return self._run(self.async_get_all_entities())
 
-		url = f"{self.ha_url}/api/states"
-		response = requests.get(url, headers=self.headers)
-		response.raise_for_status()  # Raises an HTTPError if the HTTP request returned an unsuccessful status code
-		return response.json()
\ No newline at end of file
+	def get_entity_state(self, entity_id):
+		"""
+		Retrieves one entity's state. It's read from the state mirror when it's live, otherwise from
+		  the state cache if it was fetched less than state_ttl seconds ago, otherwise from
+		  HomeAssistant's /api/states/<entity_id>.
+		Parameters:
+		entity_id (string): the HomeAssistant entity id
+		i.e. lock.front_door
+
+		Returns:
+		dict: The entity's state dictionary (entity_id, state, attributes, ...), None if HomeAssistant
+		  doesn't have the entity
+
+		Raises:
+		aiohttp.ClientError: If there is an issue with the HTTP request, HomeAssistantError if
+		  HomeAssistant responds with an error status.
+		"""
+		state = self._local_state(entity_id)
+		if(state is not None):
+			return state
+		return self._run(self.async_get_entity_state(entity_id))
+
+class HomeAssistantError(aiohttp.ClientError):
+	"""
+	HomeAssistant responded to a request with an error status, e.g. 401 for a wrong api_key.
+	"""
+
+	def __init__(self, status, text):
+		super().__init__(f"HomeAssistant responded with {status}: {text}")
+		self.status = status
+		self.text = text
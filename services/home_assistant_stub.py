@@ -0,0 +1,232 @@
+import asyncio
+import threading
+import time
+
+from aiohttp import web, WSMsgType
+
+# Service calls the stub understands, mapped to the state they leave the entity in
+SERVICE_STATES = {
+	"lock": "locked",
+	"unlock": "unlocked",
+	"open": "open",
+	"turn_on": "on",
+	"turn_off": "off"
+}
+
+class HomeAssistantStub:
+	"""
+	A local stand-in for a HomeAssistant instance, for developing and testing against without a
+	  real one. It serves the parts of the REST API HomeAssistantController uses (/api/states,
+	  /api/states/<entity_id>, /api/services/<domain>/<service>) and the websocket API's auth,
+	  get_states and state_changed subscription.
+	The server runs on its own event loop thread, entities can be changed from any thread with
+	  set_state and remove_entity and subscribers are sent the matching state_changed events.
+
+	Run it standalone with: python -m services.home_assistant_stub
+	"""
+
+	def __init__(self, access_token="stub_token", entities=None):
+		"""
+		Parameters:
+		access_token (string): The API key clients must use
+		entities (dict): Initial entity_id -> state string
+		"""
+		self.access_token = access_token
+		self.states = {}
+		# Every service call received, as (domain/service, request json)
+		self.service_calls = []
+
+		for entity_id, state in (entities or {}).items():
+			self.states[entity_id] = self._make_state(entity_id, state)
+
+		self.url = None
+		self.loop = None
+		self._subscribers = set()
+		self._websockets = set()
+		self._runner = None
+		self._thread = None
+
+	def start(self, host="127.0.0.1", port=0):
+		"""
+		Start serving on a background thread.
+
+		Returns:
+		string: The stub's base URL, to be used as the home_assistant config's url
+		"""
+		started = threading.Event()
+
+		def run():
+			self.loop = asyncio.new_event_loop()
+			asyncio.set_event_loop(self.loop)
+			self.loop.run_until_complete(self._start_server(host, port))
+			started.set()
+			self.loop.run_forever()
+
+		self._thread = threading.Thread(target=run, name="home-assistant-stub", daemon=True)
+		self._thread.start()
+		started.wait()
+		return self.url
+
+	def stop(self):
+		"""
+		Stop serving and close every websocket.
+		"""
+		asyncio.run_coroutine_threadsafe(self._stop_server(), self.loop).result(timeout=5)
+		self.loop.call_soon_threadsafe(self.loop.stop)
+		self._thread.join(timeout=5)
+
+	def set_state(self, entity_id, state):
+		"""
+		Add or update an entity, notifying websocket subscribers.
+		"""
+		asyncio.run_coroutine_threadsafe(self._set_state(entity_id, state), self.loop).result(timeout=5)
+
+	def remove_entity(self, entity_id):
+		"""
+		Remove an entity, notifying websocket subscribers.
+		"""
+		asyncio.run_coroutine_threadsafe(self._set_state(entity_id, None), self.loop).result(timeout=5)
+
+	def _make_state(self, entity_id, state):
+		now = time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime())
+		return {
+			"entity_id": entity_id,
+			"state": state,
+			"attributes": {"friendly_name": entity_id.split(".", 1)[-1].replace("_", " ").title()},
+			"last_changed": now,
+			"last_updated": now
+		}
+
+	async def _start_server(self, host, port):
+		app = web.Application()
+		app.router.add_get("/api/states", self._get_states)
+		app.router.add_get("/api/states/{entity_id}", self._get_state)
+		app.router.add_post("/api/services/{domain}/{service}", self._call_service)
+		app.router.add_get("/api/websocket", self._websocket)
+
+		self._runner = web.AppRunner(app)
+		await self._runner.setup()
+		site = web.TCPSite(self._runner, host, port)
+		await site.start()
+
+		bound_port = site._server.sockets[0].getsockname()[1]
+		self.url = f"http://{host}:{bound_port}"
+
+	async def _stop_server(self):
+		# Open websockets would hold up the cleanup until they time out
+		for websocket in list(self._websockets):
+			await websocket.close()
+		await self._runner.cleanup()
+
+	def _authorized(self, request):
+		return request.headers.get("Authorization") == f"Bearer {self.access_token}"
+
+	async def _set_state(self, entity_id, state):
+		old_state = self.states.get(entity_id)
+		if(state is None):
+			new_state = None
+			self.states.pop(entity_id, None)
+		else:
+			new_state = self._make_state(entity_id, state)
+			self.states[entity_id] = new_state
+
+		event = {
+			"type": "event",
+			"event": {
+				"event_type": "state_changed",
+				"data": {"entity_id": entity_id, "old_state": old_state, "new_state": new_state}
+			}
+		}
+		for websocket, subscription_id in list(self._subscribers):
+			await websocket.send_json({**event, "id": subscription_id})
+
+#region REST API
+	async def _get_states(self, request):
+		if(not self._authorized(request)):
+			return web.json_response({"message": "Unauthorized"}, status=401)
+		return web.json_response(list(self.states.values()))
+
+	async def _get_state(self, request):
+		if(not self._authorized(request)):
+			return web.json_response({"message": "Unauthorized"}, status=401)
+		state = self.states.get(request.match_info["entity_id"])
+		if(state is None):
+			return web.json_response({"message": "Entity not found."}, status=404)
+		return web.json_response(state)
+
+	async def _call_service(self, request):
+		if(not self._authorized(request)):
+			return web.json_response({"message": "Unauthorized"}, status=401)
+
+		domain, service = request.match_info["domain"], request.match_info["service"]
+		data = await request.json()
+		self.service_calls.append((f"{domain}/{service}", data))
+
+		entity_ids = data.get("entity_id", [])
+		if(isinstance(entity_ids, str)):
+			entity_ids = [entity_ids]
+
+		changed = []
+		for entity_id in entity_ids:
+			if(entity_id not in self.states):
+				continue
+			state = SERVICE_STATES.get(service)
+			if(service == "toggle"):
+				state = "off" if self.states[entity_id]["state"] == "on" else "on"
+			if(state is not None):
+				await self._set_state(entity_id, state)
+			changed.append(self.states[entity_id])
+
+		return web.json_response(changed)
+#endregion
+
+#region Websocket API
+	async def _websocket(self, request):
+		websocket = web.WebSocketResponse()
+		await websocket.prepare(request)
+
+		await websocket.send_json({"type": "auth_required", "ha_version": "stub"})
+		auth = await websocket.receive_json()
+		if(auth.get("type") != "auth" or auth.get("access_token") != self.access_token):
+			await websocket.send_json({"type": "auth_invalid", "message": "Invalid access token"})
+			await websocket.close()
+			return websocket
+		await websocket.send_json({"type": "auth_ok", "ha_version": "stub"})
+		self._websockets.add(websocket)
+
+		subscriptions = set()
+		try:
+			async for message in websocket:
+				if(message.type != WSMsgType.TEXT):
+					break
+
+				data = message.json()
+				if(data.get("type") == "subscribe_events" and data.get("event_type") == "state_changed"):
+					subscription = (websocket, data["id"])
+					subscriptions.add(subscription)
+					self._subscribers.add(subscription)
+					await websocket.send_json({"id": data["id"], "type": "result", "success": True, "result": None})
+				elif(data.get("type") == "get_states"):
+					await websocket.send_json({"id": data["id"], "type": "result", "success": True, "result": list(self.states.values())})
+				else:
+					await websocket.send_json({"id": data.get("id"), "type": "result", "success": False, "error": {"code": "unknown_command", "message": "Unknown command."}})
+		finally:
+			self._subscribers.difference_update(subscriptions)
+			self._websockets.discard(websocket)
+
+		return websocket
+#endregion
+
+if __name__ == "__main__":
+	stub = HomeAssistantStub(entities={
+		"lock.front_door": "locked",
+		"lock.garage_door": "locked",
+		"light.living_room": "off",
+		"light.porch_light": "off"
+	})
+	url = stub.start(port=8123)
+	print(f"HomeAssistant stub running at {url} with api_key \"{stub.access_token}\", press Ctrl+C to stop.")
+	try:
+		threading.Event().wait()
+	except KeyboardInterrupt:
+		stub.stop()
@@ -0,0 +1,56 @@
+import queue
+
+class MessageDispatcher:
+	"""
+	The MessageDispatcher wakes the CentralController when there's work for it. Message services
+	  notify it when a message lands in their message_queue, and wake can be called from any
+	  thread (or a signal handler) when the controller should check whether it's still running.
+	  The controller blocks in wait until one of those happens, instead of polling every queue in
+	  a loop.
+	"""
+
+	def __init__(self):
+		# (kind, payload) events, kind is "message" or "wake". A SimpleQueue so wake is safe to call
+		#   from a signal handler
+		self._events = queue.SimpleQueue()
+
+	def notify(self, message_service):
+		"""
+		Tell the dispatcher a message is waiting in message_service's message_queue, called by
+		  MessageService#recieve_message.
+
+		Returns:
+		void
+		"""
+		self._events.put(("message", message_service))
+
+	def wake(self):
+		"""
+		Wake the thread that's waiting without a message, e.g. so it notices it should stop.
+
+		Returns:
+		void
+		"""
+		self._events.put(("wake", None))
+
+	def wait(self, timeout=None):
+		"""
+		Block until there's at least one event or the timeout is up, then take every queued event.
+
+		Parameters:
+		timeout (float): The most seconds to block, None to block until there's an event
+
+		Returns:
+		list<(string, object)>: The (kind, payload) events in the order they happened, empty if
+		  the timeout was up first
+		"""
+		try:
+			events = [self._events.get(timeout=timeout)]
+		except queue.Empty:
+			return []
+
+		while True:
+			try:
+				events.append(self._events.get_nowait())
+			except queue.Empty:
+				return events
@@ -1,28 +1,202 @@
+import time
+import itertools
+import threading
 from abc import abstractmethod, ABC
+from collections import deque
 
 from services.service import Service
+from ttl_cache import TTLCache
+
+# Unique ids for received messages, across every message service
+_message_ids = itertools.count(1)
+
+class MessageEnvelope:
+	"""
+	A received message as it's passed from MessageService#recieve_message through the
+	  CentralController to MessageService#send_message. Its message_id is unique, so replies go to
+	  the message they answer even if two users send the same text.
+	The reply handle (e.g. the discord Message to reply to) is kept by the service in a bounded
+	  store keyed by message_id, so it's released once it's too old or too many newer messages
+	  came in, rather than living as long as the envelope.
+	"""
+
+	__slots__ = ("message_id", "service", "text", "conversation_id", "received_at")
+
+	def __init__(self, service, text, conversation_id=None):
+		"""
+		Parameters:
+		service (MessageService): The service the message was received by
+		text (string): The message text
+		conversation_id (hashable): The user/channel the message came from, see MessageService#recieve_message
+		"""
+		self.message_id = next(_message_ids)
+		self.service = service
+		self.text = text
+		self.conversation_id = conversation_id
+		# From time.perf_counter
+		self.received_at = time.perf_counter()
+
+	@property
+	def reply_handle(self):
+		"""
+		The service specific object needed to reply to this message, None if there isn't one or it
+		  has been evicted.
+		"""
+		return self.service.message_contexts.get(self.message_id)
+
+	def __repr__(self):
+		return f"MessageEnvelope({self.message_id}, {type(self.service).__name__}, {self.text!r})"
+
+# What a full MessageQueue does with a new message
+OVERFLOW_POLICIES = ("drop_oldest", "reject", "block")
+
+class MessageQueue:
+	"""
+	A bounded, thread-safe FIFO of received messages. Message services put into it from their own
+	  threads while the CentralController takes from it, both in O(1).
+	When it's full a new message is handled by the overflow policy:
+	  drop_oldest: The oldest waiting message is discarded to make room
+	  reject: The new message is refused, see MessageService#recieve_message
+	  block: The receiving thread waits up to block_timeout seconds for room, then it's refused.
+	    Only use it for services that receive on their own thread, e.g. the command line
+	"""
+
+	def __init__(self, capacity=256, overflow_policy="drop_oldest", block_timeout=5.0):
+		if(capacity <= 0):
+			raise ValueError(f"Invalid queue capacity {capacity}, it must be at least 1.")
+		if(overflow_policy not in OVERFLOW_POLICIES):
+			raise ValueError(f"Invalid overflow policy \"{overflow_policy}\", expected one of {', '.join(OVERFLOW_POLICIES)}.")
+
+		self.capacity = capacity
+		self.overflow_policy = overflow_policy
+		self.block_timeout = block_timeout
+
+		self._messages = deque()
+		self._not_full = threading.Condition()
+
+		# The most messages that have waited at once, and how many were dropped/rejected when full
+		self.high_water = 0
+		self.dropped = 0
+		self.rejected = 0
+
+	def put(self, message):
+		"""
+		Add a message to the end of the queue, applying the overflow policy if it's full.
+
+		Returns:
+		bool: False if the message was refused
+		"""
+		with self._not_full:
+			if(len(self._messages) >= self.capacity):
+				if(self.overflow_policy == "drop_oldest"):
+					self._messages.popleft()
+					self.dropped += 1
+				elif(self.overflow_policy == "reject" or not self._not_full.wait_for(lambda: len(self._messages) < self.capacity, self.block_timeout)):
+					self.rejected += 1
+					return False
+
+			self._messages.append(message)
+			self.high_water = max(self.high_water, len(self._messages))
+			return True
+
+	def get(self):
+		"""
+		Take the message at the front of the queue without blocking.
+
+		Returns:
+		object: The message, None if the queue is empty
+		"""
+		with self._not_full:
+			if(len(self._messages) == 0):
+				return None
+			message = self._messages.popleft()
+			self._not_full.notify()
+			return message
+
+	def __len__(self):
+		return len(self._messages)
+
+	def stats(self):
+		"""
+		Returns:
+		dict: The queue's depth, capacity, high_water mark and dropped/rejected message counts
+		"""
+		with self._not_full:
+			return {
+				"depth": len(self._messages),
+				"capacity": self.capacity,
+				"high_water": self.high_water,
+				"dropped": self.dropped,
+				"rejected": self.rejected
+			}
 
 class MessageService(Service):
 	"""
 	A MessageService can receive messages and send messages. Received messages come from the user
 	  and sent messages are sent to the user.
-	The message_queue should be used to read incoming messages.
+	The message_queue should be used to read incoming messages, as MessageEnvelopes.
 	"""
 	
 	def __init__(self, is_threaded=True):
 		super().__init__(is_threaded)
-		self.message_queue = []
-		self.is_ready = False
+		self.message_queue = MessageQueue()
+		# message_id -> reply handle of recently received messages, see MessageEnvelope
+		self.message_contexts = TTLCache(1024, 3600.0)
+		# Set by the ServiceManager when the service is registered, see MessageDispatcher
+		self.dispatcher = None
 
-	def recieve_message(self, message):
+	def recieve_message(self, message, conversation_id=None, reply_handle=None):
 		"""
-		Callback for when a message is recieved from a message service. Appends the string message
-		  to the end of the message_queue to be picked up by the CentralController.
+		Callback for when a message is recieved from a message service. Wraps the string message in
+		  a MessageEnvelope and appends it to the end of the message_queue to be picked up by the
+		  CentralController, and wakes the dispatcher so it's handled right away. If the queue is
+		  full and refuses the message, the user is told to try again.
+
+		Parameters:
+		message (string): The message text
+		conversation_id (hashable): The user/channel the message came from, messages of the same
+		  conversation are handled in order. None puts every message of the service in one conversation
+		reply_handle (object): What send_message needs to reply to this message, see MessageEnvelope
 
 		Returns:
-		void
+		MessageEnvelope: The received message
+		"""
+		envelope = MessageEnvelope(self, message, conversation_id)
+		if(reply_handle is not None):
+			self.message_contexts.put(envelope.message_id, reply_handle)
+
+		if(not self.message_queue.put(envelope)):
+			print(f"WARNING: {type(self).__name__} message queue is full, rejected \"{message}\"")
+			self.send_message("Too many messages are waiting, please try again in a moment.", envelope)
+			return envelope
+
+		if(self.dispatcher is not None):
+			self.dispatcher.notify(self)
+		return envelope
+
+	def load_message_config(self, config):
+		"""
+		Configure the message_queue and message_contexts from the service's config, called by the
+		  ServiceManager. The optional keys are queue_capacity, queue_overflow (see MessageQueue),
+		  queue_block_timeout, and reply_context_size/reply_context_ttl, how many reply handles are
+		  kept and for how many seconds.
+
+		Parameters:
+		config (dict): The service's config section
+
+		Returns:
+		bool, string: Config load success status, a string detailing problem if any.
 		"""
-		self.message_queue.append(message)
+		try:
+			self.message_queue = MessageQueue(
+				int(config.get("queue_capacity", 256)),
+				config.get("queue_overflow", "drop_oldest"),
+				float(config.get("queue_block_timeout", 5.0))
+			)
+			self.message_contexts = TTLCache(int(config.get("reply_context_size", 1024)), float(config.get("reply_context_ttl", 3600.0)))
+		except (TypeError, ValueError) as e:
+			return False, f"Invalid message setting: {e}"
+		return True, ""
 
 	@abstractmethod
 	def await_message(self):
@@ -39,7 +213,8 @@ class MessageService(Service):
 	@abstractmethod
 	def send_message(self, message, in_response_to):
 		"""
-		Send a message to this message service
+		Send a message to this message service, in_response_to is the MessageEnvelope being
+		  answered
 
 		Returns:
 		void
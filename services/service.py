@@ -18,9 +18,13 @@ class Service(ABC):
 		is_threaded (bool): Should this service be run in it's own thread?
 		"""
 		self.is_threaded = is_threaded
+		# Set once the service can be used, by threaded services themselves. Non-threaded services
+		#   are ready once run_service returns
+		self.is_ready = False
 
 		if(is_threaded):
-			self.thread = threading.Thread(target=self.run_service)
+			# A daemon, so a service that doesn't stop in time can be abandoned at shutdown
+			self.thread = threading.Thread(target=self.run_service, name=type(self).__name__, daemon=True)
 
 	@abstractmethod
 	def load_config(self, config):
@@ -1,11 +1,35 @@
 import os
 import json
+import time
+import threading
+import importlib
+from importlib.metadata import entry_points
 
-from services.home_assistant import HomeAssistantController
 from services.message_service import MessageService
-from services.command_line_ms import CommandLine
-from services.discord_ms import DiscordBot
-from services.telegram_ms import TelegramBot
+from services.message_dispatcher import MessageDispatcher
+
+# Service name -> "module:class" of the built-in services. A service's module is only imported when
+#   it's loaded, so e.g. discord isn't imported unless it's in supported_services
+SERVICE_REGISTRY = {
+    "home_assistant": "services.home_assistant:HomeAssistantController",
+    "command_line": "services.command_line_ms:CommandLine",
+    "discord": "services.discord_ms:DiscordBot",
+    "telegram": "services.telegram_ms:TelegramBot"
+}
+
+# Entry point group other packages can register services in, e.g. in their pyproject.toml:
+#   [project.entry-points."homeassistanthub.services"]
+#   slack = "hah_slack:SlackBot"
+SERVICE_ENTRY_POINT_GROUP = "homeassistanthub.services"
+
+# Seconds a service has to be ready before start_services reports it as slow, and stop_services
+#   waits for each service to stop, unless the service's config section sets
+#   start_timeout/stop_timeout
+DEFAULT_START_TIMEOUT = 10.0
+DEFAULT_STOP_TIMEOUT = 5.0
+
+# Seconds between the readiness reporter's checks of whether the starting services are ready
+READY_POLL_INTERVAL = 0.1
 
 def load_json(file_path):
     """
@@ -54,7 +78,17 @@ default_config = {
     "services": {
         "home_assistant": {
             "url": "",
-            "api_key": ""
+            "api_key": "",
+            "pool_size": 10,
+            "connect_timeout": 3.05,
+            "read_timeout": 10,
+            "max_retries": 3,
+            "retry_backoff": 0.5,
+            "max_concurrency": 8,
+            "use_websocket": False,
+            "state_ttl": 10,
+            "state_cache_size": 1024,
+            "entity_debounce": 0.5
         },
         "discord": {
             "authorized_users": [],
@@ -71,13 +105,20 @@ class ServiceManager():
     The ServiceManager will load all services used by the program, see Service for details.
     It will take the config file from ~/HomeAssistantHub/service_manager.json and try to load each
       service from supported_services. The supported_service names are translated to python objects
-      via _init_service_by_name.
+      via _init_service_by_name, from the service_registry and then the installed entry points in
+      SERVICE_ENTRY_POINT_GROUP.
     Each service's config should have the relevant details pertaining to the service as that
       section will be passed to the service via load_config.
     """
     def __init__(self):
         # Initialize empty services dict
         self.services = {}
+        # Service name -> "module:class" of the services that can be loaded, see register_service_type
+        self.service_registry = dict(SERVICE_REGISTRY)
+        # Woken by message services when they receive a message
+        self.dispatcher = MessageDispatcher()
+        # Set by stop_services so the readiness reporter of start_services stops watching
+        self._stopping = threading.Event()
 
         # Load the location of the config json
         home_dir = os.path.expanduser('~')
@@ -147,6 +188,10 @@ class ServiceManager():
         # Load the config on the service and get the results
         cfg_load_result, cfg_load_problem = service.load_config(self.config["services"][service_name])
 
+        # Message services also get their message queue and reply context settings from their config
+        if(cfg_load_result and isinstance(service, MessageService)):
+            cfg_load_result, cfg_load_problem = service.load_message_config(self.config["services"][service_name])
+
         # Show error if the service failed to load
         if(not cfg_load_result):
             print(f"Failed to load config for service \"{service_name}\": {cfg_load_problem}")
@@ -157,33 +202,140 @@ class ServiceManager():
 
     def register_service(self, service_name, service):
         """
-        Register a service with the service manager by its name.
+        Register a service with the service manager by its name. Message services are attached to
+          the dispatcher so they can wake the CentralController.
         """
         self.services[service_name] = service
+        if(isinstance(service, MessageService)):
+            service.dispatcher = self.dispatcher
 
     def start_services(self):
         """
-        Start all services in the service manager, if the service is threaded we will start its
-          thread, if not, we just call run_service here.
+        Start all services in the service manager concurrently, threaded services on their thread
+          and the run_service of the others on a thread of their own, and return without waiting
+          for them. A reporter thread reports the services that fail to start, that aren't ready
+          within their start_timeout, and when those become ready later.
+
+        Returns:
+        threading.Thread: The reporter thread, it ends once every service is ready or has failed
         """
-        for service in self.services.values():
+        self._stopping.clear()
+        started_at = time.monotonic()
+        runners = {}
+        for service_name, service in self.services.items():
             if(service.is_threaded):
-                service.thread.start()
+                runners[service_name] = service.thread
             else:
-                service.run_service()
+                runners[service_name] = threading.Thread(target=self._run_service, args=(service_name, service), name=f"start-{service_name}", daemon=True)
+            runners[service_name].start()
+
+        reporter = threading.Thread(target=self._report_readiness, args=(runners, started_at), name="service-readiness", daemon=True)
+        reporter.start()
+        return reporter
 
     def stop_services(self):
         """
-        Stop all services in the service manager.
+        Stop all services in the service manager concurrently, waiting up to each service's
+          stop_timeout for it to stop. Services that don't stop in time are reported and abandoned,
+          their threads are daemons so they don't keep the program running.
+
+        Returns:
+        list<string>: The names of the abandoned services
         """
-        for service in self.services.values():
-            print(f"Stopping service: {type(service)}")
-            service.stop_service()
+        self._stopping.set()
+        started_at = time.monotonic()
+        stoppers = {}
+        for service_name, service in self.services.items():
+            print(f"Stopping service: {service_name}")
+            stoppers[service_name] = threading.Thread(target=self._stop_service, args=(service_name, service), name=f"stop-{service_name}", daemon=True)
+            stoppers[service_name].start()
+
+        abandoned = []
+        for service_name, stopper in stoppers.items():
+            timeout = self._service_timeout(service_name, "stop_timeout", DEFAULT_STOP_TIMEOUT)
+            stopper.join(max(0, started_at + timeout - time.monotonic()))
+            if(stopper.is_alive()):
+                print(f"WARNING: Service \"{service_name}\" didn't stop within {timeout}s, abandoning it.")
+                abandoned.append(service_name)
+
+        return abandoned
+
+    def _report_readiness(self, runners, started_at):
+        """
+        Watch the starting services until each is ready or has failed, see start_services. A
+          service whose runner finished without it being ready failed to start.
 
-            if(service.is_threaded):
+        Parameters:
+        runners (dict<string, threading.Thread>): Service name -> the thread starting it
+        started_at (float): The time.monotonic() the services were started at
+
+        Returns:
+        list<string>: The names of the services that failed to start
+        """
+        pending = dict(self.services)
+        slow = set()
+        failed = []
+        summarized = False
+        while len(pending) > 0 and not self._stopping.is_set():
+            elapsed = time.monotonic() - started_at
+            for service_name, service in list(pending.items()):
+                if(service.is_ready):
+                    del pending[service_name]
+                    if(service_name in slow):
+                        print(f"Service \"{service_name}\" is ready after {elapsed:.2f}s.")
+                elif(not runners[service_name].is_alive()):
+                    print(f"WARNING: Service \"{service_name}\" failed to start.")
+                    failed.append(service_name)
+                    del pending[service_name]
+                elif(service_name not in slow and elapsed >= self._service_timeout(service_name, "start_timeout", DEFAULT_START_TIMEOUT)):
+                    print(f"WARNING: Service \"{service_name}\" isn't ready after {elapsed:.2f}s, it's still starting.")
+                    slow.add(service_name)
+
+            # Summarize once every service is ready, failed or past its deadline
+            if(not summarized and all(service_name in slow for service_name in pending)):
+                print(f"Started {len(self.services) - len(failed) - len(pending)}/{len(self.services)} service(s) in {elapsed:.2f}s")
+                summarized = True
+            if(len(pending) > 0):
+                self._stopping.wait(READY_POLL_INTERVAL)
+
+        return failed
+
+    def _run_service(self, service_name, service):
+        # Starts a non-threaded service, it's ready once run_service returns
+        try:
+            service.run_service()
+            service.is_ready = True
+        except Exception as e:
+            print(f"ERROR: Failed to start service \"{service_name}\": {e}")
+
+    def _stop_service(self, service_name, service):
+        try:
+            service.stop_service()
+            # A threaded service's thread isn't alive if it never started
+            if(service.is_threaded and service.thread.is_alive()):
                 service.thread.join()
+        except Exception as e:
+            print(f"ERROR: Failed to stop service \"{service_name}\": {e}")
+        service.is_ready = False
+
+    def _service_timeout(self, service_name, key, default):
+        return self.config["services"].get(service_name, {}).get(key, default)
 #endregion
 
+    def register_service_type(self, service_name, target):
+        """
+        Make a service loadable by name, e.g. from a supported_services entry.
+
+        Parameters:
+        service_name (string): The config name of the service
+        target (string): Where the service's class is, as "module:class". The module is imported
+          when the service is loaded
+
+        Returns:
+        void
+        """
+        self.service_registry[service_name] = target
+
     def get_message_services(self):
         """
         Get all of the services that are children of the MessageService class.
@@ -202,14 +354,23 @@ class ServiceManager():
         name (string): The config name of the service
 
         Returns:
-        Service: The initialized service
-        """
-        if(name == "home_assistant"):
-            return HomeAssistantController()
-        elif(name == "command_line"):
-            return CommandLine()
-        elif(name == "discord"):
-            return DiscordBot()
-        elif(name == "telegram"):
-            return TelegramBot()
-        return None
\ No newline at end of file
+        Service: The initialized service, None if it isn't registered or can't be imported
+        """
+        target = self.service_registry.get(name)
+        if(target is None):
+            # Only look through the installed packages for services that aren't built in
+            for entry_point in entry_points(group=SERVICE_ENTRY_POINT_GROUP):
+                if(entry_point.name == name):
+                    target = entry_point.value
+                    self.service_registry[name] = target
+                    break
+            else:
+                return None
+
+        module_name, _, class_name = target.partition(":")
+        try:
+            service_class = getattr(importlib.import_module(module_name), class_name)
+        except (ImportError, AttributeError) as e:
+            print(f"Failed to import service \"{name}\" from {target}: {e}")
+            return None
+        return service_class()
\ No newline at end of file
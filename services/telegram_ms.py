@@ -13,11 +13,7 @@ class TelegramBot(MessageService):
 		super().__init__()
 		self.application = None  # Telegram bot instance
 		self.token = None  # API key
-
-		# A dictionary of string messages and the userMessage object associated with it, we can use
-		#   this in send_message along with the "in_response_to" variable to access the incoming
-		#   userMessage object
-		self.message_metadata = {}
+		self.loop = None  # The event loop polling runs on
 
 	def load_config(self, config):
 		"""
@@ -37,7 +33,7 @@ class TelegramBot(MessageService):
 		Start the Telegram bot service in a separate thread with its own event loop.
 		"""
 
-		self.application = ApplicationBuilder().token(self.token).build()
+		self.application = ApplicationBuilder().token(self.token).post_init(self._on_ready).build()
 
 		# Register handlers
 		self._register_handlers()
@@ -47,14 +43,20 @@ class TelegramBot(MessageService):
 		asyncio.set_event_loop(self.loop)
 
 		print("Starting telegram...")
-		self.application.run_polling()
+		# Signal handlers can only be installed on the main thread, the ServiceManager stops polling
+		#   through stop_service instead
+		self.application.run_polling(stop_signals=None)
 
 	def stop_service(self):
 		"""
-		Stop the service.
+		Stop polling, run_polling then shuts the application down and returns.
 		"""
-		print("Attempting to stop telegram (won't work)")
-		self.application.shutdown()
+		if(self.application is None or self.loop is None):
+			return
+		self.loop.call_soon_threadsafe(self.application.stop_running)
+
+	async def _on_ready(self, application):
+		self.is_ready = True
 
 	def _register_handlers(self):
 		"""
@@ -131,37 +133,24 @@ class TelegramBot(MessageService):
 		"""
 		user_input = update.message.text  # Get the user's input
 
-		self.message_metadata = {
-			"update": update,
-			"context": context
-		}
-
-		# Pass the message to the message queue (to be processed by the central_controller)
-		self.recieve_message(user_input)
+		# Pass the message to the message queue (to be processed by the central_controller), each
+		#   chat's messages are handled in order
+		self.recieve_message(user_input, update.message.chat_id, update.message)
 		
 
 	def send_message(self, message, in_response_to):
 		"""
-		Send a message to the Telegram chat.
+		Send a message to the Telegram chat, as a reply to the telegram Message kept as the
+		  envelope's reply handle.
 		"""
-		print(f"Sending message: {message} (in response to: {in_response_to})")
-		metadata = self.message_metadata[in_response_to]
+		print(f"Sending message: {message} (in response to: {in_response_to.text})")
+		user_message = in_response_to.reply_handle
 
-		if(metadata is None):
-			print(f"ERROR: Failed to respond to message \"{in_response_to}\"")
+		if(user_message is None):
+			print(f"ERROR: Failed to respond to message \"{in_response_to.text}\", it's no longer known")
 			return
 
-		update = metadata["update"]
-		context = metadata["context"]
-
-		return_message = f"Received your command: '{in_response_to}'. Processing..."
-
-		print("sending message")
-
-		asyncio.run_coroutine_threadsafe(context.bot.send_message(
-			chat_id=update.message.chat_id,
-			text=return_message
-		), self.loop)
+		asyncio.run_coroutine_threadsafe(user_message.reply_text(str(message)), self.loop)
 
 	def await_message(self):
 		"""
@@ -0,0 +1,100 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+class SLMBatcher:
+    """
+    The SLMBatcher collects SLM requests from concurrent callers and runs them as one batched
+      generate call. A batch is flushed once it holds max_batch_size requests, or batch_window
+      seconds after its first request arrived, whichever comes first.
+    Each caller gets a Future resolving to its own decoded result.
+    """
+
+    def __init__(self, generate_batch, batch_window=0.01, max_batch_size=8):
+        """
+        Parameters:
+        generate_batch (callable): Called as generate_batch(texts, max_length), returns one result
+          per text in the same order
+        batch_window (float): Seconds to wait for more requests after the first one of a batch
+        max_batch_size (int): The most requests run in a single generate call
+        """
+        self.generate_batch = generate_batch
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+
+        self._pending = queue.Queue()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="slm-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, text, max_length=50):
+        """
+        Queue a command to be generated with the next batch.
+
+        Parameters:
+        text (str): Natural language command
+        max_length (int): Maximum length for the generated command
+
+        Returns:
+        Future: Resolves to the generated API command
+        """
+        future = Future()
+        if(not self._running):
+            future.set_exception(RuntimeError("The SLM batcher has been stopped."))
+            return future
+
+        self._pending.put((text, max_length, future))
+        return future
+
+    def stop(self):
+        """
+        Stop the batching thread, requests already queued are still generated.
+        """
+        self._running = False
+        self._pending.put(None)
+        self._thread.join()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            first = self._pending.get()
+            if(first is None):
+                break
+
+            # Collect more requests until the window closes or the batch is full
+            batch = [first]
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if(remaining <= 0):
+                    break
+                try:
+                    request = self._pending.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if(request is None):
+                    stopping = True
+                    break
+                batch.append(request)
+
+            self._flush(batch)
+
+    def _flush(self, batch):
+        # Requests can only share a generate call if they share a max_length
+        groups = {}
+        for text, max_length, future in batch:
+            groups.setdefault(max_length, []).append((text, future))
+
+        for max_length, requests in groups.items():
+            # Identical commands in the same batch are only generated once
+            texts = list(dict.fromkeys(text for text, _ in requests))
+            try:
+                results = dict(zip(texts, self.generate_batch(texts, max_length)))
+            except Exception as e:
+                for _, future in requests:
+                    future.set_exception(e)
+                continue
+
+            for text, future in requests:
+                future.set_result(results[text])
@@ -0,0 +1,133 @@
+import argparse
+import multiprocessing
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from slm_command_processor import SLMCommandProcessor, INFERENCE_PROFILES
+
+# Benchmark for the SLM inference profiles, see INFERENCE_PROFILES in slm_command_processor.py.
+# Every profile runs in a fresh process so its peak memory isn't polluted by the others, then its
+#   outputs are compared to the baseline profile's outputs for the same corpus. With --entities the
+#   profiles decode constrained to the entity ids, and they're compared to a "reference" run of the
+#   baseline profile without constraints, so the constrained baseline is a row of its own.
+#
+# Usage:
+#   python slm_benchmark.py
+#   python slm_benchmark.py --profiles baseline fast --corpus commands.txt --threads 4
+#   python slm_benchmark.py --entities entity_ids.txt  # Constrain decoding to these entity ids
+
+# Default command corpus, a corpus file should have one command per line
+default_corpus = [
+    "can you unlock the front door",
+    "lock the front door please",
+    "open the garage door",
+    "lock up the back door",
+    "turn on the kitchen light",
+    "turn on the light in the living room",
+    "toggle the porch light",
+    "switch the bedroom lamp on",
+    "toggle the hallway lights",
+    "turn on the kitchen thing",
+    "could you open the side gate",
+    "unlock the garage"
+]
+
+def peak_memory_mb():
+    """
+    Get the peak resident memory of this process.
+
+    Returns:
+    float: Peak resident memory in megabytes, None if it can't be measured on this platform
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def run_profile(profile, corpus, overrides, entity_ids):
+    """
+    Load the model with an inference profile and time every command in the corpus. Meant to be run
+      in its own process.
+
+    Returns:
+    dict: The profile's outputs, per-command latencies, load time and peak memory
+    """
+    load_start = time.perf_counter()
+    # No cache or batching, every command should hit the model exactly once
+    slm = SLMCommandProcessor(cache_size=0, max_batch_size=1, load_async=False, profile=profile, **overrides)
+    load_time = time.perf_counter() - load_start
+    if(not slm.is_ready):
+        raise RuntimeError(f"Failed to load the model: {slm.load_error}")
+    slm.set_entity_constraints(entity_ids)
+
+    # Warm up so one-time allocations aren't counted as latency
+    slm.generate_api_command(corpus[0])
+
+    outputs = []
+    latencies = []
+    for command in corpus:
+        start = time.perf_counter()
+        outputs.append(slm.generate_api_command(command))
+        latencies.append(time.perf_counter() - start)
+
+    return {
+        "outputs": outputs,
+        "latencies": latencies,
+        "load_time": load_time,
+        "peak_memory": peak_memory_mb()
+    }
+
+def load_lines(file_path):
+    with open(file_path, 'r') as file:
+        return [line.strip() for line in file if len(line.strip()) > 0]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the SLM inference profiles.")
+    parser.add_argument("--profiles", nargs="+", default=list(INFERENCE_PROFILES.keys()), choices=list(INFERENCE_PROFILES.keys()))
+    parser.add_argument("--corpus", help="File with one command per line, uses a built-in corpus if omitted.")
+    parser.add_argument("--entities", help="File with one entity id per line, decoding is constrained to them if given.")
+    parser.add_argument("--threads", type=int, default=None, help="Override the intra-op thread count of every profile.")
+    args = parser.parse_args()
+
+    corpus = default_corpus if args.corpus is None else load_lines(args.corpus)
+    entity_ids = [] if args.entities is None else load_lines(args.entities)
+    overrides = {} if args.threads is None else {"num_threads": args.threads}
+
+    # The unconstrained baseline is always run since agreement and speedup are measured against it
+    reference = "baseline" if len(entity_ids) == 0 else "reference"
+    runs = [(reference, "baseline", [])] + [(profile, profile, entity_ids) for profile in args.profiles if profile != reference]
+
+    results = {}
+    context = multiprocessing.get_context("spawn")
+    for name, profile, constraints in runs:
+        print(f"Running \"{name}\" ({profile} profile, {'constrained' if len(constraints) > 0 else 'unconstrained'}) on {len(corpus)} command(s)...")
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            results[name] = executor.submit(run_profile, profile, corpus, overrides, constraints).result()
+
+    baseline_outputs = results[reference]["outputs"]
+    baseline_mean = statistics.mean(results[reference]["latencies"])
+
+    print()
+    print(f"{'profile':<10} {'load (s)':>9} {'mean (ms)':>10} {'p50 (ms)':>9} {'p95 (ms)':>9} {'speedup':>8} {'peak (MB)':>10} {'agreement':>10}")
+    for profile, result in results.items():
+        latencies = sorted(result["latencies"])
+        mean = statistics.mean(latencies)
+        p50 = latencies[len(latencies) // 2]
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        agreement = sum(1 for a, b in zip(result["outputs"], baseline_outputs) if a == b) / len(corpus)
+        peak = "n/a" if result["peak_memory"] is None else f"{result['peak_memory']:.0f}"
+
+        print(f"{profile:<10} {result['load_time']:>9.2f} {mean * 1000:>10.1f} {p50 * 1000:>9.1f} {p95 * 1000:>9.1f} {baseline_mean / mean:>7.2f}x {peak:>10} {agreement:>9.0%}")
+
+    # Show where the profiles disagree with the reference
+    for profile, result in results.items():
+        for command, output, expected in zip(corpus, result["outputs"], baseline_outputs):
+            if(output != expected):
+                print(f"[{profile}] \"{command}\": {output} ({reference}: {expected})")
+
+if __name__ == "__main__":
+    main()
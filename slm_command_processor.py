@@ -1,29 +1,337 @@
-import torch
-from transformers import T5Tokenizer, T5ForConditionalGeneration
+import os
+import threading
+
+from ttl_cache import TTLCache
+from slm_batcher import SLMBatcher
+
+# Inference profiles for the T5 command model, each trades some accuracy for latency on CPU.
+#   quantize: Dynamically quantize the linear layers to int8 (CPU only)
+#   num_threads: Intra-op thread count for torch, None keeps torch's default (every core). Decoding
+#     a short entity id is mostly per-op overhead, so a few threads are nearly as fast as all of
+#     them and leave the other cores to concurrent requests and worker processes. Capped at the
+#     machine's core count
+#   num_beams: Beam search width, 1 is greedy decoding
+#   constrained_num_beams: Beam search width when decoding is constrained to known entity ids,
+#     every beam is a real entity id so far fewer are needed
+# See slm_benchmark.py to compare them on a command corpus.
+INFERENCE_PROFILES = {
+    "baseline": {"quantize": False, "num_threads": None, "num_beams": 5, "constrained_num_beams": 2},
+    "balanced": {"quantize": True, "num_threads": 4, "num_beams": 3, "constrained_num_beams": 2},
+    "fast": {"quantize": True, "num_threads": 2, "num_beams": 1, "constrained_num_beams": 1}
+}
+
+class EntityTokenTrie:
+    """
+    A prefix trie over tokenized entity ids, used to constrain generation so the model can only
+      produce entity ids that exist. Each path from the root is an entity id's tokens followed by
+      the end of sequence token.
+    """
+
+    def __init__(self, eos_token_id):
+        self.eos_token_id = eos_token_id
+        self.root = {}
+
+    def add(self, token_ids):
+        node = self.root
+        for token_id in token_ids:
+            node = node.setdefault(token_id, {})
+        node.setdefault(self.eos_token_id, {})
+
+    def allowed_tokens(self, batch_id, input_ids):
+        """
+        Callback for generate's prefix_allowed_tokens_fn.
+
+        Parameters:
+        batch_id (int): Index of the sequence in the batch, unused since every sequence shares the trie
+        input_ids (torch.Tensor): The decoder tokens generated so far, starting with the decoder start token
+
+        Returns:
+        list<int>: The tokens that can follow input_ids
+        """
+        node = self.root
+        for token_id in input_ids.tolist()[1:]:
+            node = node.get(token_id)
+            # Off the trie (e.g. a finished sequence being padded), only allow ending it
+            if(node is None or len(node) == 0):
+                return [self.eos_token_id]
+        return list(node.keys())
 
 class SLMCommandProcessor:
-    def __init__(self, model_name='vincenthuynh/SLM_CS576', device='cpu'):
-        # Load the model and tokenizer
-        self.tokenizer = T5Tokenizer.from_pretrained(model_name)
-        self.model = T5ForConditionalGeneration.from_pretrained(model_name)
+    """
+    The SLMCommandProcessor resolves natural language commands with the T5 command model.
+    Importing torch/transformers and loading the model takes several seconds, so with load_async
+      it happens on a background thread; is_ready is set once the model can be used and
+      wait_until_ready can be used to block on it.
+    """
+
+    def __init__(self, model_name='vincenthuynh/SLM_CS576', device='cpu', cache_size=256, cache_ttl=300.0,
+                 batch_window=0.01, max_batch_size=8, load_async=True, profile="baseline", **profile_overrides):
+        if(profile not in INFERENCE_PROFILES):
+            raise ValueError(f"Unknown inference profile \"{profile}\", expected one of: {', '.join(INFERENCE_PROFILES)}")
+        for setting in profile_overrides:
+            if(setting not in INFERENCE_PROFILES[profile]):
+                raise ValueError(f"Unknown inference setting \"{setting}\".")
+
+        self.model_name = model_name
         self.device = device
-        self.model.to(self.device)
+
+        # Settings from the inference profile, any of them can be overridden by keyword
+        self.profile = profile
+        self.inference_settings = {**INFERENCE_PROFILES[profile], **profile_overrides}
+        self.num_beams = self.inference_settings["num_beams"]
+        self.tokenizer = None
+        self.model = None
+
+        # The entity ids generation is constrained to, None when unconstrained. The trie is built
+        #   from the tokenized ids once the tokenizer has loaded
+        self.entity_constraints = None
+        self.entity_trie = None
+        self._entity_tokens = {}
+        self._constraint_lock = threading.Lock()
+
+        # Readiness state of the model, load_error holds the exception if loading failed
+        self.is_ready = False
+        self.load_error = None
+        self._loaded = threading.Event()
+
+        # Generated commands keyed by normalized command text, the same phrasings are sent over and
+        #   over so this skips the model entirely for them
+        self.cache = TTLCache(cache_size, cache_ttl)
+        # Bumped by invalidate_cache, a result generated across an invalidation may be for entities
+        #   that no longer exist so it isn't cached
+        self._cache_epoch = 0
+        self._cache_lock = threading.Lock()
+
+        # Concurrent callers are grouped into a single batched generate call, a max_batch_size of 1
+        #   runs every command on the calling thread instead
+        self.batcher = None
+        # How many concurrent callers can share generate calls, limiting callers below this keeps
+        #   batches from filling
+        self.batch_capacity = max_batch_size
+        if(max_batch_size > 1):
+            self.batcher = SLMBatcher(self.generate_api_commands, batch_window, max_batch_size)
+
+        # Load the model and tokenizer
+        if(load_async):
+            threading.Thread(target=self._load_model, name="slm-loader", daemon=True).start()
+        else:
+            self._load_model()
+
+    def _load_model(self):
+        try:
+            # Imported here so the rest of the program doesn't wait on torch/transformers
+            from transformers import T5Tokenizer, T5ForConditionalGeneration
+
+            self.tokenizer = T5Tokenizer.from_pretrained(self.model_name)
+            self.model = T5ForConditionalGeneration.from_pretrained(self.model_name)
+            self.model.to(self.device)
+            self._apply_inference_settings()
+            with self._constraint_lock:
+                self._rebuild_entity_trie()
+            self.is_ready = True
+            print(f"Loaded SLM \"{self.model_name}\" with the \"{self.profile}\" inference profile.")
+        except Exception as e:
+            self.load_error = e
+            print(f"Failed to load SLM \"{self.model_name}\": {e}")
+        finally:
+            self._loaded.set()
+
+    def _apply_inference_settings(self):
+        import torch
+
+        self.model.eval()
+
+        # Note that torch's thread count is process wide
+        if(self.inference_settings["num_threads"] is not None):
+            torch.set_num_threads(min(self.inference_settings["num_threads"], os.cpu_count() or 1))
+
+        if(self.inference_settings["quantize"]):
+            if(self.device != 'cpu'):
+                print(f"WARNING: Dynamic quantization is only supported on the CPU, running the full precision model on {self.device}.")
+            else:
+                self.model = torch.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    def set_entity_constraints(self, entity_ids):
+        """
+        Constrain generation to a set of entity ids, should be called whenever the known entities
+          change. Clears the result cache.
+
+        Parameters:
+        entity_ids (iterable<str>): The entity ids that can be generated, empty to remove the constraint
+
+        Returns:
+        void
+        """
+        entity_ids = set(entity_ids)
+        with self._constraint_lock:
+            self.entity_constraints = entity_ids if len(entity_ids) > 0 else None
+            self._rebuild_entity_trie()
+
+        self.invalidate_cache()
+
+    def _rebuild_entity_trie(self):
+        # Must be called holding _constraint_lock
+        if(self.entity_constraints is None or self.tokenizer is None):
+            self.entity_trie = None
+            return
+
+        # Tokenizations are kept between rebuilds, only new entity ids are tokenized
+        entity_tokens = {}
+        trie = EntityTokenTrie(self.tokenizer.eos_token_id)
+        for entity_id in self.entity_constraints:
+            token_ids = self._entity_tokens.get(entity_id)
+            if(token_ids is None):
+                token_ids = self.tokenizer.encode(entity_id, add_special_tokens=False)
+            entity_tokens[entity_id] = token_ids
+            trie.add(token_ids)
+
+        self._entity_tokens = entity_tokens
+        self.entity_trie = trie
+
+    def wait_until_ready(self, timeout=None):
+        """
+        Block until the model has finished loading.
+
+        Parameters:
+        timeout (float): The most seconds to wait, None to wait indefinitely
+
+        Returns:
+        bool: True if the model is ready to be used
+        """
+        self._loaded.wait(timeout)
+        return self.is_ready
 
     def generate_api_command(self, text, max_length=50):
         """
         Generates an API command from a natural language command using the SLM model.
-        
+
         Parameters:
         text (str): Natural language command
         max_length (int): Maximum length for the generated command
 
         Returns:
-        str: The generated API command
+        str: The generated API command, None if it couldn't be generated or the model isn't ready
         """
+        cache_key = (normalize_command(text), max_length)
+        cached = self.cache.get(cache_key)
+        if(cached is not None):
+            return cached
+
+        if(not self.is_ready):
+            return None
+
+        epoch = self._cache_epoch
         try:
-            input_ids = self.tokenizer.encode(text, return_tensors='pt').to(self.device)
-            with torch.no_grad():
-                generated_ids = self.model.generate(input_ids=input_ids, max_length=max_length, num_beams=5, early_stopping=True)
-            return self.tokenizer.decode(generated_ids[0], skip_special_tokens=True)
+            if(self.batcher is not None):
+                result = self.batcher.submit(text, max_length).result()
+            else:
+                result = self.generate_api_commands([text], max_length)[0]
         except Exception as e:
             return None  # Return None if there's an error in processing
+
+        with self._cache_lock:
+            if(epoch == self._cache_epoch):
+                self.cache.put(cache_key, result)
+        return result
+
+    def generate_api_commands(self, texts, max_length=50):
+        """
+        Generates API commands for several natural language commands with one padded, batched
+          generate call. Doesn't use the result cache, see generate_api_command.
+
+        Parameters:
+        texts (list<str>): Natural language commands
+        max_length (int): Maximum length for the generated commands
+
+        Returns:
+        list<str>: The generated API commands, in the same order as texts
+        """
+        import torch
+
+        # Constrained decoding can only produce known entity ids, so it gets by with fewer beams
+        entity_trie = self.entity_trie
+        num_beams = self.num_beams
+        constraint_args = {}
+        if(entity_trie is not None):
+            num_beams = self.inference_settings["constrained_num_beams"]
+            constraint_args["prefix_allowed_tokens_fn"] = entity_trie.allowed_tokens
+
+        inputs = self.tokenizer(texts, return_tensors='pt', padding=True).to(self.device)
+        with torch.no_grad():
+            generated_ids = self.model.generate(
+                input_ids=inputs.input_ids,
+                attention_mask=inputs.attention_mask,
+                max_length=max_length,
+                num_beams=num_beams,
+                early_stopping=num_beams > 1,
+                **constraint_args
+            )
+        return self.tokenizer.batch_decode(generated_ids, skip_special_tokens=True)
+
+    def encode(self, texts, batch_size=64):
+        """
+        Embed texts with the model's T5 encoder, mean pooled over each text's tokens.
+
+        Parameters:
+        texts (list<str>): The texts to be embedded
+        batch_size (int): The most texts run through the encoder at once
+
+        Returns:
+        numpy.ndarray: A float32 array with one L2-normalized row per text
+        """
+        import numpy as np
+        import torch
+
+        if(not self.is_ready):
+            raise RuntimeError("The SLM hasn't finished loading.")
+
+        encoder = self.model.get_encoder()
+        embeddings = []
+        for start in range(0, len(texts), batch_size):
+            inputs = self.tokenizer(texts[start:start + batch_size], return_tensors='pt', padding=True).to(self.device)
+            with torch.no_grad():
+                hidden = encoder(input_ids=inputs.input_ids, attention_mask=inputs.attention_mask).last_hidden_state
+
+            # Average the token embeddings, ignoring padding
+            mask = inputs.attention_mask.unsqueeze(-1).to(hidden.dtype)
+            pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+            embeddings.append(torch.nn.functional.normalize(pooled, dim=-1).cpu().numpy().astype(np.float32))
+
+        if(len(embeddings) == 0):
+            return np.zeros((0, self.model.config.d_model), dtype=np.float32)
+        return np.concatenate(embeddings)
+
+    def stop(self):
+        """
+        Stop the batching thread.
+        """
+        if(self.batcher is not None):
+            self.batcher.stop()
+
+    def invalidate_cache(self):
+        """
+        Drop every cached result, should be called when the known entities change since a cached
+          entity id may no longer exist. Results being generated meanwhile aren't cached either.
+        """
+        with self._cache_lock:
+            self._cache_epoch += 1
+            self.cache.clear()
+
+    def cache_stats(self):
+        """
+        Returns:
+        dict: The result cache's hit/miss counters, see TTLCache#stats
+        """
+        return self.cache.stats()
+
+def normalize_command(text):
+    """
+    Normalize command text so phrasings that only differ in case or spacing share a cache entry.
+
+    Parameters:
+    text (str): Natural language command
+
+    Returns:
+    str: The lowercased command with collapsed whitespace
+    """
+    return " ".join(text.lower().split())
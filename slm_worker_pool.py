@@ -0,0 +1,320 @@
+import time
+import itertools
+import multiprocessing
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from slm_command_processor import SLMCommandProcessor
+
+# Methods that are run on one worker, and methods that are run on every worker so they share state
+_WORKER_METHODS = {"generate_api_command", "generate_api_commands", "encode", "cache_stats"}
+_BROADCAST_METHODS = {"set_entity_constraints", "invalidate_cache"}
+
+def _worker_main(index, requests, responses, processor_args):
+    """
+    Entry point of a worker process. Loads the SLM and answers requests until it receives None.
+    Requests are handled on a few threads so concurrent requests can share a batched generate
+      call, see SLMBatcher.
+    """
+    processor = SLMCommandProcessor(load_async=False, **processor_args)
+    if(not processor.is_ready):
+        responses.put(("load_failed", index, repr(processor.load_error)))
+        return
+    responses.put(("ready", index, None))
+
+    def handle(request_id, method, args):
+        try:
+            responses.put(("result", request_id, getattr(processor, method)(*args)))
+        except Exception as e:
+            responses.put(("error", request_id, repr(e)))
+
+    with ThreadPoolExecutor(max_workers=max(1, processor_args.get("max_batch_size", 8))) as executor:
+        while True:
+            request = requests.get()
+            if(request is None):
+                break
+
+            request_id, method, args = request
+            if(method in _BROADCAST_METHODS):
+                # Handled in order so later requests see the new state
+                handle(request_id, method, args)
+            else:
+                executor.submit(handle, request_id, method, args)
+
+class SLMWorkerPool:
+    """
+    The SLMWorkerPool runs the SLM in separate worker processes so generation doesn't hold the
+      main process's GIL. It has the same interface as SLMCommandProcessor, and submit returns a
+      Future so callers can keep working while a command is decoded.
+    A supervisor thread collects responses and restarts workers that die, resending the requests
+      they were working on. Restarts back off exponentially, and a worker that keeps dying is
+      given up on like one that can't load the model.
+    """
+
+    def __init__(self, num_workers=1, max_attempts=2, max_restarts=5, restart_backoff=0.5, **processor_args):
+        """
+        Parameters:
+        num_workers (int): The number of worker processes
+        max_attempts (int): How many workers a request is tried on before it fails
+        max_restarts (int): How many times a worker is restarted before it's given up on. The count
+          starts over once a restarted worker has run for a minute
+        restart_backoff (float): Seconds before a dead worker's first restart, doubling each restart
+        processor_args (dict): Keyword arguments for each worker's SLMCommandProcessor
+        """
+        self.num_workers = num_workers
+        self.max_attempts = max_attempts
+        self.max_restarts = max_restarts
+        self.restart_backoff = restart_backoff
+        self.processor_args = processor_args
+        # How many concurrent callers can share generate calls, a full batch per worker, see
+        #   SLMCommandProcessor#batch_capacity
+        self.batch_capacity = num_workers * max(1, processor_args.get("max_batch_size", 8))
+
+        self.is_ready = False
+        self.load_error = None
+        self._loaded = threading.Event()
+
+        # The last broadcast of each method, replayed to restarted workers
+        self._broadcast_state = {}
+
+        # request_id -> [future, worker index, method, args, attempts]
+        self._requests = {}
+        self._request_ids = itertools.count()
+        self._lock = threading.Lock()
+
+        self._context = multiprocessing.get_context("spawn")
+        self._responses = self._context.Queue()
+        self._workers = [None] * num_workers
+        self._ready_workers = set()
+        self._failed_workers = set()
+        # Dead workers waiting out their restart backoff -> when they're restarted
+        self._restarting_workers = {}
+        self._restarts = [0] * num_workers
+        for index in range(num_workers):
+            self._start_worker(index)
+
+        self._running = True
+        self._supervisor = threading.Thread(target=self._supervise, name="slm-pool-supervisor", daemon=True)
+        self._supervisor.start()
+
+    def submit(self, method, *args):
+        """
+        Run an SLMCommandProcessor method on a worker.
+
+        Parameters:
+        method (string): The method's name, e.g. "generate_api_command"
+        args (list): The method's arguments
+
+        Returns:
+        Future: Resolves to the method's return value
+        """
+        future = Future()
+        if(method in _BROADCAST_METHODS):
+            self._broadcast(method, args)
+            future.set_result(None)
+            return future
+        if(method not in _WORKER_METHODS):
+            future.set_exception(ValueError(f"Unsupported SLM method \"{method}\"."))
+            return future
+
+        with self._lock:
+            request_id = next(self._request_ids)
+            self._requests[request_id] = [future, None, method, args, 0]
+            self._dispatch(request_id)
+        return future
+
+    def generate_api_command(self, text, max_length=50):
+        """
+        See SLMCommandProcessor#generate_api_command, blocks until a worker has generated the command.
+        """
+        try:
+            return self.submit("generate_api_command", text, max_length).result()
+        except Exception as e:
+            return None
+
+    def encode(self, texts, batch_size=64):
+        """
+        See SLMCommandProcessor#encode, blocks until a worker has embedded the texts.
+        """
+        return self.submit("encode", texts, batch_size).result()
+
+    def set_entity_constraints(self, entity_ids):
+        self._broadcast("set_entity_constraints", (list(entity_ids),))
+
+    def invalidate_cache(self):
+        self._broadcast("invalidate_cache", ())
+
+    def wait_until_ready(self, timeout=None):
+        self._loaded.wait(timeout)
+        return self.is_ready
+
+    def stop(self):
+        """
+        Stop every worker process, requests still in flight fail.
+        """
+        self._running = False
+        with self._lock:
+            for index, worker in enumerate(self._workers):
+                if(index not in self._failed_workers):
+                    worker["requests"].put(None)
+            for future, *_ in self._requests.values():
+                future.set_exception(RuntimeError("The SLM worker pool has been stopped."))
+            self._requests.clear()
+
+        for worker in self._workers:
+            worker["process"].join(timeout=5)
+            if(worker["process"].is_alive()):
+                worker["process"].terminate()
+
+    def _start_worker(self, index):
+        requests = self._context.Queue()
+        process = self._context.Process(
+            target=_worker_main,
+            args=(index, requests, self._responses, self.processor_args),
+            name=f"slm-worker-{index}",
+            daemon=True
+        )
+        process.start()
+
+        # Bring the new worker up to date before it handles any request
+        for method, args in self._broadcast_state.items():
+            requests.put((None, method, args))
+
+        self._workers[index] = {"process": process, "requests": requests, "started_at": time.monotonic()}
+
+    def _broadcast(self, method, args):
+        with self._lock:
+            self._broadcast_state[method] = args
+            # Failed workers have exited and dead ones get the state when they restart, messages to
+            #   them would pile up in their queues
+            for index, worker in enumerate(self._workers):
+                if(index not in self._failed_workers and index not in self._restarting_workers):
+                    worker["requests"].put((None, method, args))
+
+    def _fail_worker(self, index, error):
+        # Must be called holding _lock. Gives up on a worker, its requests go to the others
+        self._failed_workers.add(index)
+        self._restarting_workers.pop(index, None)
+        self.load_error = error
+        # Nothing reads its queue anymore, don't wait to flush it
+        self._workers[index]["requests"].cancel_join_thread()
+        self._workers[index]["requests"].close()
+
+        self._retry_requests_of(index)
+        if(len(self._failed_workers) == self.num_workers):
+            self._loaded.set()
+            # Fail the requests that were waiting for a worker to restart
+            for request_id in list(self._requests.keys()):
+                self._dispatch(request_id)
+
+    def _dispatch(self, request_id):
+        # Must be called holding _lock. Sends the request to the worker with the least in flight,
+        #   preferring workers that have loaded
+        request = self._requests[request_id]
+        in_flight = [0] * self.num_workers
+        for _, worker_index, *_ in self._requests.values():
+            if(worker_index is not None):
+                in_flight[worker_index] += 1
+
+        if(len(self._failed_workers) == self.num_workers):
+            del self._requests[request_id]
+            request[0].set_exception(RuntimeError(f"No SLM worker could load the model: {self.load_error}"))
+            return
+        candidates = [
+            index for index in range(self.num_workers)
+            if(index not in self._failed_workers and index not in self._restarting_workers)
+        ]
+        if(len(candidates) == 0):
+            # Every worker is waiting to restart, the request is sent once one has
+            request[1] = None
+            return
+        index = min(candidates, key=lambda index: (index not in self._ready_workers, in_flight[index]))
+
+        request[1] = index
+        request[4] += 1
+        self._workers[index]["requests"].put((request_id, request[2], request[3]))
+
+    def _supervise(self):
+        while self._running:
+            try:
+                kind, key, payload = self._responses.get(timeout=0.5)
+                self._handle_response(kind, key, payload)
+            except queue.Empty:
+                pass
+
+            self._restart_dead_workers()
+
+    def _handle_response(self, kind, key, payload):
+        with self._lock:
+            if(kind == "ready"):
+                self._ready_workers.add(key)
+                self.is_ready = True
+                self._loaded.set()
+                return
+
+            if(kind == "load_failed"):
+                # A worker that can't load won't do better after a restart
+                print(f"ERROR: SLM worker {key} failed to load: {payload}")
+                self._fail_worker(key, payload)
+                return
+
+            # Responses to broadcasts have no request id
+            request = self._requests.pop(key, None)
+            if(request is None):
+                return
+
+            if(kind == "result"):
+                request[0].set_result(payload)
+            else:
+                request[0].set_exception(RuntimeError(payload))
+
+    def _restart_dead_workers(self):
+        with self._lock:
+            if(not self._running):
+                return
+
+            now = time.monotonic()
+            for index, worker in enumerate(self._workers):
+                if(index in self._failed_workers):
+                    continue
+
+                if(index in self._restarting_workers):
+                    if(now >= self._restarting_workers[index]):
+                        del self._restarting_workers[index]
+                        self._restarts[index] += 1
+                        self._start_worker(index)
+                        # Send the requests that were waiting for a worker
+                        for request_id, request in list(self._requests.items()):
+                            if(request[1] is None):
+                                self._dispatch(request_id)
+                    continue
+
+                if(worker["process"].is_alive()):
+                    continue
+
+                exitcode = worker["process"].exitcode
+                self._ready_workers.discard(index)
+                if(now - worker["started_at"] >= 60):
+                    self._restarts[index] = 0
+                if(self._restarts[index] >= self.max_restarts):
+                    print(f"ERROR: SLM worker {index} exited with code {exitcode} after {self._restarts[index]} restarts, giving up on it.")
+                    self._fail_worker(index, f"SLM worker {index} kept exiting, last with code {exitcode}")
+                    continue
+
+                delay = self.restart_backoff * (2 ** self._restarts[index])
+                print(f"WARNING: SLM worker {index} exited with code {exitcode}, restarting it in {delay:.1f}s.")
+                self._restarting_workers[index] = now + delay
+                self._retry_requests_of(index)
+
+    def _retry_requests_of(self, index):
+        # Must be called holding _lock. Retries the requests a dead or failed worker had on the
+        #   other workers, up to max_attempts
+        for request_id, request in list(self._requests.items()):
+            if(request[1] != index):
+                continue
+            if(request[4] >= self.max_attempts):
+                del self._requests[request_id]
+                request[0].set_exception(RuntimeError(f"SLM worker {index} stopped while handling the request."))
+            else:
+                self._dispatch(request_id)
@@ -0,0 +1,71 @@
+import unittest
+
+from command_matcher import CommandMatcher
+
+class TestCommandMatcher(unittest.TestCase):
+    def test_find_all_finds_overlapping_keywords(self):
+        matcher = CommandMatcher(["front door", "door", "front door lock"])
+
+        self.assertEqual(
+            sorted(matcher.find_all("unlock the front door lock")),
+            [(11, "front door"), (11, "front door lock"), (17, "door")]
+        )
+
+    def test_longest_match_wins(self):
+        matcher = CommandMatcher(["lock", "unlock", "front door", "front door lock"])
+
+        self.assertEqual(matcher.longest_match("unlock the front door lock"), "front door lock")
+        self.assertEqual(CommandMatcher(["lock", "unlock"]).longest_match("unlock the door"), "unlock")
+
+    def test_equal_lengths_prefer_the_first_added(self):
+        matcher = CommandMatcher(["porch", "patio"])
+
+        self.assertEqual(matcher.longest_match("patio and porch"), "porch")
+
+    def test_matches_whole_words_only(self):
+        matcher = CommandMatcher(["front door", "front door lock", "on", "lock"])
+
+        self.assertEqual(matcher.longest_match("is the front door locked?"), "front door")
+        self.assertEqual(matcher.find_all("the front room"), [])
+        self.assertEqual(matcher.find_all("unlock the clock"), [])
+        self.assertEqual(matcher.longest_match("lock the front door lock."), "front door lock")
+
+    def test_accept_filters_matches(self):
+        matcher = CommandMatcher(["garage", "garage light"])
+
+        self.assertEqual(matcher.longest_match("unlock the garage light", lambda keyword: keyword == "garage"), "garage")
+        self.assertIsNone(matcher.longest_match("unlock the garage light", lambda keyword: False))
+
+    def test_no_match(self):
+        self.assertIsNone(CommandMatcher(["front door"]).longest_match("turn on the porch light"))
+        self.assertIsNone(CommandMatcher().longest_match("anything"))
+
+    def test_add_after_matching(self):
+        matcher = CommandMatcher(["door"])
+        self.assertEqual(matcher.longest_match("open the garage door"), "door")
+
+        matcher.add("garage door")
+        self.assertEqual(matcher.longest_match("open the garage door"), "garage door")
+        self.assertIn("garage door", matcher)
+        self.assertEqual(len(matcher), 2)
+
+    def test_remove_prunes_keyword(self):
+        matcher = CommandMatcher(["front door", "front door lock"])
+
+        self.assertTrue(matcher.remove("front door lock"))
+        self.assertFalse(matcher.remove("front door lock"))
+        self.assertEqual(matcher.longest_match("the front door lock"), "front door")
+
+        self.assertTrue(matcher.remove("front door"))
+        self.assertEqual(matcher.root.children, {})
+        self.assertIsNone(matcher.longest_match("the front door lock"))
+
+    def test_clear(self):
+        matcher = CommandMatcher(["front door"])
+        matcher.clear()
+
+        self.assertEqual(len(matcher), 0)
+        self.assertIsNone(matcher.longest_match("the front door"))
+
+if __name__ == "__main__":
+    unittest.main()
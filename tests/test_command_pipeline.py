@@ -0,0 +1,176 @@
+import threading
+import time
+import unittest
+from contextlib import nullcontext
+
+from command_pipeline import CommandPipeline, _pick_weighted
+
+class ConcurrencyCounter:
+    """
+    Counts how many threads are inside it at once, and the most there ever were.
+    """
+
+    def __init__(self):
+        self.current = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        with self._lock:
+            self.current += 1
+            self.peak = max(self.peak, self.current)
+
+    def __exit__(self, *exc_info):
+        with self._lock:
+            self.current -= 1
+
+class CommandPipelineTestCase(unittest.TestCase):
+    def setUp(self):
+        self.handled = []
+        self.handled_lock = threading.Lock()
+
+    def make_pipeline(self, handler=None, **kwargs):
+        pipeline = CommandPipeline(self.record if handler is None else handler, **kwargs)
+        self.addCleanup(pipeline.stop)
+        return pipeline
+
+    def record(self, *args):
+        with self.handled_lock:
+            self.handled.append(args)
+
+    def wait_for_handled(self, count, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while(len(self.handled) < count and time.monotonic() < deadline):
+            time.sleep(0.01)
+        self.assertEqual(len(self.handled), count)
+
+    def hold_worker(self, pipeline):
+        """
+        Submit a job that holds the pipeline's only worker until the returned event is set, so jobs
+          queued meanwhile are all waiting when it's released.
+        """
+        started = threading.Event()
+        release = threading.Event()
+
+        def blocker():
+            started.set()
+            release.wait(5)
+        pipeline.handler = lambda *args: blocker() if args == ("blocker",) else self.record(*args)
+        pipeline.submit("blocker", "blocker")
+        self.assertTrue(started.wait(5))
+        return release
+
+class TestWeightedRoundRobin(CommandPipelineTestCase):
+    def test_picks_are_smooth_and_in_proportion(self):
+        credit = {}
+        picks = [_pick_weighted(["a", "b", "c"], {"a": 5}, credit) for _ in range(7)]
+
+        self.assertEqual(picks, ["a", "a", "b", "a", "c", "a", "a"])
+        self.assertEqual(credit, {"a": 0, "b": 0, "c": 0})
+
+    def test_class_weights(self):
+        pipeline = self.make_pipeline(max_workers=1, class_weights={"custom": 3, "slm": 1})
+        release = self.hold_worker(pipeline)
+        for index in range(8):
+            pipeline.submit(f"slm {index}", "slm", index, priority_class="slm")
+            pipeline.submit(f"custom {index}", "custom", index, priority_class="custom")
+        release.set()
+
+        self.wait_for_handled(16)
+        first = [priority_class for priority_class, _ in self.handled[:8]]
+        self.assertEqual(first.count("custom"), 6)
+        self.assertEqual(first.count("slm"), 2)
+
+    def test_source_weights_within_a_class(self):
+        pipeline = self.make_pipeline(max_workers=1, source_weights={"discord": 2})
+        release = self.hold_worker(pipeline)
+        for index in range(6):
+            pipeline.submit(f"telegram {index}", "telegram", source="telegram")
+            pipeline.submit(f"discord {index}", "discord", source="discord")
+        release.set()
+
+        self.wait_for_handled(12)
+        first = [source for source, in self.handled[:6]]
+        self.assertEqual(first.count("discord"), 4)
+        self.assertEqual(first.count("telegram"), 2)
+
+class TestLimits(CommandPipelineTestCase):
+    def test_class_limit(self):
+        counter = ConcurrencyCounter()
+
+        def handler(index):
+            with counter:
+                time.sleep(0.05)
+            self.record(index)
+        pipeline = self.make_pipeline(handler, max_workers=4, class_limits={"slm": 1})
+        for index in range(4):
+            pipeline.submit(index, index, priority_class="slm")
+
+        self.wait_for_handled(4)
+        self.assertEqual(counter.peak, 1)
+
+    def test_stage_limit(self):
+        counter = ConcurrencyCounter()
+
+        def handler(index):
+            with pipeline.stage("slm"), counter:
+                time.sleep(0.05)
+            self.record(index)
+        pipeline = self.make_pipeline(handler, max_workers=6, stage_limits={"slm": 2})
+        for index in range(6):
+            pipeline.submit(index, index)
+
+        self.wait_for_handled(6)
+        self.assertEqual(counter.peak, 2)
+        self.assertIsInstance(pipeline.stage("ha"), nullcontext)
+
+class TestConversations(CommandPipelineTestCase):
+    def test_jobs_of_a_conversation_run_in_order_one_at_a_time(self):
+        counter = ConcurrencyCounter()
+
+        def handler(index):
+            with counter:
+                # Later jobs finish faster, so running them concurrently would reorder them
+                time.sleep(0.01 * (5 - index))
+                self.record(index)
+        pipeline = self.make_pipeline(handler, max_workers=4)
+        for index in range(5):
+            pipeline.submit("alice", index)
+
+        self.wait_for_handled(5)
+        self.assertEqual(self.handled, [(index,) for index in range(5)])
+        self.assertEqual(counter.peak, 1)
+
+    def test_conversations_run_concurrently(self):
+        barrier = threading.Barrier(2, timeout=5)
+
+        def handler(name):
+            # Only passes if both conversations are running at once
+            barrier.wait()
+            self.record(name)
+        pipeline = self.make_pipeline(handler, max_workers=2)
+        pipeline.submit("alice", "alice")
+        pipeline.submit("bob", "bob")
+
+        self.wait_for_handled(2)
+        self.assertEqual(sorted(self.handled), [("alice",), ("bob",)])
+
+    def test_failed_job_doesnt_hold_up_its_conversation(self):
+        def handler(index):
+            if(index == 0):
+                raise RuntimeError("HomeAssistant timed out")
+            self.record(index)
+        pipeline = self.make_pipeline(handler, max_workers=1)
+        pipeline.submit("alice", 0)
+        pipeline.submit("alice", 1)
+
+        self.wait_for_handled(1)
+        self.assertEqual(self.handled, [(1,)])
+        # A job's latency is recorded once its handler returns
+        deadline = time.monotonic() + 5
+        while(pipeline.latency_stats().get("exact", {}).get("count") != 2 and time.monotonic() < deadline):
+            time.sleep(0.01)
+        self.assertEqual(pipeline.latency_stats()["exact"]["count"], 2)
+
+if __name__ == "__main__":
+    unittest.main()
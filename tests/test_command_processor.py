@@ -0,0 +1,180 @@
+import unittest
+
+from command_processor import CommandProcessor, CommandProcessingError
+from entity_embedding_index import EntityEmbeddingIndex
+from tests.test_entity_embedding_index import encode_words
+
+ENTITIES = {
+    "front door": "lock.front_door",
+    "garage door": "lock.garage_door",
+    "porch light": "light.porch_light",
+    "garage light": "light.garage_light"
+}
+
+class CommandProcessorTestCase(unittest.TestCase):
+    """
+    Makes a CommandProcessor without HomeAssistant, with ENTITIES in its entity mapping. The SLM
+      isn't used, commands that would need it are resolved with _parse_command.
+    """
+
+    entities = ENTITIES
+
+    def setUp(self):
+        self.command_processor = CommandProcessor(None)
+        self.addCleanup(self.command_processor.stop)
+        for name, entity_id in self.entities.items():
+            self.command_processor.add_to_enity_mapping(name, entity_id)
+        self.command_processor.add_custom_command("exit", lambda: {})
+
+    def parse(self, command):
+        result, _ = self.command_processor._parse_command(command)
+        return result
+
+class TestSplitCommand(CommandProcessorTestCase):
+    def test_single_command_isnt_split(self):
+        self.assertEqual(self.command_processor.split_command("lock the front door"), ["lock the front door"])
+
+    def test_splits_on_and_then_and_punctuation(self):
+        self.assertEqual(
+            self.command_processor.split_command("lock the front door and turn on the porch light"),
+            ["lock the front door", "turn on the porch light"]
+        )
+        self.assertEqual(
+            self.command_processor.split_command("lock the front door; unlock the garage door then turn on the garage light"),
+            ["lock the front door", "unlock the garage door", "turn on the garage light"]
+        )
+
+    def test_part_without_action_reuses_previous_action(self):
+        self.assertEqual(
+            self.command_processor.split_command("turn on the porch light and the garage light"),
+            ["turn on the porch light", "turn on the garage light"]
+        )
+
+    def test_part_after_query_is_a_query(self):
+        self.assertEqual(
+            self.command_processor.split_command("is the front door locked and the garage door"),
+            ["is the front door locked", "is the garage door"]
+        )
+
+    def test_custom_commands_arent_split(self):
+        self.assertEqual(self.command_processor.split_command("exit and lock the front door"), ["exit and lock the front door"])
+
+    def test_courtesy_suffix_isnt_a_command(self):
+        for command in ["lock the front door, please", "lock the front door and thanks", "lock the front door, thank you"]:
+            self.assertEqual(self.command_processor.split_command(command), [command])
+            self.assertEqual(self.command_processor.process_command(command)["entity_id"], "lock.front_door")
+            self.assertEqual(self.command_processor.classify_command(command), "exact")
+
+    def test_courtesy_suffix_is_merged_into_the_last_part(self):
+        self.assertEqual(
+            self.command_processor.split_command("lock the front door and turn on the porch light, please"),
+            ["lock the front door", "turn on the porch light please"]
+        )
+
+    def test_part_without_a_target_isnt_split(self):
+        # "lock it" names no entity, it would be sent to the SLM to guess one
+        self.assertEqual(self.command_processor.split_command("lock the front door and lock it"), ["lock the front door and lock it"])
+
+    def test_multi_result(self):
+        result = self.command_processor.process_command("lock the front door and turn on the porch light")
+        self.assertEqual(result["processed_type"], "multi_cmd")
+        self.assertEqual(
+            [(command["result"]["action_label"], command["result"]["entity_id"]) for command in result["commands"]],
+            [("lock/lock", "lock.front_door"), ("light/turn_on", "light.porch_light")]
+        )
+
+class TestQueries(CommandProcessorTestCase):
+    entities = {**ENTITIES, "front door lock": "lock.front_door_lock"}
+
+    def test_query_resolves_to_a_state_query(self):
+        result = self.parse("is the garage door locked?")
+
+        self.assertEqual(result["processed_type"], "ha_query")
+        self.assertEqual(result["entity_id"], "lock.garage_door")
+
+    def test_query_state_word_isnt_part_of_the_entity_name(self):
+        # "front door lock" is in "front door locked", but not as whole words
+        self.assertEqual(self.parse("is the front door locked?")["entity_id"], "lock.front_door")
+        self.assertEqual(self.parse("is the front door lock locked?")["entity_id"], "lock.front_door_lock")
+
+    def test_query_isnt_an_action(self):
+        # "locked" contains the "lock" action, a question must never perform it
+        result = self.parse("is the porch light on")
+
+        self.assertEqual(result["processed_type"], "ha_query")
+        self.assertEqual(result["entity_id"], "light.porch_light")
+
+class TestActionDomain(CommandProcessorTestCase):
+    entities = {**ENTITIES, "garage": "lock.garage"}
+
+    def test_exact_target_must_be_in_the_actions_domain(self):
+        # "lock" can't be called on a light, so the target is left to the SLM
+        self.assertEqual(self.command_processor._parse_command("lock the porch light"), (None, "lock"))
+
+    def test_longest_target_in_the_domain_wins(self):
+        # "garage light" is longer, but only "garage" can be unlocked
+        self.assertEqual(self.parse("unlock the garage light")["entity_id"], "lock.garage")
+        self.assertEqual(self.parse("turn on the garage light")["entity_id"], "light.garage_light")
+
+    def test_queries_match_any_domain(self):
+        self.assertEqual(self.parse("is the porch light on")["entity_id"], "light.porch_light")
+
+class FakeSLM:
+    """
+    A loaded SLM that embeds with encode_words and generates a fixed entity id.
+    """
+
+    is_ready = True
+    load_error = None
+
+    def __init__(self, generated=None):
+        self.generated = generated
+        self.generated_for = []
+
+    def wait_until_ready(self, timeout=None):
+        return True
+
+    def encode(self, texts, batch_size=64):
+        return encode_words(texts)
+
+    def generate_api_command(self, text, max_length=50):
+        self.generated_for.append(text)
+        return self.generated
+
+    def stop(self):
+        pass
+
+class TestEmbeddingTier(CommandProcessorTestCase):
+    def use_embeddings(self, threshold, generated=None):
+        self.addCleanup(self.command_processor.slm_processor.stop)
+        self.command_processor.slm_processor = FakeSLM(generated)
+        self.command_processor.embedding_index = EntityEmbeddingIndex(encode_words, self.entities.keys())
+        self.command_processor.embedding_threshold = threshold
+        return self.command_processor.slm_processor
+
+    def test_only_entities_in_the_actions_domain_are_candidates(self):
+        # "garage light" is the closest name, but "lock" can't act on a light
+        self.use_embeddings(0.3)
+
+        result = self.command_processor._resolve_with_slm("lock the garage light", "lock")
+        self.assertEqual(result["entity_id"], "lock.garage_door")
+        self.assertTrue(all(entity_id.startswith("lock.") for entity_id, _ in result["candidates"]))
+
+    def test_match_above_the_threshold_skips_generation(self):
+        slm = self.use_embeddings(0.6, generated="light.garage_light")
+
+        self.assertEqual(self.command_processor._resolve_with_slm("open the front door", "unlock")["entity_id"], "lock.front_door")
+        self.assertEqual(slm.generated_for, [])
+
+    def test_falls_back_to_generation_below_the_threshold(self):
+        slm = self.use_embeddings(0.9, generated="lock.garage_door")
+
+        self.assertEqual(self.command_processor._resolve_with_slm("lock the garage", "lock")["entity_id"], "lock.garage_door")
+        self.assertEqual(slm.generated_for, ["lock the garage"])
+
+        slm.generated = None
+        with self.assertRaises(CommandProcessingError):
+            self.command_processor._resolve_with_slm("lock the garage", "lock")
+
+if __name__ == "__main__":
+    unittest.main()
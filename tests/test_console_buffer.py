@@ -0,0 +1,71 @@
+import io
+import threading
+import unittest
+from contextlib import redirect_stdout
+
+from console_buffer import ConsoleBuffer, line_level
+from services.service_manager import ServiceManager
+
+class TestConsoleBuffer(unittest.TestCase):
+    def test_fragments_are_joined_into_lines(self):
+        buffer = ConsoleBuffer()
+        buffer.write("Loaded ")
+        buffer.write("SLM\nWARNING: slow")
+
+        self.assertEqual(buffer.drain(), [("info", "Loaded SLM")])
+        buffer.write(" service\n")
+        self.assertEqual(buffer.drain(), [("warning", "WARNING: slow service")])
+        self.assertEqual(buffer.drain(), [])
+
+    def test_oldest_lines_are_dropped_when_full(self):
+        buffer = ConsoleBuffer(max_lines=3)
+        for index in range(5):
+            buffer.write(f"line {index}\n")
+
+        self.assertEqual([line for _, line in buffer.drain()], ["line 2", "line 3", "line 4"])
+        self.assertEqual(buffer.dropped, 2)
+
+    def test_concurrent_writers_keep_whole_lines(self):
+        buffer = ConsoleBuffer(max_lines=10000)
+
+        def write(name):
+            for index in range(500):
+                buffer.write(f"{name} {index}\n")
+        writers = [threading.Thread(target=write, args=(f"writer{number}",)) for number in range(4)]
+        for writer in writers:
+            writer.start()
+        for writer in writers:
+            writer.join()
+
+        lines = [line for _, line in buffer.drain()]
+        self.assertEqual(len(lines), 2000)
+        self.assertEqual(len(set(lines)), 2000)
+
+    def test_line_level(self):
+        self.assertEqual(line_level("ERROR: Failed to start service"), "error")
+        self.assertEqual(line_level("  Error: Entity listener failed"), "error")
+        self.assertEqual(line_level("WARNING: HomeAssistant websocket disconnected"), "warning")
+        self.assertEqual(line_level("Starting..."), "info")
+
+class TestConsoleLevelConfig(unittest.TestCase):
+    def make_interface(self, **interface_config):
+        # Imported here so the other tests run without tkinter
+        from interface import InterfaceManager
+
+        service_manager = ServiceManager()
+        service_manager.config = {"interface": interface_config}
+        return InterfaceManager(service_manager, None)
+
+    def test_valid_level(self):
+        self.assertEqual(self.make_interface(console_level="warning").console_level, "warning")
+
+    def test_invalid_level_falls_back_to_info(self):
+        output = io.StringIO()
+        with redirect_stdout(output):
+            interface = self.make_interface(console_level="debug")
+
+        self.assertEqual(interface.console_level, "info")
+        self.assertIn("WARNING: Invalid console_level \"debug\"", output.getvalue())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+import time
+import unittest
+
+import numpy as np
+
+from entity_embedding_index import EntityEmbeddingIndex
+
+VOCABULARY = {}
+
+def encode_words(texts, batch_size=64):
+    """
+    A stand-in for SLMCommandProcessor#encode, embeds each text as its normalized bag of words.
+    """
+    embeddings = np.zeros((len(texts), 64), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for word in text.lower().split():
+            embeddings[row, VOCABULARY.setdefault(word.strip("?!.,"), len(VOCABULARY))] += 1
+    return embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+
+class TestEntityEmbeddingIndex(unittest.TestCase):
+    def setUp(self):
+        self.encoded = []
+
+        def encode(texts, batch_size=64):
+            self.encoded.append(list(texts))
+            return encode_words(texts)
+
+        self.index = EntityEmbeddingIndex(encode, ["front door", "garage door", "porch light"])
+
+    def test_query_ranks_by_similarity(self):
+        candidates = self.index.query("unlock the garage door", k=2)
+
+        self.assertEqual([name for name, _ in candidates], ["garage door", "front door"])
+        self.assertGreater(candidates[0][1], candidates[1][1])
+
+    def test_accept_limits_the_candidates(self):
+        candidates = self.index.query("turn on the garage door", k=5, accept=lambda name: name.endswith("light"))
+
+        self.assertEqual([name for name, _ in candidates], ["porch light"])
+        self.assertEqual(self.index.query("garage door", accept=lambda name: False), [])
+
+    def test_pending_names_are_encoded_in_the_background(self):
+        self.index.encode_in_background()
+        deadline = time.monotonic() + 5
+        while(len(self.index._pending) > 0 and time.monotonic() < deadline):
+            time.sleep(0.01)
+        self.assertEqual(self.index.count, 3)
+
+        # The query only has to encode its own text
+        self.encoded.clear()
+        self.index.query("open the front door")
+        self.assertEqual(self.encoded, [["open the front door"]])
+
+    def test_remove_after_encoding(self):
+        self.index.encode_pending()
+
+        self.assertTrue(self.index.remove("front door"))
+        self.assertFalse(self.index.remove("front door"))
+        self.assertEqual(len(self.index), 2)
+        self.assertNotIn("front door", [name for name, _ in self.index.query("front door")])
+
+if __name__ == "__main__":
+    unittest.main()
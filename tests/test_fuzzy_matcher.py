@@ -0,0 +1,65 @@
+import unittest
+
+from fuzzy_matcher import FuzzyEntityMatcher, bounded_edit_distance
+
+NAMES = ["front door", "garage door", "living room lamp", "living room fan", "tv"]
+
+class TestBoundedEditDistance(unittest.TestCase):
+    def test_distances(self):
+        self.assertEqual(bounded_edit_distance("door", "door", 2), 0)
+        self.assertEqual(bounded_edit_distance("frnt", "front", 2), 1)
+        # An adjacent swap is one edit
+        self.assertEqual(bounded_edit_distance("fornt", "front", 2), 1)
+        self.assertEqual(bounded_edit_distance("lamp", "lmap", 1), 1)
+
+    def test_gives_up_past_the_maximum(self):
+        self.assertEqual(bounded_edit_distance("garage", "front", 2), 3)
+        self.assertEqual(bounded_edit_distance("a", "abcdef", 2), 3)
+
+class TestFuzzyEntityMatcher(unittest.TestCase):
+    def setUp(self):
+        self.matcher = FuzzyEntityMatcher(NAMES)
+
+    def test_typos_match(self):
+        name, score = self.matcher.best_match("frnt door")
+        self.assertEqual(name, "front door")
+        self.assertGreater(score, 0.8)
+
+        self.assertEqual(self.matcher.best_match("unlock the garag dor")[0], "garage door")
+
+    def test_missing_space_matches(self):
+        name, score = self.matcher.best_match("livingroom lamp")
+
+        self.assertEqual(name, "living room lamp")
+        self.assertEqual(score, 1.0)
+
+    def test_short_words_only_match_exactly(self):
+        self.assertEqual(self.matcher.best_match("tv")[0], "tv")
+        self.assertEqual(self.matcher.best_match("tc"), (None, 0.0))
+
+    def test_accept_filters_candidates(self):
+        name, _ = self.matcher.best_match("living room", accept=lambda name: name.endswith("fan"))
+
+        self.assertEqual(name, "living room fan")
+        self.assertEqual(self.matcher.best_match("front door", accept=lambda name: False), (None, 0.0))
+
+    def test_equal_scores_prefer_the_longer_name(self):
+        matcher = FuzzyEntityMatcher(["porch", "porchlight"])
+
+        # "porch light" fully covers both, the joined pair matches "porchlight"
+        self.assertEqual(matcher.best_match("porch light"), ("porchlight", 1.0))
+
+    def test_remove(self):
+        self.assertTrue(self.matcher.remove("front door"))
+        self.assertFalse(self.matcher.remove("front door"))
+        self.assertEqual(len(self.matcher), len(NAMES) - 1)
+        self.assertNotEqual(self.matcher.best_match("front door")[0], "front door")
+
+        # Removing every name leaves nothing behind in the indexes
+        for name in NAMES[1:]:
+            self.matcher.remove(name)
+        self.assertEqual(self.matcher._key_index, {})
+        self.assertEqual(self.matcher._delete_index, {})
+
+if __name__ == "__main__":
+    unittest.main()
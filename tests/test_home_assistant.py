@@ -0,0 +1,176 @@
+import time
+import threading
+import unittest
+
+from services.home_assistant import HomeAssistantController, HomeAssistantError
+from services.home_assistant_stub import HomeAssistantStub
+from command_processor import CommandProcessor
+
+ENTITIES = {
+    "lock.front_door": "locked",
+    "lock.garage_door": "locked",
+    "light.living_room_lamp": "off",
+    "light.living_room_ceiling": "off",
+    "switch.living_room_fan": "off",
+    "light.porch_light": "off"
+}
+
+def wait_for(condition, timeout=5.0):
+    """
+    Poll condition until it's true or the timeout is up.
+
+    Returns:
+    bool: Whether the condition became true
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if(condition()):
+            return True
+        time.sleep(0.02)
+    return condition()
+
+class HomeAssistantStubTestCase(unittest.TestCase):
+    """
+    Starts a HomeAssistantStub for each test, and makes HomeAssistantControllers connected to it.
+    """
+
+    def setUp(self):
+        self.stub = HomeAssistantStub(entities=ENTITIES)
+        self.url = self.stub.start()
+        self.controllers = []
+
+    def tearDown(self):
+        for controller in self.controllers:
+            controller.stop_service()
+        self.stub.stop()
+
+    def make_controller(self, **config):
+        controller = HomeAssistantController()
+        loaded, problem = controller.load_config({"url": self.url, "api_key": self.stub.access_token, **config})
+        self.assertTrue(loaded, problem)
+        self.controllers.append(controller)
+        return controller
+
+class TestAuthentication(HomeAssistantStubTestCase):
+    def test_rest_auth_failure_raises_home_assistant_error(self):
+        controller = self.make_controller(api_key="wrong_token")
+
+        with self.assertRaises(HomeAssistantError) as raised:
+            controller.get_all_entities()
+        self.assertEqual(raised.exception.status, 401)
+        # Formatting the error must work, every handler prints it
+        self.assertIn("401", str(raised.exception))
+
+        with self.assertRaises(HomeAssistantError):
+            controller.get_entity_state("lock.front_door")
+
+    def test_websocket_auth_failure_stops_without_mirroring(self):
+        controller = self.make_controller(api_key="wrong_token", use_websocket=True)
+        controller.run_service()
+
+        self.assertTrue(wait_for(controller._websocket_task.done))
+        self.assertFalse(controller.mirror_live.is_set())
+        self.assertEqual(controller.states, {})
+
+class TestStateMirror(HomeAssistantStubTestCase):
+    def test_mirror_is_primed_with_every_state(self):
+        controller = self.make_controller(use_websocket=True)
+        controller.run_service()
+
+        self.assertTrue(controller.mirror_live.wait(5))
+        self.assertEqual(set(controller.states.keys()), set(ENTITIES.keys()))
+        self.assertEqual(controller.get_entity_state("lock.front_door")["state"], "locked")
+        self.assertEqual({state["entity_id"] for state in controller.get_all_entities()}, set(ENTITIES.keys()))
+
+    def test_mirror_goes_live_with_a_snapshot_over_4mb(self):
+        # aiohttp limits websocket messages to 4MB by default
+        for index in range(20000):
+            self.stub.set_state(f"sensor.sensor_with_a_fairly_long_name_{index}", "0")
+        controller = self.make_controller(use_websocket=True)
+        controller.run_service()
+
+        self.assertTrue(controller.mirror_live.wait(10))
+        self.assertEqual(len(controller.states), len(ENTITIES) + 20000)
+
+    def test_mirror_follows_state_changes(self):
+        controller = self.make_controller(use_websocket=True)
+        controller.run_service()
+        self.assertTrue(controller.mirror_live.wait(5))
+
+        self.stub.set_state("lock.front_door", "unlocked")
+        self.assertTrue(wait_for(lambda: controller.states["lock.front_door"]["state"] == "unlocked"))
+
+    def test_entity_changes_reach_command_processor(self):
+        controller = self.make_controller(use_websocket=True)
+        command_processor = CommandProcessor(controller)
+        self.addCleanup(command_processor.stop)
+        controller.run_service()
+        self.assertTrue(controller.mirror_live.wait(5))
+        self.assertEqual(command_processor.entity_mapping.get("front door"), "lock.front_door")
+
+        self.stub.set_state("lock.back_door", "locked")
+        self.assertTrue(wait_for(lambda: command_processor.entity_mapping.get("back door") == "lock.back_door"))
+        self.assertEqual(command_processor.process_command("unlock the back door")["entity_id"], "lock.back_door")
+
+        self.stub.remove_entity("lock.back_door")
+        self.assertTrue(wait_for(lambda: "back door" not in command_processor.entity_mapping))
+
+    def test_entity_changes_are_batched_off_the_event_loop(self):
+        controller = self.make_controller(use_websocket=True, entity_debounce=0.2)
+        calls = []
+        controller.add_entity_listener(lambda added, removed: calls.append((threading.current_thread(), sorted(added), sorted(removed))))
+        controller.run_service()
+        self.assertTrue(controller.mirror_live.wait(5))
+        self.assertTrue(wait_for(lambda: len(calls) == 1))
+
+        for index in range(20):
+            self.stub.set_state(f"light.new_light_{index}", "off")
+        self.stub.set_state("light.short_lived", "off")
+        self.stub.remove_entity("light.short_lived")
+        self.stub.remove_entity("light.porch_light")
+
+        self.assertTrue(wait_for(lambda: len(calls) == 2))
+        time.sleep(0.5)
+        self.assertEqual(len(calls), 2)
+        thread, added, removed = calls[1]
+        self.assertIsNot(thread, controller._loop_thread)
+        self.assertEqual(added, sorted(f"light.new_light_{index}" for index in range(20)))
+        self.assertEqual(removed, ["light.porch_light"])
+
+class TestServiceCalls(HomeAssistantStubTestCase):
+    def test_single_entity_service_call(self):
+        controller = self.make_controller()
+
+        success, _ = controller.make_request("lock/unlock", "lock.front_door")
+
+        self.assertTrue(success)
+        self.assertEqual(self.stub.service_calls, [("lock/unlock", {"entity_id": "lock.front_door"})])
+        self.assertEqual(self.stub.states["lock.front_door"]["state"], "unlocked")
+
+    def test_group_command_makes_one_call_per_domain(self):
+        controller = self.make_controller()
+        command_processor = CommandProcessor(controller)
+        self.addCleanup(command_processor.stop)
+
+        result = command_processor.process_command("turn on all living room lights")
+        self.assertTrue(result["group"])
+        self.assertEqual(result["entity_id"], ["light.living_room_ceiling", "light.living_room_lamp"])
+
+        success, _ = controller.make_request(result["action_label"], result["entity_id"])
+        self.assertTrue(success)
+        self.assertEqual(self.stub.service_calls, [("light/turn_on", {"entity_id": ["light.living_room_ceiling", "light.living_room_lamp"]})])
+
+    def test_mixed_domain_list_is_grouped_by_domain(self):
+        controller = self.make_controller()
+
+        success, _ = controller.make_request("light/turn_on", ["light.porch_light", "switch.living_room_fan", "light.living_room_lamp"])
+
+        self.assertTrue(success)
+        self.assertEqual(sorted(self.stub.service_calls), [
+            ("light/turn_on", {"entity_id": ["light.porch_light", "light.living_room_lamp"]}),
+            ("switch/turn_on", {"entity_id": ["switch.living_room_fan"]})
+        ])
+        self.assertEqual(self.stub.states["switch.living_room_fan"]["state"], "on")
+
+if __name__ == "__main__":
+    unittest.main()
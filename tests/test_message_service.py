@@ -0,0 +1,124 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+from services.message_service import MessageQueue, MessageService
+
+class FakeMessageService(MessageService):
+    """
+    A message service that records what it sends instead of sending it.
+    """
+
+    def __init__(self):
+        super().__init__(False)
+        self.sent = []
+
+    def load_config(self, config):
+        return self.load_message_config(config)
+
+    def run_service(self):
+        pass
+
+    def stop_service(self):
+        pass
+
+    def await_message(self):
+        pass
+
+    def send_message(self, message, in_response_to):
+        self.sent.append((message, in_response_to))
+
+class TestMessageQueue(unittest.TestCase):
+    def test_fifo(self):
+        message_queue = MessageQueue(capacity=3)
+        for message in ("a", "b", "c"):
+            self.assertTrue(message_queue.put(message))
+
+        self.assertEqual([message_queue.get() for _ in range(4)], ["a", "b", "c", None])
+
+    def test_drop_oldest_makes_room(self):
+        message_queue = MessageQueue(capacity=2, overflow_policy="drop_oldest")
+        for message in ("a", "b", "c"):
+            self.assertTrue(message_queue.put(message))
+
+        self.assertEqual([message_queue.get(), message_queue.get()], ["b", "c"])
+        self.assertEqual(message_queue.stats(), {"depth": 0, "capacity": 2, "high_water": 2, "dropped": 1, "rejected": 0})
+
+    def test_reject_refuses_new_messages(self):
+        message_queue = MessageQueue(capacity=2, overflow_policy="reject")
+        message_queue.put("a")
+        message_queue.put("b")
+
+        self.assertFalse(message_queue.put("c"))
+        self.assertEqual(message_queue.get(), "a")
+        self.assertTrue(message_queue.put("c"))
+        self.assertEqual(message_queue.stats()["rejected"], 1)
+
+    def test_block_waits_for_room(self):
+        message_queue = MessageQueue(capacity=1, overflow_policy="block", block_timeout=5)
+        message_queue.put("a")
+
+        taker = threading.Timer(0.1, message_queue.get)
+        taker.start()
+        started = time.monotonic()
+        self.assertTrue(message_queue.put("b"))
+        self.assertGreaterEqual(time.monotonic() - started, 0.05)
+        taker.join()
+        self.assertEqual(message_queue.get(), "b")
+
+    def test_block_refuses_after_the_timeout(self):
+        message_queue = MessageQueue(capacity=1, overflow_policy="block", block_timeout=0.05)
+        message_queue.put("a")
+
+        self.assertFalse(message_queue.put("b"))
+        self.assertEqual(message_queue.stats()["rejected"], 1)
+
+    def test_invalid_settings(self):
+        with self.assertRaises(ValueError):
+            MessageQueue(capacity=0)
+        with self.assertRaises(ValueError):
+            MessageQueue(overflow_policy="drop_newest")
+
+class TestMessageService(unittest.TestCase):
+    def test_rejected_message_is_answered(self):
+        service = FakeMessageService()
+        self.assertEqual(service.load_config({"queue_capacity": 1, "queue_overflow": "reject"}), (True, ""))
+        service.recieve_message("lock the front door")
+
+        envelope = service.recieve_message("unlock the front door")
+
+        self.assertEqual(len(service.message_queue), 1)
+        self.assertEqual(service.sent, [("Too many messages are waiting, please try again in a moment.", envelope)])
+
+    def test_invalid_message_config(self):
+        service = FakeMessageService()
+
+        loaded, problem = service.load_config({"queue_overflow": "drop_newest"})
+        self.assertFalse(loaded)
+        self.assertIn("drop_newest", problem)
+
+    def test_reply_context_expires(self):
+        service = FakeMessageService()
+        service.load_config({"reply_context_ttl": 60})
+
+        with mock.patch("ttl_cache.time.monotonic", return_value=1000.0):
+            envelope = service.recieve_message("lock the front door", "alice", reply_handle="discord message")
+            other = service.recieve_message("lock the front door", "bob")
+        with mock.patch("ttl_cache.time.monotonic", return_value=1059.0):
+            self.assertEqual(envelope.reply_handle, "discord message")
+            self.assertIsNone(other.reply_handle)
+        with mock.patch("ttl_cache.time.monotonic", return_value=1061.0):
+            self.assertIsNone(envelope.reply_handle)
+        self.assertNotEqual(envelope.message_id, other.message_id)
+
+    def test_reply_contexts_are_bounded(self):
+        service = FakeMessageService()
+        service.load_config({"reply_context_size": 2})
+
+        envelopes = [service.recieve_message(f"message {index}", reply_handle=index) for index in range(3)]
+
+        self.assertEqual([envelope.reply_handle for envelope in envelopes], [None, 1, 2])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import io
+import socket
+import unittest
+import urllib.error
+import urllib.request
+from contextlib import redirect_stdout
+
+from metrics import Counter, Gauge, Histogram, MetricsRegistry, MetricsServer
+
+class TestMetrics(unittest.TestCase):
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram("hah_stage_seconds", "Stage durations.", buckets=(1.0, 0.005, 0.1))
+        # A value on a bound is in that bound's bucket, one above every bound only in +Inf
+        for value in (0.003, 0.005, 0.2, 60):
+            histogram.observe(value, stage="parse")
+
+        self.assertEqual(histogram.render(), [
+            "# HELP hah_stage_seconds Stage durations.",
+            "# TYPE hah_stage_seconds histogram",
+            'hah_stage_seconds_bucket{stage="parse",le="0.005"} 2',
+            'hah_stage_seconds_bucket{stage="parse",le="0.1"} 2',
+            'hah_stage_seconds_bucket{stage="parse",le="1.0"} 3',
+            'hah_stage_seconds_bucket{stage="parse",le="+Inf"} 4',
+            'hah_stage_seconds_sum{stage="parse"} 60.208',
+            'hah_stage_seconds_count{stage="parse"} 4'
+        ])
+
+    def test_histogram_percentiles(self):
+        histogram = Histogram("latency", "")
+        for value in range(1, 101):
+            histogram.observe(value / 100)
+
+        self.assertEqual(histogram.percentiles((0.5, 0.95)), {(): {"count": 100, 0.5: 0.51, 0.95: 0.96}})
+
+    def test_counter_labels_are_sorted_and_escaped(self):
+        counter = Counter("hah_messages_total", "Messages handled.")
+        counter.inc(service="discord", processed_type="ha_cmd")
+        counter.inc(2, processed_type="ha_cmd", service="discord")
+        counter.inc(service='say "hi"\n')
+
+        self.assertEqual(counter.render()[2:], [
+            'hah_messages_total{processed_type="ha_cmd",service="discord"} 3',
+            'hah_messages_total{service="say \\"hi\\"\\n"} 1'
+        ])
+
+    def test_failing_gauge_renders_no_samples(self):
+        def collect():
+            raise RuntimeError("service stopped")
+        gauge = Gauge("hah_message_queue_depth", "Queue depth.", collect)
+
+        with redirect_stdout(io.StringIO()) as output:
+            self.assertEqual(gauge.render(), ["# HELP hah_message_queue_depth Queue depth.", "# TYPE hah_message_queue_depth gauge"])
+        self.assertIn("WARNING: Failed to collect gauge hah_message_queue_depth", output.getvalue())
+
+    def test_registry_renders_every_metric(self):
+        registry = MetricsRegistry()
+        registry.counter("requests_total", "Requests.").inc()
+        registry.gauge("depth", "Depth.", lambda: [({"service": "discord"}, 4)])
+
+        self.assertIs(registry.counter("requests_total"), registry.metrics()[0])
+        self.assertEqual(registry.render(), "\n".join([
+            "# HELP requests_total Requests.",
+            "# TYPE requests_total counter",
+            "requests_total 1",
+            "# HELP depth Depth.",
+            "# TYPE depth gauge",
+            'depth{service="discord"} 4'
+        ]) + "\n")
+
+class TestMetricsServer(unittest.TestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry()
+        self.registry.counter("requests_total", "Requests.").inc()
+
+    def start_server(self, port=0):
+        server = MetricsServer(self.registry, port=port)
+        with redirect_stdout(io.StringIO()) as output:
+            started = server.start()
+        self.addCleanup(server.stop)
+        return server, started, output.getvalue()
+
+    def test_serves_the_metrics(self):
+        server, started, _ = self.start_server()
+        self.assertTrue(started)
+
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.port}/metrics", timeout=5) as response:
+            self.assertEqual(response.headers["Content-Type"], "text/plain; version=0.0.4; charset=utf-8")
+            self.assertEqual(response.read().decode("utf-8"), self.registry.render())
+
+        with self.assertRaises(urllib.error.HTTPError) as raised:
+            urllib.request.urlopen(f"http://127.0.0.1:{server.port}/", timeout=5)
+        self.assertEqual(raised.exception.code, 404)
+
+    def test_port_in_use_is_a_warning(self):
+        taken = socket.socket()
+        self.addCleanup(taken.close)
+        taken.bind(("127.0.0.1", 0))
+        taken.listen()
+
+        server, started, output = self.start_server(taken.getsockname()[1])
+
+        self.assertFalse(started)
+        self.assertIn("WARNING: Failed to start the metrics endpoint", output)
+
+if __name__ == "__main__":
+    unittest.main()
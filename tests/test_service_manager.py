@@ -0,0 +1,66 @@
+import io
+import time
+import unittest
+from contextlib import redirect_stdout
+
+from services.service import Service
+from services.service_manager import ServiceManager
+
+class FakeService(Service):
+    """
+    A non-threaded service whose run_service takes start_time seconds, and raises if fail is set.
+    """
+
+    def __init__(self, start_time=0.0, fail=False):
+        super().__init__(False)
+        self.start_time = start_time
+        self.fail = fail
+
+    def load_config(self, config):
+        return True, ""
+
+    def run_service(self):
+        time.sleep(self.start_time)
+        if(self.fail):
+            raise RuntimeError("can't connect")
+
+    def stop_service(self):
+        pass
+
+class TestStartServices(unittest.TestCase):
+    def setUp(self):
+        self.service_manager = ServiceManager()
+        self.service_manager.config = {"services": {"slow": {"start_timeout": 0.2}}}
+        self.service_manager.services = {
+            "fast": FakeService(),
+            "slow": FakeService(start_time=0.6),
+            "broken": FakeService(fail=True)
+        }
+
+    def test_returns_without_waiting_and_reports_in_the_background(self):
+        output = io.StringIO()
+        with redirect_stdout(output):
+            started_at = time.monotonic()
+            reporter = self.service_manager.start_services()
+            self.assertLess(time.monotonic() - started_at, 0.1)
+
+            reporter.join(5)
+        self.assertFalse(reporter.is_alive())
+
+        lines = output.getvalue().splitlines()
+        self.assertIn("WARNING: Service \"broken\" failed to start.", lines)
+        self.assertTrue(any(line.startswith("WARNING: Service \"slow\" isn't ready after") for line in lines))
+        self.assertTrue(any(line.startswith("Started 1/3 service(s)") for line in lines))
+        self.assertTrue(any(line.startswith("Service \"slow\" is ready after") for line in lines))
+        self.assertTrue(self.service_manager.services["slow"].is_ready)
+
+    def test_stop_ends_the_reporter(self):
+        self.service_manager.services["slow"].start_time = 5
+        with redirect_stdout(io.StringIO()):
+            reporter = self.service_manager.start_services()
+            self.service_manager.stop_services()
+            reporter.join(1)
+        self.assertFalse(reporter.is_alive())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+import threading
+import time
+import unittest
+
+from slm_batcher import SLMBatcher
+
+class RecordingGenerator:
+    """
+    A stand-in for SLMCommandProcessor#generate_api_commands that records every call, and raises
+      error if it's set.
+    """
+
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __call__(self, texts, max_length):
+        with self._lock:
+            self.calls.append((list(texts), max_length))
+        if(self.error is not None):
+            raise self.error
+        return [f"{text}:{max_length}" for text in texts]
+
+class TestSLMBatcher(unittest.TestCase):
+    def make_batcher(self, generator, **kwargs):
+        batcher = SLMBatcher(generator, **kwargs)
+        self.addCleanup(batcher.stop)
+        return batcher
+
+    def test_concurrent_requests_share_a_call_per_max_length(self):
+        generator = RecordingGenerator()
+        batcher = self.make_batcher(generator, batch_window=0.2, max_batch_size=8)
+
+        futures = [
+            batcher.submit("lock the door", 50),
+            batcher.submit("open the gate", 50),
+            batcher.submit("lock the door", 50),
+            batcher.submit("lock the door", 20)
+        ]
+
+        self.assertEqual(
+            [future.result(timeout=5) for future in futures],
+            ["lock the door:50", "open the gate:50", "lock the door:50", "lock the door:20"]
+        )
+        # Identical commands are only generated once
+        self.assertEqual(sorted(generator.calls), [(["lock the door"], 20), (["lock the door", "open the gate"], 50)])
+
+    def test_a_lone_request_is_flushed_when_the_window_closes(self):
+        generator = RecordingGenerator()
+        batcher = self.make_batcher(generator, batch_window=0.05, max_batch_size=8)
+
+        started = time.monotonic()
+        self.assertEqual(batcher.submit("lock the door").result(timeout=5), "lock the door:50")
+        self.assertGreaterEqual(time.monotonic() - started, 0.05)
+        self.assertEqual(generator.calls, [(["lock the door"], 50)])
+
+    def test_a_full_batch_is_flushed_without_waiting_for_the_window(self):
+        generator = RecordingGenerator()
+        batcher = self.make_batcher(generator, batch_window=10, max_batch_size=3)
+
+        futures = [batcher.submit(f"command {index}") for index in range(4)]
+
+        self.assertEqual([future.result(timeout=5) for future in futures[:3]], ["command 0:50", "command 1:50", "command 2:50"])
+        self.assertEqual(generator.calls, [(["command 0", "command 1", "command 2"], 50)])
+        # The fourth starts the next batch, which waits for its window
+        self.assertFalse(futures[3].done())
+
+    def test_errors_reach_every_future_in_the_batch(self):
+        error = RuntimeError("out of memory")
+        batcher = self.make_batcher(RecordingGenerator(error), batch_window=0.2, max_batch_size=8)
+
+        futures = [batcher.submit("lock the door"), batcher.submit("open the gate")]
+
+        for future in futures:
+            self.assertIs(future.exception(timeout=5), error)
+
+    def test_stop_generates_queued_requests_then_rejects_new_ones(self):
+        generator = RecordingGenerator()
+        batcher = SLMBatcher(generator, batch_window=10, max_batch_size=8)
+
+        future = batcher.submit("lock the door")
+        batcher.stop()
+
+        self.assertEqual(future.result(timeout=5), "lock the door:50")
+        with self.assertRaises(RuntimeError):
+            batcher.submit("open the gate").result(timeout=5)
+
+if __name__ == "__main__":
+    unittest.main()
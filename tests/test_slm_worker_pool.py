@@ -0,0 +1,53 @@
+import time
+import unittest
+
+from slm_worker_pool import SLMWorkerPool
+
+def _crash(index, requests, responses, processor_args):
+    # A worker that dies before it loads, like one killed by the OOM killer
+    raise SystemExit(3)
+
+class CrashingWorkerPool(SLMWorkerPool):
+    def _start_worker(self, index):
+        process = self._context.Process(target=_crash, args=(index, None, None, None), daemon=True)
+        process.start()
+        self._workers[index] = {"process": process, "requests": self._context.Queue(), "started_at": time.monotonic()}
+
+class TestSLMWorkerPool(unittest.TestCase):
+    def test_workers_that_cant_load_fail_requests(self):
+        # The model can't load here or with a missing model, either way every worker reports it
+        pool = SLMWorkerPool(num_workers=2, model_name="does-not-exist/missing-model")
+        try:
+            self.assertFalse(pool.wait_until_ready(timeout=120))
+            self.assertEqual(pool._failed_workers, {0, 1})
+            self.assertIsNotNone(pool.load_error)
+
+            with self.assertRaisesRegex(RuntimeError, "No SLM worker could load the model"):
+                pool.submit("generate_api_command", "turn on the lamp").result(timeout=5)
+            self.assertIsNone(pool.generate_api_command("turn on the lamp"))
+
+            # Broadcasts to workers that have exited would pile up in their queues
+            pool.set_entity_constraints(["light.lamp"])
+            self.assertEqual(pool._broadcast_state["set_entity_constraints"], (["light.lamp"],))
+        finally:
+            pool.stop()
+
+    def test_crash_looping_worker_is_given_up_on(self):
+        pool = CrashingWorkerPool(num_workers=1, max_attempts=2, max_restarts=2, restart_backoff=0.05)
+        try:
+            future = pool.submit("generate_api_command", "turn on the lamp")
+            with self.assertRaises(RuntimeError):
+                future.result(timeout=30)
+
+            self.assertFalse(pool.wait_until_ready(timeout=30))
+            self.assertEqual(pool._failed_workers, {0})
+            self.assertEqual(pool._restarts, [2])
+            self.assertIn("kept exiting", pool.load_error)
+
+            with self.assertRaisesRegex(RuntimeError, "No SLM worker could load the model"):
+                pool.submit("encode", ["lamp"]).result(timeout=5)
+        finally:
+            pool.stop()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+from unittest import mock
+
+from ttl_cache import TTLCache
+from slm_command_processor import SLMCommandProcessor
+
+class TestTTLCache(unittest.TestCase):
+    def test_entries_expire_after_the_ttl(self):
+        cache = TTLCache(max_size=4, ttl=10)
+        with mock.patch("ttl_cache.time.monotonic", return_value=100.0):
+            cache.put("lock the door", "lock.front_door")
+        with mock.patch("ttl_cache.time.monotonic", return_value=110.0):
+            self.assertEqual(cache.get("lock the door"), "lock.front_door")
+        with mock.patch("ttl_cache.time.monotonic", return_value=110.5):
+            self.assertIsNone(cache.get("lock the door"))
+        self.assertEqual(len(cache), 0)
+
+    def test_no_ttl_never_expires(self):
+        cache = TTLCache(max_size=4, ttl=None)
+        with mock.patch("ttl_cache.time.monotonic", return_value=0.0):
+            cache.put("key", "value")
+        with mock.patch("ttl_cache.time.monotonic", return_value=1e9):
+            self.assertEqual(cache.get("key"), "value")
+
+    def test_least_recently_used_is_evicted(self):
+        cache = TTLCache(max_size=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        # Reading "a" makes "b" the least recently used
+        cache.get("a")
+        cache.put("c", 3)
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_zero_size_caches_nothing(self):
+        cache = TTLCache(max_size=0)
+        cache.put("a", 1)
+
+        self.assertEqual(len(cache), 0)
+        self.assertIsNone(cache.get("a"))
+
+    def test_stats(self):
+        cache = TTLCache(max_size=1)
+        cache.put("a", 1)
+        cache.get("a")
+        cache.get("missing")
+        cache.put("b", 2)
+        cache.clear()
+
+        self.assertEqual(cache.stats(), {"size": 0, "max_size": 1, "hits": 1, "misses": 1, "evictions": 1, "hit_rate": 0.5})
+        self.assertEqual(TTLCache().stats()["hit_rate"], 0.0)
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.processor = SLMCommandProcessor(load_async=False, max_batch_size=1)
+        self.processor.is_ready = True
+
+    def test_results_are_cached_by_normalized_command(self):
+        generated = []
+        self.processor.generate_api_commands = lambda texts, max_length: generated.extend(texts) or ["lock.front_door"]
+
+        self.assertEqual(self.processor.generate_api_command("Lock the front door"), "lock.front_door")
+        self.assertEqual(self.processor.generate_api_command("LOCK the  front door"), "lock.front_door")
+        self.assertEqual(generated, ["Lock the front door"])
+
+    def test_result_generated_across_an_invalidation_isnt_cached(self):
+        def generate(texts, max_length):
+            # The entities change while the command is being generated
+            self.processor.invalidate_cache()
+            return ["lock.removed_door"]
+        self.processor.generate_api_commands = generate
+
+        self.assertEqual(self.processor.generate_api_command("lock the door"), "lock.removed_door")
+        self.assertEqual(len(self.processor.cache), 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+import threading
+import time
+from collections import OrderedDict
+
+class TTLCache:
+    """
+    A bounded, thread-safe cache with least-recently-used eviction and a time-to-live on each
+      entry. Entries older than ttl seconds are treated as missing and dropped when read.
+    Hit and miss counters are kept so callers can report how useful the cache is.
+    """
+
+    def __init__(self, max_size=256, ttl=300.0):
+        """
+        Parameters:
+        max_size (int): The maximum number of entries held before the least recently used is evicted
+        ttl (float): Seconds an entry stays valid, None for entries that never expire
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # key -> (value, stored_at), ordered from least to most recently used
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """
+        Get an entry from the cache, marking it as recently used.
+
+        Parameters:
+        key (hashable): The entry's key
+        default (object): Returned when the key is missing or expired
+
+        Returns:
+        object: The cached value, or default
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if(entry is None):
+                self.misses += 1
+                return default
+
+            value, stored_at = entry
+            if(self.ttl is not None and time.monotonic() - stored_at > self.ttl):
+                del self._entries[key]
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """
+        Store an entry in the cache, evicting the least recently used entries if it is full.
+
+        Parameters:
+        key (hashable): The entry's key
+        value (object): The value to be cached
+
+        Returns:
+        void
+        """
+        if(self.max_size <= 0):
+            return
+
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        """
+        Remove an entry from the cache.
+
+        Returns:
+        object: The removed value, or default if it wasn't cached
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            return default if entry is None else entry[0]
+
+    def clear(self):
+        """
+        Remove every entry from the cache, the counters are kept.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Get the cache's counters.
+
+        Returns:
+        dict: size, max_size, hits, misses, evictions and hit_rate
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups > 0 else 0.0
+            }